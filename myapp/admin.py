@@ -1,6 +1,71 @@
-import os
+import threading
+import weakref
+from django.conf import settings
 from django.contrib import admin
-from .models import MODELS_MAP
+from django.core.urlresolvers import RegexURLResolver, clear_url_caches
+from .models import MODELS_MAP, schema_reloaded
+from .counts import CountedQuerySet
 
-for _, model in MODELS_MAP.items():
-    admin.site.register(model)
+# the admin needs every model class, which builds the lazy registry in
+# full; that happens on the first admin request, not at boot (see
+# AdminResolver), workers that must never build them all can turn it off
+ADMIN_REGISTER_MODELS = getattr(settings, "ADMIN_REGISTER_MODELS", True)
+
+class EntityAdmin(admin.ModelAdmin):
+    # the changelist counts the unfiltered table on every page, the row
+    # counter answers that instead of a COUNT(*)
+    def get_queryset(self, request):
+        return super(EntityAdmin, self).get_queryset(request)._clone(klass=CountedQuerySet)
+
+def register_models():
+    if not ADMIN_REGISTER_MODELS:
+        return
+    for _, model in MODELS_MAP.items():
+        if model not in admin.site._registry:
+            admin.site.register(model, EntityAdmin)
+
+class AdminResolver(RegexURLResolver):
+    # stands in for include(admin.site.urls), which needs the models
+    # registered when the urlconf is imported; the models are registered
+    # and the admin urls built when a request first gets to the admin
+    instances = weakref.WeakSet()
+
+    def __init__(self, regex):
+        super(AdminResolver, self).__init__(
+            regex, None, app_name=admin.site.app_name, namespace=admin.site.name)
+        self._patterns = None
+        self._lock = threading.Lock()
+        AdminResolver.instances.add(self)
+
+    @property
+    def url_patterns(self):
+        patterns = self._patterns
+        if patterns is None:
+            with self._lock:
+                if self._patterns is None:
+                    register_models()
+                    self._patterns = admin.site.get_urls()
+                patterns = self._patterns
+        return patterns
+
+    # the next admin request builds the urls again, the reverse
+    # lookups of the old ones go with them
+    def reset(self):
+        with self._lock:
+            self._patterns = None
+            self._reverse_dict = {}
+            self._namespace_dict = {}
+            self._app_dict = {}
+            self._callback_strs = set()
+            self._populated = False
+
+def refresh_admin(sender, unloaded, loaded, **kwargs):
+    for model in unloaded:
+        if model in admin.site._registry:
+            admin.site.unregister(model)
+    # the loaded ones are registered when the admin urls are built again
+    for resolver in list(AdminResolver.instances):
+        resolver.reset()
+    clear_url_caches()
+
+schema_reloaded.connect(refresh_admin)
@@ -0,0 +1,223 @@
+from django.conf import settings
+from django.contrib.staticfiles.storage import CachedStaticFilesStorage, CachedFilesMixin
+from django.core.files.base import ContentFile
+from django.utils.six.moves.urllib.parse import urlsplit
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST_NAME = "staticfiles.json"
+# files that do not shrink by compression are left alone, images mostly
+COMPRESS_EXTENSIONS = getattr(settings, "STATIC_COMPRESS_EXTENSIONS",
+    (".js", ".css", ".html", ".svg", ".json", ".txt", ".map", ".xml", ".ico"))
+# a compressed variant is only kept when it is this much smaller
+COMPRESS_MIN_RATIO = 0.95
+# content-hashed names never change, the others may on the next deploy
+STATIC_IMMUTABLE_MAX_AGE = getattr(settings, "STATIC_IMMUTABLE_MAX_AGE", 365 * 24 * 3600)
+STATIC_MAX_AGE = getattr(settings, "STATIC_MAX_AGE", 60)
+# Content-Encoding -> file suffix, in the order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+TEXT_TYPES = ("application/javascript", "application/json", "application/xml")
+
+def gzip_bytes(data):
+    buf = io.BytesIO()
+    # mtime 0 so the same input always gives the same bytes
+    with gzip.GzipFile(filename="", mode="wb", fileobj=buf, compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+def compressors():
+    found = [("gzip", ".gz", gzip_bytes)]
+    if brotli is not None:
+        found.insert(0, ("br", ".br", lambda data: brotli.compress(data, quality=11)))
+    return found
+
+class CompressedStaticFilesStorage(CachedStaticFilesStorage):
+    # collectstatic writes content-hashed copies of every file as
+    # CachedStaticFilesStorage does, then a manifest of the hashed names
+    # and .gz (and .br when brotli is installed) variants next to them,
+    # so workers neither hash nor compress anything at runtime
+    def __init__(self, *args, **kwargs):
+        super(CompressedStaticFilesStorage, self).__init__(*args, **kwargs)
+        self._hashed_files = None
+
+    @property
+    def hashed_files(self):
+        if self._hashed_files is None:
+            self._hashed_files = load_manifest(self.location)
+        return self._hashed_files
+
+    def url(self, name, force=False):
+        if force:
+            # post_process() rewriting the urls in css files
+            return super(CompressedStaticFilesStorage, self).url(name, force)
+        # the dev server serves the original files only, and without a
+        # manifest (no collectstatic yet) names are not hashed either
+        if not settings.DEBUG:
+            name = self.hashed_files.get(name, name)
+        return super(CachedFilesMixin, self).url(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        hashed_files = {}
+        for name, hashed_name, processed in super(
+                CompressedStaticFilesStorage, self).post_process(paths, dry_run, **options):
+            yield name, hashed_name, processed
+            if hashed_name is not None:
+                hashed_files[name.replace("\\", "/")] = hashed_name
+        for name, hashed_name in sorted(hashed_files.items()):
+            for path in (name, hashed_name):
+                if path.endswith(COMPRESS_EXTENSIONS):
+                    self.compress(path)
+        self.save_manifest(hashed_files)
+        self._hashed_files = hashed_files
+
+    def compress(self, name):
+        with self.open(name) as f:
+            data = f.read()
+        for encoding, suffix, compress in compressors():
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            compressed = compress(data)
+            if len(compressed) < len(data) * COMPRESS_MIN_RATIO:
+                self._save(name + suffix, ContentFile(compressed))
+
+    def save_manifest(self, hashed_files):
+        if self.exists(MANIFEST_NAME):
+            self.delete(MANIFEST_NAME)
+        content = json.dumps(hashed_files, indent=1, sort_keys=True)
+        self._save(MANIFEST_NAME, ContentFile(content.encode("utf-8")))
+
+# original name -> hashed name, empty without a collectstatic run
+def load_manifest(root):
+    try:
+        with open(os.path.join(root, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def content_type(name):
+    guessed, _ = mimetypes.guess_type(name)
+    guessed = guessed or "application/octet-stream"
+    if guessed.startswith("text/") or guessed in TEXT_TYPES:
+        guessed += "; charset=utf-8"
+    return guessed
+
+# the encodings of Accept-Encoding a client takes, q=0 ones left out
+def accepted_encodings(header):
+    accepted = set()
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if token and q > 0:
+            accepted.add(token.strip().lower())
+    return accepted
+
+class Asset(object):
+    # one file with its representations: encoding -> (bytes, strong etag)
+    def __init__(self, name, data, immutable):
+        self.content_type = content_type(name)
+        if immutable:
+            self.cache_control = "public, max-age={}, immutable".format(STATIC_IMMUTABLE_MAX_AGE)
+        else:
+            self.cache_control = "public, max-age={}".format(STATIC_MAX_AGE)
+        self.digest = hashlib.md5(data).hexdigest()
+        self.variants = {"identity": (data, '"{}"'.format(self.digest))}
+
+    def add_variant(self, encoding, data):
+        # every representation has its own strong etag
+        self.variants[encoding] = (data, '"{}-{}"'.format(self.digest, encoding))
+
+    def negotiate(self, accept_encoding):
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, _ in ENCODINGS:
+            if encoding in self.variants and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+class StaticIndex(object):
+    # every file under STATIC_ROOT read into memory once, at boot; the
+    # precompressed .gz/.br files become variants of the file they belong to
+    def __init__(self, root):
+        self.root = root
+        self.assets = {}
+        if root and os.path.isdir(root):
+            self.load()
+
+    def load(self):
+        hashed_names = set(load_manifest(self.root).values())
+        paths = []
+        for directory, _, files in os.walk(self.root):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                paths.append(os.path.relpath(path, self.root).replace(os.sep, "/"))
+        names = set(paths)
+        for name in sorted(paths):
+            if name == MANIFEST_NAME or any(
+                    name.endswith(suffix) and name[:-len(suffix)] in names
+                    for _, suffix in ENCODINGS):
+                continue
+            asset = Asset(name, self.read(name), name in hashed_names)
+            for encoding, suffix in ENCODINGS:
+                if name + suffix in names:
+                    asset.add_variant(encoding, self.read(name + suffix))
+            self.assets[name] = asset
+
+    def read(self, name):
+        with open(os.path.join(self.root, name), "rb") as f:
+            return f.read()
+
+    def get(self, name):
+        return self.assets.get(name)
+
+class StaticFilesApp(object):
+    # serves STATIC_URL from memory in front of the django application,
+    # anything not in the index goes on to the application
+    def __init__(self, application, root=None, prefix=None):
+        self.application = application
+        self.prefix = urlsplit(prefix or settings.STATIC_URL).path
+        self.index = StaticIndex(root or settings.STATIC_ROOT)
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        asset = None
+        if path.startswith(self.prefix):
+            asset = self.index.get(path[len(self.prefix):])
+        if asset is None:
+            return self.application(environ, start_response)
+        method = environ.get("REQUEST_METHOD", "GET")
+        if method not in ("GET", "HEAD"):
+            start_response("405 Method Not Allowed", [("Allow", "GET, HEAD")])
+            return [b""]
+        encoding = asset.negotiate(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        data, etag = asset.variants[encoding]
+        headers = [
+            ("ETag", etag),
+            ("Cache-Control", asset.cache_control),
+            ("Vary", "Accept-Encoding"),
+        ]
+        if_none_match = environ.get("HTTP_IF_NONE_MATCH", "")
+        if if_none_match.strip() == "*" or etag in [
+                tag.strip() for tag in if_none_match.split(",")]:
+            start_response("304 Not Modified", headers)
+            return [b""]
+        headers.append(("Content-Type", asset.content_type))
+        headers.append(("Content-Length", str(len(data))))
+        if encoding != "identity":
+            headers.append(("Content-Encoding", encoding))
+        start_response("200 OK", headers)
+        return [b"" if method == "HEAD" else data]
@@ -0,0 +1,170 @@
+from django.db import connection, transaction
+from django.core.management.color import no_style
+from .models import ModelsLoader, model_save, model_escape
+from .savers import escape
+from .mixins import ActionMixin
+import contextlib
+import datetime
+import django
+import json
+import platform
+import time
+
+BENCH_SCHEMA = {
+    "benchrow": {
+        "title": "Benchmark rows",
+        "fields": [
+        {"id": "name", "title": "Name", "type": "char"},
+        {"id": "paycheck", "title": "Paycheck", "type": "integer"},
+        {"id": "date_joined", "title": "Date joined", "type": "date"}
+        ]}
+}
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    func(*args, **kwargs)
+    return time.time() - start
+
+def rate(count, seconds):
+    return {
+        "count": count,
+        "seconds": round(seconds, 6),
+        "per_sec": round(count / seconds, 1) if seconds else None}
+
+@contextlib.contextmanager
+def temp_models(schema):
+    # builds the models and their tables, drops both afterwards
+    loader = ModelsLoader(json.dumps(schema))
+    built = [loader.build(name, spec) for name, spec in loader.get_specs().items()]
+    style = no_style()
+    cursor = connection.cursor()
+    for model in built:
+        sql, _ = connection.creation.sql_create_model(model, style)
+        for statement in sql + connection.creation.sql_indexes_for_model(model, style):
+            cursor.execute(statement)
+    try:
+        yield built
+    finally:
+        for model in built:
+            for statement in connection.creation.sql_destroy_model(model, {}, style):
+                cursor.execute(statement)
+            loader.unload(model.__name__)
+
+def make_rows(model, count):
+    day = datetime.date(2014, 1, 1)
+    return [model(
+        name="name <{}> & 'co'".format(i),
+        paycheck=i,
+        date_joined=day) for i in range(count)]
+
+def save_all(objs, save):
+    with transaction.atomic():
+        for obj in objs:
+            save(obj)
+
+# the validation and escaping each save path does before the insert
+def generic_prepare(obj):
+    obj.full_clean()
+    model_escape(obj)
+
+def prepare_all(objs, prepare):
+    for obj in objs:
+        prepare(obj)
+
+def legacy_escape(s):
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("'", "&#39;").replace("\"", "&quot;")
+
+# strings that are worst (or best) cases for escaping
+ESCAPE_CASES = {
+    "all_special": "<>&'\"" * 2000,
+    "no_special": "abcdefghij" * 1000,
+    "mixed": "Tom & Jerry <b>'quoted' \"text\"</b> " * 250,
+    "short": "<a>",
+}
+
+def make_schema(entities):
+    return dict(("benchentity{}".format(i), {
+        "title": "Entity {}".format(i),
+        "fields": [
+        {"id": "name", "title": "Name", "type": "char", "index": True},
+        {"id": "paycheck", "title": "Paycheck", "type": "integer"},
+        {"id": "date_joined", "title": "Date joined", "type": "date"}
+        ]}) for i in range(entities))
+
+def bench_loader(entities=(1, 100, 1000), **options):
+    results = {}
+    for count in entities:
+        loader = ModelsLoader(json.dumps(make_schema(count)))
+        start = time.time()
+        specs = loader.get_specs()
+        parsed = time.time()
+        for name, spec in specs.items():
+            loader.build(name, spec)
+        built = time.time()
+        for name in specs:
+            loader.unload(name)
+        results[str(count)] = {
+            "specs_seconds": round(parsed - start, 6),
+            "build_seconds": round(built - parsed, 6),
+            "models_per_sec": rate(count, built - start)["per_sec"]}
+    return results
+
+def bench_serialize(sizes=(1000, 10000, 100000), **options):
+    results = {}
+    mixin = ActionMixin()
+    with temp_models(BENCH_SCHEMA) as (model,):
+        inserted = 0
+        for size in sorted(sizes):
+            with transaction.atomic():
+                model.objects.bulk_create(
+                    make_rows(model, size - inserted), batch_size=500)
+            inserted = size
+            data = []
+            seconds = timed(
+                lambda: data.append(mixin.serialize(model, model.objects.all())))
+            result = rate(size, seconds)
+            result["bytes"] = len(data[0])
+            results[str(size)] = result
+    return results
+
+def bench_escape(iterations=200, **options):
+    results = {}
+    for name, s in ESCAPE_CASES.items():
+        results[name] = {
+            "length": len(s),
+            "escape": rate(iterations, timed(
+                lambda: [escape(s) for _ in range(iterations)])),
+            "legacy": rate(iterations, timed(
+                lambda: [legacy_escape(s) for _ in range(iterations)]))}
+    return results
+
+# "prepare" is the part the compiled routine replaces, the full saves
+# add the same insert, stamp and counter queries to both paths
+def bench_save(rows=1000, **options):
+    with temp_models(BENCH_SCHEMA) as (model,):
+        generic_prep = timed(prepare_all, make_rows(model, rows), generic_prepare)
+        compiled_prep = timed(prepare_all, make_rows(model, rows), model.save.routine.prepare)
+        generic = timed(save_all, make_rows(model, rows), model_save)
+        compiled = timed(save_all, make_rows(model, rows), model.save)
+    return {
+        "prepare": {
+            "generic": rate(rows, generic_prep),
+            "compiled": rate(rows, compiled_prep),
+            "speedup": round(generic_prep / compiled_prep, 2) if compiled_prep else None},
+        "generic": rate(rows, generic),
+        "compiled": rate(rows, compiled),
+        "speedup": round(generic / compiled, 2) if compiled else None}
+
+BENCHMARKS = {
+    "loader": bench_loader,
+    "serialize": bench_serialize,
+    "escape": bench_escape,
+    "save": bench_save,
+}
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "time": datetime.datetime.utcnow().isoformat()}
@@ -0,0 +1,170 @@
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db import models, router, transaction, IntegrityError
+from django.db.models import F
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+# response bodies and cached versions live in this alias of CACHES, so
+# workers sharing it (memcached, redis...) share them; without such an
+# alias every worker has a bounded local-memory cache of its own
+ENTITY_CACHE_BACKEND = getattr(settings, "ENTITY_CACHE_BACKEND", "myapp")
+RESPONSE_CACHE_SIZE = getattr(settings, "RESPONSE_CACHE_SIZE", 256)
+RESPONSE_CACHE_SECONDS = getattr(settings, "RESPONSE_CACHE_SECONDS", 300)
+# a reader that got the version just before a write committed keeps
+# the old one at most this long
+VERSION_CACHE_SECONDS = getattr(settings, "VERSION_CACHE_SECONDS", 5)
+PAGE_CACHE_SIZE = getattr(settings, "PAGE_CACHE_SIZE", 64)
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if ENTITY_CACHE_BACKEND in settings.CACHES:
+            _backend = get_cache(ENTITY_CACHE_BACKEND)
+        else:
+            _backend = get_cache(
+                "django.core.cache.backends.locmem.LocMemCache",
+                LOCATION="myapp-entities", OPTIONS={"MAX_ENTRIES": RESPONSE_CACHE_SIZE})
+    return _backend
+
+class EntityVersion(models.Model):
+    # the counters themselves live in the primary database, a bump made
+    # in a write's transaction becomes visible together with the rows it
+    # stamps; the cache only keeps copies for a few seconds
+    entity = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField()
+
+    class Meta:
+        app_label = "myapp"
+        db_table = "myapp_entity_version"
+
+def version_key(entity, using):
+    return "myapp:version:{}:{}".format(using, entity)
+
+def _seed():
+    # counters start from the clock, so versions handed out by an
+    # older counter are never handed out again
+    return int(time.time() * 1000)
+
+def _primary():
+    return router.db_for_write(EntityVersion)
+
+# bumps always go to the primary
+def _versions(using=None):
+    return EntityVersion.objects.using(using or _primary())
+
+def _create(entity):
+    try:
+        with transaction.atomic(using=_primary()):
+            _versions().create(entity=entity, version=_seed())
+    except IntegrityError:
+        # another worker made it first
+        pass
+
+def _read_version(entity, using):
+    try:
+        return _versions(using).values_list("version", flat=True).get(entity=entity)
+    except EntityVersion.DoesNotExist:
+        if using != _primary():
+            # not replicated yet, neither are rows of any version
+            return 0
+        _create(entity)
+        return _versions(using).values_list("version", flat=True).get(entity=entity)
+
+# the version of the rows in the database using reads, a replica's
+# version row arrives in the same transactions as the rows it stamps;
+# unchanged polls are answered from the cached copy, the database is
+# asked once per VERSION_CACHE_SECONDS or after a bump
+def get_version(entity, using=None):
+    using = using or _primary()
+    backend = get_backend()
+    key = version_key(entity, using)
+    version = backend.get(key)
+    if version is None:
+        version = _read_version(entity, using)
+        backend.set(key, version, VERSION_CACHE_SECONDS)
+    return version
+
+# inside a write's transaction the row stays locked until it commits,
+# so concurrent writers of an entity get increasing versions in order
+def bump_version(entity):
+    with transaction.atomic(using=_primary(), savepoint=False):
+        if not _versions().filter(entity=entity).update(version=F("version") + 1):
+            _create(entity)
+            _versions().filter(entity=entity).update(version=F("version") + 1)
+        version = _versions().values_list("version", flat=True).get(entity=entity)
+    # not set to the new one, which may not be committed yet; copies
+    # of the replicas expire, they get the bump when they replicate it
+    get_backend().delete(version_key(entity, _primary()))
+    return version
+
+class LRUCache:
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return None
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class ResponseCache:
+    # serialized list responses in the entity cache, keyed by
+    # response_key(); a new version gives new keys, old ones expire
+    def get(self, key):
+        return get_backend().get("myapp:response:{}".format(key))
+
+    def set(self, key, value):
+        get_backend().set("myapp:response:{}".format(key), value, RESPONSE_CACHE_SECONDS)
+
+    def clear(self):
+        get_backend().clear()
+
+response_cache = ResponseCache()
+
+# rendered html pages of this worker, keyed by template, schema and url
+page_cache = LRUCache(PAGE_CACHE_SIZE)
+
+def page_key(template_name, schema, url):
+    raw = "{}:{}:{}".format(template_name, schema, url)
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+# headers replayed with a cached body
+CACHED_HEADERS = ("Content-Type", "X-Next-Cursor", "X-Sync-Token", "X-Total-Count",
+    "X-Deleted-Ids")
+
+# path tells apart the endpoints of an entity (list, aggregate), variant
+# the representations negotiated from request headers
+def response_key(entity, version, path, params, variant=""):
+    query = "&".join(
+        "{}={}".format(k, v) for k in sorted(params) for v in params.getlist(k))
+    raw = "{}:{}:{}:{}:{}".format(entity, version, path, query, variant)
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in tags or "W/" + etag in tags
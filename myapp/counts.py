@@ -0,0 +1,118 @@
+from django.db import models, connections, router, transaction, IntegrityError, DatabaseError
+from django.db.models import F
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_save, post_delete
+from .stamps import has_stamp
+
+class EntityCount(models.Model):
+    # exact row count of one entity, kept by the save and delete paths
+    # in the transaction of the write, so it never needs a COUNT(*)
+    entity = models.CharField(max_length=100, primary_key=True)
+    rows = models.BigIntegerField(default=0)
+
+    class Meta:
+        app_label = "myapp"
+        db_table = "myapp_entity_count"
+
+# generated models only, EntityCount and other apps are not counted
+def is_counted(model):
+    return model is not EntityCount and has_stamp(model)
+
+def entity_name(model):
+    return model.__name__.lower()
+
+# the first use of a counter counts the table once; inside the write's
+# transaction that count already includes the new rows
+def init_count(model, using):
+    try:
+        with transaction.atomic(using=using):
+            EntityCount.objects.using(using).create(
+                entity=entity_name(model), rows=model._default_manager.using(using).count())
+        return True
+    except IntegrityError:
+        # another transaction made it first
+        return False
+
+def add_rows(model, n, using=None):
+    using = using or router.db_for_write(model)
+    counters = EntityCount.objects.using(using).filter(entity=entity_name(model))
+    if counters.update(rows=F("rows") + n):
+        return
+    if not init_count(model, using):
+        counters.update(rows=F("rows") + n)
+
+def exact_count(model, using=None):
+    using = using or router.db_for_read(EntityCount) or "default"
+    try:
+        return EntityCount.objects.using(using).get(entity=entity_name(model)).rows
+    except EntityCount.DoesNotExist:
+        # counters are only ever created on the primary
+        using = router.db_for_write(model)
+        init_count(model, using)
+        return EntityCount.objects.using(using).get(entity=entity_name(model)).rows
+
+# entity -> exact row count in one query; registry maps entities to
+# models, only those without a counter yet are looked up and counted
+def exact_counts(registry, entities, using=None):
+    using = using or router.db_for_read(EntityCount) or "default"
+    counts = dict(EntityCount.objects.using(using)
+        .filter(entity__in=entities).values_list("entity", "rows"))
+    for entity in entities:
+        if entity not in counts:
+            try:
+                counts[entity] = exact_count(registry[entity])
+            except DatabaseError:
+                # no table yet, syncdb has not run since it was added
+                pass
+    return counts
+
+# the planner's row estimate from the last ANALYZE, postgresql only;
+# tables without one are left out
+def estimated_counts(entities, using="default"):
+    connection = connections[using]
+    if connection.vendor != "postgresql" or not entities:
+        return {}
+    # generated models keep django's default table names
+    tables = dict(("{}_{}".format(EntityCount._meta.app_label, entity), entity)
+        for entity in entities)
+    cursor = connection.cursor()
+    cursor.execute(
+        "SELECT relname, reltuples::bigint FROM pg_class "
+        "WHERE relkind = 'r' AND relname IN ({})".format(", ".join(["%s"] * len(tables))),
+        list(tables))
+    # tables never analyzed report 0 or -1
+    return dict((tables[table], rows) for table, rows in cursor.fetchall() if rows > 0)
+
+# estimates where the planner has one, exact counts for the rest
+def approximate_counts(registry):
+    entities = list(registry)
+    counts = estimated_counts(entities)
+    missing = [entity for entity in entities if entity not in counts]
+    if missing:
+        counts.update(exact_counts(registry, missing))
+    return counts
+
+class CountedQuerySet(QuerySet):
+    # count() of the whole, unfiltered table comes from the counter
+    def count(self):
+        query = self.query
+        if (self._result_cache is None and not query.where and not query.having and
+            not query.distinct and not query.low_mark and query.high_mark is None and
+            is_counted(self.model)):
+            return exact_count(self.model, self.db)
+        return super(CountedQuerySet, self).count()
+
+def count_saved(sender, instance, created, raw=False, using=None, **kwargs):
+    if created and not raw and is_counted(sender):
+        add_rows(sender, 1, using)
+
+# runs inside the delete's transaction
+def count_deleted(sender, instance, using=None, **kwargs):
+    if is_counted(sender):
+        add_rows(sender, -1, using)
+
+# connected per generated model (see ModelsLoader.build()), a receiver
+# for every sender would turn off fast deletes of the other apps
+def connect_counts(model):
+    post_save.connect(count_saved, sender=model)
+    post_delete.connect(count_deleted, sender=model)
@@ -0,0 +1,92 @@
+from django.conf import settings
+import csv
+import io
+import json
+import zlib
+from .models import get_serializer
+
+EXPORT_CHUNK_SIZE = getattr(settings, "EXPORT_CHUNK_SIZE", 5000)
+# format -> (content type, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+# walks the queryset in primary key order as values_list() tuples,
+# one short query per chunk, so neither the worker nor the database
+# cursor holds the whole table and no transaction stays open
+def iter_chunks(queryset, chunk_size, serializer=None):
+    serializer = serializer or get_serializer(queryset.model)
+    queryset = serializer.values(queryset.order_by("pk"))
+    last_pk = None
+    while True:
+        page = queryset
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        chunk = list(page[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1][serializer.pk_index]
+
+# a header line of field names, then one line per row
+def csv_lines(serializer, chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(serializer.names)
+    for chunk in chunks:
+        writer.writerows(serializer.native_rows(chunk))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+# the header document on the first line, then one array per row
+# in the order of its fields
+def ndjson_lines(serializer, chunks, **kwargs):
+    head = {"fields": serializer.fields}
+    head.update(kwargs)
+    yield json.dumps(head) + "\n"
+    for chunk in chunks:
+        yield "".join(
+            json.dumps(row) + "\n" for row in serializer.native_rows(chunk))
+
+def export_lines(model, chunks, fmt, serializer=None, **kwargs):
+    serializer = serializer or get_serializer(model)
+    if fmt == "csv":
+        return csv_lines(serializer, chunks)
+    return ndjson_lines(serializer, chunks, **kwargs)
+
+# utf-8 bytes, gzipped as they go when compress is set
+def encode_stream(parts, compress=False):
+    if not compress:
+        for part in parts:
+            yield part.encode("utf-8")
+        return
+    # wbits 31 gives a gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for part in parts:
+        data = compressor.compress(part.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+class RowCounter:
+    # passes chunks through and counts their rows
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.rows = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.rows += len(chunk)
+            yield chunk
+
+def export(queryset, f, fmt="csv", compress=False, chunk_size=None):
+    chunks = RowCounter(iter_chunks(queryset, chunk_size or EXPORT_CHUNK_SIZE))
+    for data in encode_stream(
+            export_lines(queryset.model, chunks, fmt), compress):
+        f.write(data)
+    return chunks.rows
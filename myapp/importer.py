@@ -0,0 +1,216 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import connection, transaction, IntegrityError
+import csv
+import gzip
+import io
+import json
+import time
+from .savers import SaveRoutine
+from .stamps import visible_fields, stamp_objects
+from .counts import add_rows
+
+IMPORT_BATCH_SIZE = getattr(settings, "BULK_BATCH_SIZE", 500)
+# rows written per transaction, and so the most rows held in memory
+IMPORT_COMMIT_ROWS = getattr(settings, "IMPORT_COMMIT_ROWS", 10000)
+IMPORT_PROGRESS_ROWS = getattr(settings, "IMPORT_PROGRESS_ROWS", 10000)
+FORMATS = ("csv", "ndjson")
+
+def guess_format(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    return None
+
+# read line by line, .gz files are decompressed on the fly
+def open_text(path):
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(
+            gzip.open(path, "rb"), encoding="utf-8-sig", newline="")
+    return open(path, encoding="utf-8-sig", newline="")
+
+class Importer:
+    # streams rows from a csv or ndjson file into a model: every row is
+    # cleaned and escaped like model_save() does it, rows are written
+    # with bulk_create(), one transaction per commit_rows rows
+    def __init__(self, model, batch_size=None, commit_rows=None,
+            rejects_path=None, progress=None, progress_rows=None):
+        self.model = model
+        self.routine = SaveRoutine(model)
+        self.batch_size = batch_size or IMPORT_BATCH_SIZE
+        self.commit_rows = commit_rows or IMPORT_COMMIT_ROWS
+        self.rejects_path = rejects_path
+        self.progress = progress
+        self.progress_rows = progress_rows or IMPORT_PROGRESS_ROWS
+        self.columns = self._get_columns()
+        self.unknown_columns = []
+        self.explicit_pk = False
+        self.stats = {"rows": 0, "imported": 0, "rejected": 0}
+        self._rejects = None
+        self._start = None
+
+    # file column -> attname, by the field id or title from models.json
+    def _get_columns(self):
+        columns = {}
+        for field in visible_fields(self.model):
+            columns[str(field.verbose_name).strip().lower()] = field.attname
+        for field in visible_fields(self.model):
+            columns[field.name.lower()] = field.attname
+        return columns
+
+    def map_header(self, header):
+        attnames = [self.columns.get(str(name).strip().lower()) for name in header]
+        for name, attname in zip(header, attnames):
+            if attname is None and name not in self.unknown_columns:
+                self.unknown_columns.append(name)
+        return attnames
+
+    # both readers yield (line number, raw row, attname -> value or None)
+    def read_csv(self, f):
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        attnames = self.map_header(header)
+        for row in reader:
+            if not row:
+                continue
+            raw = dict(zip(header, row))
+            if len(row) != len(header):
+                yield reader.line_num, raw, None
+                continue
+            yield reader.line_num, raw, dict(
+                (attname, value) for attname, value in zip(attnames, row)
+                if attname is not None)
+
+    # objects keyed by column, or a header document with "fields" (as
+    # the ndjson list format writes it) followed by arrays in that order
+    def read_ndjson(self, f):
+        attnames = None
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_num, line, None
+                continue
+            if isinstance(row, dict) and isinstance(row.get("fields"), list):
+                attnames = self.map_header(
+                    [field[0] if isinstance(field, list) else field
+                        for field in row["fields"]])
+                continue
+            if isinstance(row, list) and attnames is not None:
+                if len(row) != len(attnames):
+                    yield line_num, row, None
+                    continue
+                yield line_num, row, dict(
+                    (attname, value) for attname, value in zip(attnames, row)
+                    if attname is not None)
+            elif isinstance(row, dict):
+                values = {}
+                for key, value in row.items():
+                    attname = self.columns.get(key.strip().lower())
+                    if attname is None:
+                        if key not in self.unknown_columns:
+                            self.unknown_columns.append(key)
+                        continue
+                    values[attname] = value
+                yield line_num, row, values
+            else:
+                yield line_num, row, None
+
+    def build(self, values):
+        pk_name = self.model._meta.pk.attname
+        if values.get(pk_name, "") in ("", None):
+            # an empty id column means a new row
+            values.pop(pk_name, None)
+        obj = self.model(**values)
+        self.routine.prepare(obj)
+        return obj
+
+    # one json object per rejected row, the file is only created
+    # when there is something to put there
+    def reject(self, line_num, raw, errors):
+        self.stats["rejected"] += 1
+        if self.rejects_path is None:
+            return
+        if self._rejects is None:
+            self._rejects = open(self.rejects_path, "w")
+        self._rejects.write(json.dumps(
+            {"line": line_num, "row": raw, "errors": errors}) + "\n")
+
+    def write(self, batch):
+        objs = [obj for _, _, obj in batch]
+        try:
+            with transaction.atomic():
+                stamp_objects(self.model, objs)
+                self.model.objects.bulk_create(objs, batch_size=self.batch_size)
+                add_rows(self.model, len(batch))
+            self.stats["imported"] += len(batch)
+        except IntegrityError:
+            # a row clashed with another one, e.g. a duplicate within the
+            # batch, so this batch is written row by row; the rollback
+            # took the stamp with it, the rows share a new one
+            with transaction.atomic():
+                stamp_objects(self.model, objs)
+                for line_num, raw, obj in batch:
+                    try:
+                        with transaction.atomic():
+                            self.model.objects.bulk_create([obj])
+                            add_rows(self.model, 1)
+                        self.stats["imported"] += 1
+                    except IntegrityError as e:
+                        self.reject(line_num, raw, {"__all__": [str(e)]})
+
+    def report(self):
+        seconds = time.time() - self._start
+        self.stats["seconds"] = round(seconds, 3)
+        self.stats["per_sec"] = round(self.stats["rows"] / seconds, 1) if seconds else None
+        if self.progress is not None:
+            self.progress(self.stats)
+
+    # explicit ids do not move the primary key sequence on postgresql
+    def reset_sequences(self):
+        statements = connection.ops.sequence_reset_sql(no_style(), [self.model])
+        if statements:
+            cursor = connection.cursor()
+            for sql in statements:
+                cursor.execute(sql)
+
+    def run(self, f, fmt):
+        reader = self.read_csv if fmt == "csv" else self.read_ndjson
+        self._start = time.time()
+        batch = []
+        try:
+            for line_num, raw, values in reader(f):
+                self.stats["rows"] += 1
+                if values is None:
+                    self.reject(line_num, raw, {"__all__": ["Malformed row."]})
+                else:
+                    try:
+                        obj = self.build(values)
+                    except (ValidationError, TypeError) as e:
+                        errors = getattr(e, "message_dict", None) or {"__all__": [str(e)]}
+                        self.reject(line_num, raw, errors)
+                    else:
+                        self.explicit_pk = self.explicit_pk or obj.pk is not None
+                        batch.append((line_num, raw, obj))
+                if len(batch) >= self.commit_rows:
+                    self.write(batch)
+                    batch = []
+                if self.stats["rows"] % self.progress_rows == 0:
+                    self.report()
+            if batch:
+                self.write(batch)
+            if self.explicit_pk:
+                self.reset_sequences()
+        finally:
+            if self._rejects is not None:
+                self._rejects.close()
+        self.report()
+        return self.stats
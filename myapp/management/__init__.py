@@ -0,0 +1,5 @@
+from myapp.models import MODELS_MAP
+
+# syncdb, flush and south's migrate import this module before they list
+# the installed models, so every lazily registered model has a class
+MODELS_MAP.materialize_all()
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+import json
+from myapp.benchmarks import BENCHMARKS, environment
+
+def int_list(value):
+    return tuple(int(v) for v in value.split(",") if v)
+
+class Command(BaseCommand):
+    args = "[benchmark ...]"
+    help = ("Times the hot internals of myapp and prints the results as JSON. "
+        "Benchmarks: {}. Run it against a scratch database, e.g. "
+        "DATABASE_URL=sqlite:///bench.db".format(", ".join(sorted(BENCHMARKS))))
+    option_list = BaseCommand.option_list + (
+        make_option("--rows", type="int", dest="rows", default=1000,
+            help="Rows to write for the save benchmark"),
+        make_option("--sizes", dest="sizes", default="1000,10000,100000",
+            help="Comma separated table sizes for the serialize benchmark"),
+        make_option("--entities", dest="entities", default="1,100,1000",
+            help="Comma separated schema sizes for the loader benchmark"),
+        make_option("--iterations", type="int", dest="iterations", default=200,
+            help="Iterations per string for the escape benchmark"),
+        make_option("--output", dest="output", default=None,
+            help="Write the JSON to this file instead of stdout"),
+    )
+
+    def handle(self, *args, **options):
+        names = args or sorted(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError("Unknown benchmark: {}".format(", ".join(unknown)))
+        try:
+            options["sizes"] = int_list(options["sizes"])
+            options["entities"] = int_list(options["entities"])
+        except ValueError:
+            raise CommandError("--sizes and --entities take comma separated numbers")
+        results = {"environment": environment(), "results": {}}
+        for name in names:
+            results["results"][name] = BENCHMARKS[name](**options)
+        data = json.dumps(results, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(data)
+        else:
+            self.stdout.write(data)
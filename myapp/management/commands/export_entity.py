@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from optparse import make_option
+import sys
+import time
+from myapp.models import MODELS_MAP
+from myapp.exporter import export, EXPORT_FORMATS
+
+class Command(BaseCommand):
+    args = "<entity> [file]"
+    help = ("Writes every row of an entity as CSV or NDJSON, to a file or "
+        "stdout. Rows are read in short primary key chunks, so memory stays "
+        "flat and no long transaction is held; --database points it at a "
+        "replica. A file name ending in .gz or --gzip compresses the output.")
+    option_list = BaseCommand.option_list + (
+        make_option("--format", dest="format", default=None,
+            choices=sorted(EXPORT_FORMATS),
+            help="csv or ndjson, guessed from the file name, csv by default"),
+        make_option("--gzip", action="store_true", dest="gzip", default=False,
+            help="Gzip the output"),
+        make_option("--chunk-size", type="int", dest="chunk_size", default=None,
+            help="Rows fetched per query"),
+        make_option("--database", dest="database", default=DEFAULT_DB_ALIAS,
+            help="Database to read from"),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) not in (1, 2):
+            raise CommandError("Usage: export_entity {}".format(self.args))
+        entity, path = args[0], args[1] if len(args) == 2 else None
+        try:
+            model = MODELS_MAP[entity]
+        except KeyError:
+            raise CommandError("Unknown entity: {}".format(entity))
+        if options["chunk_size"] is not None and options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        name = path or ""
+        compress = options["gzip"] or name.endswith(".gz")
+        if name.endswith(".gz"):
+            name = name[:-3]
+        fmt = options["format"] or ("ndjson" if name.endswith((".ndjson", ".jsonl")) else "csv")
+        queryset = model.objects.using(options["database"]).all()
+        start = time.time()
+        if path is None:
+            # bytes, possibly gzipped, so not through self.stdout
+            export(queryset, sys.stdout.buffer, fmt, compress, options["chunk_size"])
+            sys.stdout.buffer.flush()
+            return
+        try:
+            with open(path, "wb") as f:
+                rows = export(queryset, f, fmt, compress, options["chunk_size"])
+        except OSError as e:
+            raise CommandError("Cannot write {}: {}".format(path, e))
+        seconds = time.time() - start
+        self.stdout.write("{} rows written to {} in {:.1f}s, {} rows/sec".format(
+            rows, path, seconds, round(rows / seconds, 1) if seconds else None))
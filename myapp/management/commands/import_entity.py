@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from myapp.models import MODELS_MAP
+from myapp.importer import Importer, FORMATS, guess_format, open_text
+
+class Command(BaseCommand):
+    args = "<entity> <file>"
+    help = ("Streams rows from a CSV or NDJSON file (optionally .gz) into an "
+        "entity. Columns are matched to fields by id or title from models.json, "
+        "rows are cleaned and escaped like a regular save and written with "
+        "bulk_create in batches. Rows that fail go to the rejects file.")
+    option_list = BaseCommand.option_list + (
+        make_option("--format", dest="format", default=None, choices=FORMATS,
+            help="csv or ndjson, guessed from the file name by default"),
+        make_option("--batch-size", type="int", dest="batch_size", default=None,
+            help="Rows per INSERT statement"),
+        make_option("--commit-rows", type="int", dest="commit_rows", default=None,
+            help="Rows per transaction"),
+        make_option("--rejects", dest="rejects", default=None,
+            help="File for rejected rows, <file>.rejects.ndjson by default"),
+        make_option("--progress-rows", type="int", dest="progress_rows", default=None,
+            help="Report progress every this many rows"),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Usage: import_entity {}".format(self.args))
+        entity, path = args
+        try:
+            model = MODELS_MAP[entity]
+        except KeyError:
+            raise CommandError("Unknown entity: {}".format(entity))
+        fmt = options["format"] or guess_format(path)
+        if fmt is None:
+            raise CommandError("Cannot tell the format of {}, use --format".format(path))
+        for name in ("batch_size", "commit_rows", "progress_rows"):
+            if options[name] is not None and options[name] < 1:
+                raise CommandError("--{} must be at least 1".format(name.replace("_", "-")))
+        rejects_path = options["rejects"] or path + ".rejects.ndjson"
+        importer = Importer(
+            model,
+            batch_size=options["batch_size"],
+            commit_rows=options["commit_rows"],
+            rejects_path=rejects_path,
+            progress=self.write_progress,
+            progress_rows=options["progress_rows"])
+        try:
+            with open_text(path) as f:
+                stats = importer.run(f, fmt)
+        except (OSError, UnicodeDecodeError) as e:
+            raise CommandError("Cannot read {}: {}".format(path, e))
+        if importer.unknown_columns:
+            self.stdout.write("Ignored columns: {}".format(
+                ", ".join(str(name) for name in importer.unknown_columns)))
+        if stats["rejected"]:
+            self.stdout.write("Rejected rows written to {}".format(rejects_path))
+
+    def write_progress(self, stats):
+        self.stdout.write(
+            "{rows} rows, {imported} imported, {rejected} rejected, "
+            "{per_sec} rows/sec".format(**stats))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from subprocess import CalledProcessError
+import json
+from myapp.startup import startup_report
+
+class Command(BaseCommand):
+    help = ("Boots fresh interpreters and reports where import time goes: "
+        "settings, django, myapp.models (schema read, specs, model build), "
+        "myapp.admin and the URLconf, with the schema parsed from models.json "
+        "and loaded from the snapshot. Prints JSON, the best of --runs.")
+    option_list = BaseCommand.option_list + (
+        make_option("--runs", type="int", dest="runs", default=3,
+            help="Interpreters to start per mode"),
+        make_option("--mode", dest="mode", default=None,
+            choices=("parsed", "snapshot"),
+            help="Only report this mode: parsed or snapshot"),
+        make_option("--output", dest="output", default=None,
+            help="Write the JSON to this file instead of stdout"),
+    )
+
+    def handle(self, *args, **options):
+        if options["runs"] < 1:
+            raise CommandError("--runs must be at least 1")
+        modes = (options["mode"],) if options["mode"] else ("parsed", "snapshot")
+        try:
+            report = startup_report(options["runs"], modes)
+        except CalledProcessError as e:
+            raise CommandError("Startup run failed: {}".format(e))
+        data = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(data)
+        else:
+            self.stdout.write(data)
@@ -0,0 +1,159 @@
+from django.conf import settings
+from collections import OrderedDict
+import bisect
+import contextlib
+import threading
+import time
+
+METRICS_COUNT_QUERIES = getattr(settings, "METRICS_COUNT_QUERIES", True)
+
+DURATION_BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+BYTES_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 1000, 10000, 100000, 1000000)
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, labels):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # per bucket counts (not cumulative), sum, count
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0]
+            if idx < len(self.buckets):
+                series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labels, key))
+        if extra:
+            pairs.append(extra)
+        return ",".join('{}="{}"'.format(
+            name, value.replace("\\", "\\\\").replace("\"", "\\\""))
+            for name, value in pairs)
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.help_text),
+            "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            series = sorted((key, (list(s[0]), s[1], s[2]))
+                for key, s in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append("{}_bucket{{{}}} {}".format(
+                    self.name, self._format_labels(key, ("le", repr(float(bound)))),
+                    cumulative))
+            lines.append("{}_bucket{{{}}} {}".format(
+                self.name, self._format_labels(key, ("le", "+Inf")), count))
+            labels = self._format_labels(key)
+            lines.append("{}_sum{{{}}} {}".format(self.name, labels, repr(float(total))))
+            lines.append("{}_count{{{}}} {}".format(self.name, labels, count))
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+REQUEST_SECONDS = Histogram(
+    "myapp_request_duration_seconds", "Time spent handling a request.",
+    DURATION_BUCKETS, ("entity", "view", "method"))
+PHASE_SECONDS = Histogram(
+    "myapp_phase_duration_seconds", "Time spent in a phase of a request.",
+    DURATION_BUCKETS, ("entity", "view", "phase"))
+QUERIES = Histogram(
+    "myapp_request_queries", "Database queries run by a request.",
+    COUNT_BUCKETS, ("entity", "view"))
+RESPONSE_BYTES = Histogram(
+    "myapp_response_bytes", "Size of a response body.",
+    BYTES_BUCKETS, ("entity", "view"))
+ROWS = Histogram(
+    "myapp_response_rows", "Rows serialized into a response.",
+    COUNT_BUCKETS, ("entity", "view"))
+
+HISTOGRAMS = (REQUEST_SECONDS, PHASE_SECONDS, QUERIES, RESPONSE_BYTES, ROWS)
+
+class CountingCursor:
+    # counts the statements run through a cursor; unlike the debug
+    # cursor it keeps neither the sql nor the timings
+    def __init__(self, cursor, connection):
+        self.cursor = cursor
+        self.connection = connection
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, *args, **kwargs):
+        self.connection.queries_run += 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.connection.queries_run += 1
+        return self.cursor.executemany(*args, **kwargs)
+
+# statements run on the connection so far; its cursors are wrapped on
+# the first call, connections are per thread so once per thread
+def queries_run(connection):
+    if not hasattr(connection, "queries_run"):
+        connection.queries_run = 0
+        cursor = connection.cursor
+        connection.cursor = lambda: CountingCursor(cursor(), connection)
+    return connection.queries_run
+
+def render_metrics():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return "\n".join(lines) + "\n"
+
+class RequestMetrics:
+    # per request numbers, filled by the views and the middleware
+    def __init__(self):
+        self.start = time.time()
+        self.timings = OrderedDict()
+        self.rows = None
+        self.entity = ""
+        self.view = ""
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.time() - start
+
+    def server_timing(self, total):
+        parts = ["{};dur={:.3f}".format(name, seconds * 1000)
+            for name, seconds in self.timings.items()]
+        parts.append("total;dur={:.3f}".format(total * 1000))
+        return ", ".join(parts)
+
+@contextlib.contextmanager
+def _no_timer():
+    yield
+
+def timer(request, name):
+    metrics = getattr(request, "metrics", None)
+    if metrics is None:
+        return _no_timer()
+    return metrics.timer(name)
+
+def record_rows(request, rows):
+    metrics = getattr(request, "metrics", None)
+    if metrics is not None:
+        metrics.rows = (metrics.rows or 0) + rows
@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.db import connections
+from .models import schema_reloader
+from .routers import get_replicas, pin_primary, unpin
+from .metrics import (RequestMetrics, METRICS_COUNT_QUERIES, REQUEST_SECONDS,
+    PHASE_SECONDS, QUERIES, RESPONSE_BYTES, ROWS, queries_run)
+import time
+
+class SchemaReloadMiddleware(object):
+    # picks up models.json changes, at most once per SCHEMA_RELOAD_INTERVAL
+    def process_request(self, request):
+        schema_reloader.check()
+
+REPLICA_PIN_SECONDS = getattr(settings, "REPLICA_PIN_SECONDS", 5)
+REPLICA_PIN_COOKIE = getattr(settings, "REPLICA_PIN_COOKIE", "myapp_primary")
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE")
+
+class ReplicaPinMiddleware(object):
+    # keeps a request on the primary when it writes, and so do the
+    # requests of the same client for REPLICA_PIN_SECONDS after a write,
+    # so it reads what it has just written while replicas catch up
+    def process_request(self, request):
+        unpin()
+        if not get_replicas():
+            return
+        try:
+            until = float(request.COOKIES.get(REPLICA_PIN_COOKIE, 0))
+        except ValueError:
+            until = 0
+        if request.method not in SAFE_METHODS or until > time.time():
+            pin_primary()
+
+    def process_response(self, request, response):
+        if (get_replicas() and request.method not in SAFE_METHODS and
+            response.status_code < 400):
+            response.set_cookie(
+                REPLICA_PIN_COOKIE, str(time.time() + REPLICA_PIN_SECONDS),
+                max_age=REPLICA_PIN_SECONDS, httponly=True)
+        unpin()
+        return response
+
+class TimingMiddleware(object):
+    # times myapp views, adds a Server-Timing header and feeds
+    # the histograms served at /myapp/metrics
+    def process_request(self, request):
+        request.metrics = RequestMetrics()
+        if METRICS_COUNT_QUERIES:
+            request.metrics.queries_before = self.count_queries()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = getattr(request, "metrics", None)
+        if metrics is not None and view_func.__module__.startswith("myapp."):
+            metrics.view = getattr(view_func, "__name__", "")
+            metrics.entity = view_kwargs.get("entity", "")
+
+    def count_queries(self):
+        return sum(queries_run(connection) for connection in connections.all())
+
+    def process_response(self, request, response):
+        metrics = getattr(request, "metrics", None)
+        if metrics is None or not metrics.view:
+            return response
+        total = time.time() - metrics.start
+        labels = {"entity": metrics.entity, "view": metrics.view}
+        REQUEST_SECONDS.observe(total, method=request.method, **labels)
+        for phase, seconds in metrics.timings.items():
+            PHASE_SECONDS.observe(seconds, phase=phase, **labels)
+        if METRICS_COUNT_QUERIES:
+            QUERIES.observe(
+                self.count_queries() - metrics.queries_before, **labels)
+        if not response.streaming:
+            RESPONSE_BYTES.observe(len(response.content), **labels)
+        if metrics.rows is not None:
+            ROWS.observe(metrics.rows, **labels)
+        response["Server-Timing"] = metrics.server_timing(total)
+        return response
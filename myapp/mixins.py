@@ -1,46 +1,285 @@
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse, Http404
+from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.views.decorators.csrf import requires_csrf_token
+from django.middleware.csrf import get_token
+from django.template import RequestContext
+from django.template.loader import render_to_string
+from django.utils.http import http_date, parse_http_date_safe
 from django.utils.decorators import method_decorator
+from django.db.models.query import QuerySet
+from django.db import transaction, IntegrityError
+from django.db import models
+from django.db.models import F, Max, Min, Sum, Avg, Count
+from django.db.models.fields import FieldDoesNotExist
+from django.core.exceptions import ValidationError, NON_FIELD_ERRORS
+from django.forms.models import modelform_factory
+import datetime
+import decimal
+import hashlib
 import json
-from .models import MODELS_MAP
+import time
+import uuid
+from .models import (MODELS_MAP, ModelsLoader, get_serializer, model_escape, escape,
+    schema_reloader, schema_reloaded)
+from .cache import (get_version, response_cache, response_key,
+    etag_matches, CACHED_HEADERS, page_cache, page_key)
+from .metrics import timer, record_rows
+from .search import search
+from .stamps import STAMP_FIELD, stamp_objects, stamp_changes, deleted_since
+from .counts import add_rows, exact_count
+from .exporter import (iter_chunks, csv_lines, ndjson_lines, export_lines,
+    encode_stream, EXPORT_FORMATS, EXPORT_CHUNK_SIZE)
+
+PAGE_SIZE_LIMIT = getattr(settings, "PAGE_SIZE_LIMIT", 1000)
+STREAM_CHUNK_SIZE = getattr(settings, "STREAM_CHUNK_SIZE", 1000)
+BULK_BATCH_SIZE = getattr(settings, "BULK_BATCH_SIZE", 500)
+FILTER_LOOKUPS = ("exact", "lt", "lte", "gt", "gte")
+# query parameters which are never treated as field filters
+RESERVED_PARAMS = (
+    "after", "limit", "stream", "order", "q", "format", "gzip", "response",
+    "since", "fields",
+    "group_by", "sum", "avg", "min", "max", "count")
+# aggregate parameter -> (function, schema types it makes sense for)
+AGGREGATES = {
+    "sum": (Sum, ("integer",)),
+    "avg": (Avg, ("integer",)),
+    "min": (Min, ("integer", "date")),
+    "max": (Max, ("integer", "date")),
+}
+
+# list formats picked with ?format= or the Accept header:
+# name -> (content type, streaming serializer method)
+FORMATS = {
+    "json": ("application/json", "serialize_stream"),
+    "columnar": ("application/json", None),
+    "csv": ("text/csv; charset=utf-8", "serialize_csv"),
+    "ndjson": ("application/x-ndjson", "serialize_ndjson"),
+}
+ACCEPT_FORMATS = {
+    "application/vnd.myapp.columnar+json": "columnar",
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+}
+
+class QueryParamError(Exception):
+    # errors are kept in the same shape as form.errors
+    def __init__(self, errors):
+        super(QueryParamError, self).__init__(errors)
+        self.errors = errors
 
 class ActionMixin:
+    # the serializer of the ?fields= projection, if there is one
+    def get_row_serializer(self, model):
+        return get_serializer(model, getattr(self, "projection", None))
+
+    def fetch_rows(self, serializer, queryset):
+        if isinstance(queryset, QuerySet):
+            with timer(getattr(self, "request", None), "fetch"):
+                return list(serializer.values(queryset))
+        return queryset
+
     def serialize(self, model, queryset, **kwargs):
-        fields_map = [[
-        field.name, 
-        model._meta.get_field(field.name).verbose_name, 
-        field.__class__.__name__[:-5]] 
-        for field in model._meta.fields]
-
-        res = {"fields": fields_map, "data": []}
-
-        for obj in queryset:
-            obj_data = {}
-            for fld in model._meta.fields:
-                obj_data.update({fld.name: str(getattr(obj, fld.name, ""))})
-            res["data"].append(obj_data)
+        serializer = self.get_row_serializer(model)
+        request = getattr(self, "request", None)
+        queryset = self.fetch_rows(serializer, queryset)
+        with timer(request, "serialize"):
+            res = {"fields": serializer.fields, "data": serializer.rows(queryset)}
+        record_rows(request, len(res["data"]))
         res.update(kwargs)
-        return json.dumps(res)
+        with timer(request, "json"):
+            return json.dumps(res)
+
+    # the same document as serialize() produces, written row by row
+    def serialize_stream(self, model, chunks, **kwargs):
+        serializer = self.get_row_serializer(model)
+        head = {"fields": serializer.fields}
+        head.update(kwargs)
+        yield json.dumps(head)[:-1] + ", \"data\": ["
+        sep = ""
+        for chunk in chunks:
+            rows = [json.dumps(row) for row in serializer.rows(chunk)]
+            if rows:
+                yield sep + ", ".join(rows)
+                sep = ", "
+        yield "]}"
+
+    # one array per field, in the order of the fields header,
+    # with native ints and iso dates
+    def serialize_columnar(self, model, queryset, **kwargs):
+        serializer = self.get_row_serializer(model)
+        request = getattr(self, "request", None)
+        rows = self.fetch_rows(serializer, queryset)
+        with timer(request, "serialize"):
+            res = {"fields": serializer.fields, "columns": serializer.native_columns(rows)}
+        record_rows(request, len(rows))
+        res.update(kwargs)
+        with timer(request, "json"):
+            return json.dumps(res)
+
+    # a header line of field names, then one line per row;
+    # the urls do not fit in csv and are left out
+    def serialize_csv(self, model, chunks, **kwargs):
+        return csv_lines(self.get_row_serializer(model), chunks)
+
+    # the header document on the first line, then one array per row
+    def serialize_ndjson(self, model, chunks, **kwargs):
+        return ndjson_lines(self.get_row_serializer(model), chunks, **kwargs)
+
+    def serialize_as(self, fmt, model, queryset, **kwargs):
+        if fmt == "json":
+            return self.serialize(model, queryset, **kwargs)
+        if fmt == "columnar":
+            return self.serialize_columnar(model, queryset, **kwargs)
+        request = getattr(self, "request", None)
+        rows = self.fetch_rows(self.get_row_serializer(model), queryset)
+        record_rows(request, len(rows))
+        with timer(request, "serialize"):
+            return "".join(
+                getattr(self, FORMATS[fmt][1])(model, [rows], **kwargs))
+
+    # ?format= wins over the Accept header, json is the default
+    def negotiate_format(self):
+        fmt = self.request.GET.get("format")
+        if fmt:
+            return fmt
+        for media in self.request.META.get("HTTP_ACCEPT", "").split(","):
+            fmt = ACCEPT_FORMATS.get(media.split(";")[0].strip().lower())
+            if fmt:
+                return fmt
+        return "json"
+
+    def get_format(self):
+        fmt = self.negotiate_format()
+        if fmt not in FORMATS:
+            raise QueryParamError({"format": ["Unsupported format."]})
+        return fmt
+
+    def get_json_body(self):
+        try:
+            return json.loads(self.request.body.decode("utf-8"))
+        except ValueError:
+            raise QueryParamError({"__all__": ["Invalid JSON."]})
 
     def render_to_json(self, context, **kwargs):
         data = json.dumps(context)
         kwargs["content_type"] = "application/json"
         return HttpResponse(data, **kwargs)
 
+    def render_to_stream(self, queryset, fmt="json", **kwargs):
+        chunks = self.iter_chunks(queryset)
+        content_type, method = FORMATS[fmt]
+        response = StreamingHttpResponse(
+            getattr(self, method)(self.model, chunks, **kwargs),
+            content_type=content_type)
+        response["Access-Control-Allow-Origin"] = "*"
+        return response
+
     def render_to_response(self, context):
         queryset = self.get_queryset()
-        post_url = reverse("myapp:new_entity", kwargs={"entity": self.kwargs["entity"]})
-        self.kwargs["pk"] = 0
-        update_url = reverse("myapp:update_entity", kwargs=self.kwargs)
-        data = self.serialize(
-            self.model, queryset, 
+        if self.request.method == "GET" and not self.request.GET.get("stream"):
+            return self.render_cached(queryset)
+        return self.render_list(queryset)
+
+    # unchanged lists are answered from the version counter alone:
+    # 304 for a matching If-None-Match, cached body otherwise
+    def render_cached(self, queryset, render=None):
+        render = render or self.render_list
+        entity = self.kwargs["entity"]
+        # the version of the database the rows come from: a replica at
+        # a version has the same rows as the primary had at it
+        key = response_key(
+            entity, get_version(entity, queryset.db), self.request.path, self.request.GET,
+            self.negotiate_format())
+        etag = '"{}"'.format(key)
+        if etag_matches(self.request.META.get("HTTP_IF_NONE_MATCH"), etag):
+            response = HttpResponseNotModified()
+        else:
+            cached = response_cache.get(key)
+            if cached is None:
+                response = render(queryset)
+                if response.status_code != 200:
+                    return response
+                headers = dict((name, response[name])
+                    for name in CACHED_HEADERS if response.has_header(name))
+                response_cache.set(key, (response.content, headers))
+            else:
+                data, headers = cached
+                response = HttpResponse(data)
+                for name, value in headers.items():
+                    response[name] = value
+        response["ETag"] = etag
+        response["Vary"] = "Accept"
+        response["Cache-Control"] = "no-cache"
+        response["Access-Control-Allow-Origin"] = "*"
+        return response
+
+    def render_list(self, queryset):
+        with timer(self.request, "reverse"):
+            post_url = reverse("myapp:new_entity", kwargs={"entity": self.kwargs["entity"]})
+            self.kwargs["pk"] = 0
+            update_url = reverse("myapp:update_entity", kwargs=self.kwargs)
+        extra = {}
+        try:
+            fmt = self.get_format()
+            queryset = self.filter_queryset(queryset)
+            if self.request.GET.get("stream"):
+                if not self.is_pk_ordered():
+                    raise QueryParamError(
+                        {"stream": ["Cannot be combined with a custom order."]})
+                if "limit" in self.request.GET:
+                    # a stream runs to the last row, pages take ?limit
+                    raise QueryParamError(
+                        {"stream": ["Cannot be combined with a limit."]})
+                if FORMATS[fmt][1] is None:
+                    raise QueryParamError(
+                        {"stream": ["Cannot be combined with the {} format.".format(fmt)]})
+                return self.render_to_stream(
+                    self.seek(queryset), 
+                    fmt,
+                    post_url=post_url,
+                    update_url=update_url,
+                    token=self.token,
+                    count=exact_count(self.model, queryset.db),
+                    **self.get_deleted())
+            # get_page() may hand back a list of rows
+            db = queryset.db
+            queryset, extra = self.get_page(queryset)
+            extra["token"] = self.token
+            # rows in the entity, whatever the filters; no COUNT(*)
+            extra["count"] = exact_count(self.model, db)
+            extra.update(self.get_deleted())
+        except QueryParamError as e:
+            return self.render_to_json(e.errors, status=400)
+        data = self.serialize_as(
+            fmt, self.model, queryset, 
             post_url=post_url,
-            update_url=update_url)
-        response = HttpResponse(data, content_type="application/json")
+            update_url=update_url,
+            **extra)
+        response = HttpResponse(data, content_type=FORMATS[fmt][0])
+        if fmt == "csv":
+            # csv has no room for the cursor, the sync token and the count
+            if extra.get("next") is not None:
+                response["X-Next-Cursor"] = str(extra["next"])
+            response["X-Sync-Token"] = str(extra["token"])
+            response["X-Total-Count"] = str(extra["count"])
+            if "deleted" in extra:
+                response["X-Deleted-Ids"] = ",".join(extra["deleted"])
         response["Access-Control-Allow-Origin"] = "*"
         return response
 
+    # the saved object alone, in the row format of the list, with the
+    # entity version after the save; asked for with ?response=object
+    def render_object(self, obj):
+        serializer = get_serializer(self.model)
+        with timer(self.request, "serialize"):
+            data = {
+                "fields": serializer.fields,
+                "object": serializer.row(serializer.instance_values(obj)),
+                "version": get_version(self.kwargs["entity"])}
+        return self.render_to_json(data)
+
     def get_success_url(self):
         return reverse("myapp:show_entity", kwargs={"entity": self.kwargs["entity"]})
 
@@ -52,15 +291,570 @@ class QuerysetMixin:
     def get_queryset(self):
         try:
             self.model = model = MODELS_MAP[self.kwargs["entity"]]
-            return model.objects.all()
+            queryset = model.objects.all()
         except KeyError:
             raise Http404
+        # the router picks a replica or the primary now, streamed
+        # responses read after the pin of the request is gone
+        return queryset.using(queryset.db)
+
+    def get_int_param(self, name, default=None, min_value=0):
+        value = self.request.GET.get(name)
+        if value is None or value == "":
+            return default
+        try:
+            value = int(value)
+        except ValueError:
+            raise QueryParamError({name: ["Enter a whole number."]})
+        if value < min_value:
+            raise QueryParamError(
+                {name: ["Ensure this value is greater than or equal to {}.".format(min_value)]})
+        return value
+
+    def get_model_field(self, name):
+        if name == STAMP_FIELD:
+            return None
+        try:
+            return self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def is_indexed(self, field):
+        return field.primary_key or field.unique or field.db_index
+
+    # ?field=value or ?field__<lookup>=value, only on indexed fields,
+    # so every filter can be answered from an index
+    def get_filters(self):
+        filters, errors = {}, {}
+        for param, value in self.request.GET.items():
+            if param in RESERVED_PARAMS:
+                continue
+            name, _, lookup = param.partition("__")
+            field = self.get_model_field(name)
+            if field is None:
+                continue
+            lookup = lookup or "exact"
+            if lookup not in FILTER_LOOKUPS:
+                errors[param] = ["Unsupported lookup."]
+                continue
+            if not self.is_indexed(field):
+                errors[param] = ["Only indexed fields can be filtered on."]
+                continue
+            try:
+                value = field.to_python(value)
+            except ValidationError as e:
+                errors[param] = e.messages
+                continue
+            # stored strings are escaped, compare them escaped as well
+            if isinstance(value, str):
+                value = escape(value)
+            filters["{}__{}".format(field.attname, lookup)] = value
+        if errors:
+            raise QueryParamError(errors)
+        return filters
+
+    # ?order=-field1,field2, the primary key always breaks ties
+    def get_order(self):
+        order = self.request.GET.get("order")
+        if not order:
+            return None
+        names, errors = [], []
+        for name in order.split(","):
+            field = self.get_model_field(name.lstrip("-"))
+            if field is None:
+                errors.append("Unknown field {}.".format(name.lstrip("-")))
+            elif not self.is_indexed(field):
+                errors.append("Field {} is not indexed.".format(field.name))
+            else:
+                names.append(name)
+        if errors:
+            raise QueryParamError({"order": errors})
+        pk_name = self.model._meta.pk.name
+        if names == [pk_name]:
+            return None
+        if names[-1].lstrip("-") != pk_name:
+            names.append(pk_name)
+        return names
+
+    # ?fields=a,b: only these columns are selected and serialized
+    def get_projection(self):
+        fields = self.request.GET.get("fields")
+        if not fields:
+            return None
+        names, errors = [], []
+        for name in fields.split(","):
+            name = name.strip()
+            if self.get_model_field(name) is None:
+                errors.append("Unknown field {}.".format(name))
+            else:
+                names.append(name)
+        if errors:
+            raise QueryParamError({"fields": errors})
+        return names
+
+    def filter_queryset(self, queryset):
+        self.projection = self.get_projection()
+        self.order = self.get_order()
+        # read before the query: rows written meanwhile get a larger
+        # stamp and are picked up with ?since=<token> next time
+        self.token = get_version(self.kwargs["entity"], queryset.db)
+        queryset = queryset.filter(**self.get_filters())
+        since = self.get_int_param("since")
+        self.deleted = None
+        if since is not None:
+            queryset = queryset.filter(**{STAMP_FIELD + "__gt": since})
+            self.deleted = deleted_since(self.model, since, queryset.db)
+        q = self.request.GET.get("q", "").strip()
+        if q:
+            queryset = search(queryset, q)
+        if self.order:
+            queryset = queryset.order_by(*self.order)
+        return queryset
+
+    # ids deleted after ?since, only answered with a since token
+    def get_deleted(self):
+        if self.deleted is None:
+            return {}
+        return {"deleted": self.deleted}
+
+    def is_pk_ordered(self):
+        return not getattr(self, "order", None)
+
+    # keyset (seek) pagination over the primary key:
+    # ?after=<id>&limit=N, page cost does not depend on the page depth
+    def get_page(self, queryset):
+        queryset = self.seek(queryset)
+        limit = self.get_int_param("limit", min_value=1)
+        if limit is None:
+            return queryset, {}
+        limit = min(limit, PAGE_SIZE_LIMIT)
+        serializer = self.get_row_serializer(self.model)
+        if not self.is_pk_ordered():
+            # a plain top-N query, there is no cursor for custom orders
+            with timer(self.request, "fetch"):
+                rows = list(serializer.values(queryset[:limit]))
+            return rows, {"limit": limit}
+        # one extra row tells whether there is a next page
+        with timer(self.request, "fetch"):
+            rows = list(serializer.values(queryset.order_by("pk")[:limit + 1]))
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = rows[limit - 1][serializer.pk_index]
+        return rows[:limit], {"next": next_cursor, "limit": limit}
+
+    def seek(self, queryset):
+        after = self.get_int_param("after")
+        if after is not None:
+            if not self.is_pk_ordered():
+                raise QueryParamError(
+                    {"after": ["Cannot be combined with a custom order."]})
+            queryset = queryset.filter(pk__gt=after)
+        return queryset
+
+    def iter_chunks(self, queryset, chunk_size=None):
+        return iter_chunks(queryset, chunk_size or STREAM_CHUNK_SIZE,
+            self.get_row_serializer(queryset.model))
+
+class ExportMixin:
+    # ?format=csv|ndjson&gzip=1, the filtered table as a download,
+    # written while it is read in primary key chunks; ?after= resumes
+    def get(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        try:
+            fmt = self.request.GET.get("format") or "csv"
+            if fmt not in EXPORT_FORMATS:
+                raise QueryParamError({"format": ["Unsupported format."]})
+            queryset = self.seek(self.filter_queryset(queryset))
+            if not self.is_pk_ordered():
+                raise QueryParamError(
+                    {"order": ["Exports are in primary key order."]})
+        except QueryParamError as e:
+            return self.render_to_json(e.errors, status=400)
+        content_type, extension = EXPORT_FORMATS[fmt]
+        filename = "{}.{}".format(self.kwargs["entity"], extension)
+        compress = bool(self.request.GET.get("gzip"))
+        if compress:
+            content_type = "application/gzip"
+            filename += ".gz"
+        chunks = self.iter_chunks(queryset, EXPORT_CHUNK_SIZE)
+        response = StreamingHttpResponse(
+            encode_stream(export_lines(self.model, chunks, fmt,
+                self.get_row_serializer(self.model)), compress),
+            content_type=content_type)
+        response["Content-Disposition"] = 'attachment; filename="{}"'.format(filename)
+        response["Access-Control-Allow-Origin"] = "*"
+        return response
 
 class ValidationMixin:
     def form_valid(self, form):
-        super(ValidationMixin, self).form_valid(form)
+        with timer(self.request, "save"):
+            super(ValidationMixin, self).form_valid(form)
+        if self.request.GET.get("response") == "object":
+            return self.render_object(self.object)
         return self.render_to_response({})
 
     def form_invalid(self, form):
         super(ValidationMixin, self).form_invalid(form)
         return self.render_to_json(form.errors, status=400)
+
+class BulkCreateMixin:
+    def get_bulk_form_class(self):
+        fields = [field.name for field in self.model._meta.fields
+            if field.editable and not field.auto_created]
+        return modelform_factory(self.model, fields=fields)
+
+    # validates the whole batch first, returns (objects, errors),
+    # errors are keyed by the row index
+    def build_objects(self, rows):
+        form_class = self.get_bulk_form_class()
+        objs, errors = [], {}
+        seen = set()
+        for idx, row in enumerate(rows):
+            if not isinstance(row, dict):
+                errors[str(idx)] = {"__all__": ["Expected an object."]}
+                continue
+            # ModelForm validation runs the model full_clean() as well
+            form = form_class(data=row)
+            if not form.is_valid():
+                errors[str(idx)] = form.errors
+                continue
+            obj = form.save(commit=False)
+            model_escape(obj)
+            objs.append(obj)
+            row_errors = self.check_batch_unique(obj, seen)
+            if row_errors:
+                errors[str(idx)] = row_errors
+        return objs, errors
+
+    # the form checks unique values against the table only, rows of the
+    # same batch that clash are caught here; seen maps values to rows
+    def check_batch_unique(self, obj, seen):
+        opts = self.model._meta
+        checks = [(field.name,) for field in opts.fields
+            if field.unique and not field.primary_key]
+        checks.extend(tuple(check) for check in opts.unique_together)
+        errors = {}
+        for check in checks:
+            values = tuple(getattr(obj, name) for name in check)
+            if None in values:
+                continue
+            if (check, values) in seen:
+                key = check[0] if len(check) == 1 else NON_FIELD_ERRORS
+                errors.setdefault(key, []).append(obj.unique_error_message(self.model, check))
+            else:
+                seen.add((check, values))
+        return errors
+
+    def post(self, request, *args, **kwargs):
+        self.get_queryset()
+        try:
+            rows = self.get_json_body()
+            if not isinstance(rows, list):
+                raise QueryParamError({"__all__": ["Expected a list of objects."]})
+        except QueryParamError as e:
+            return self.render_to_json(e.errors, status=400)
+        objs, errors = self.build_objects(rows)
+        if errors:
+            return self.render_to_json(errors, status=400)
+        try:
+            with transaction.atomic():
+                stamp_objects(self.model, objs)
+                self.model.objects.bulk_create(objs, batch_size=BULK_BATCH_SIZE)
+                add_rows(self.model, len(objs))
+        except IntegrityError as e:
+            # a concurrent write took a unique value after validation
+            return self.render_to_json({NON_FIELD_ERRORS: [str(e)]}, status=400)
+        return self.render_to_json({"created": len(objs)})
+
+class BulkUpdateMixin:
+    # accepts either {"objects": [{"pk": 1, "field": value, ...}, ...]}
+    # or {"filter": {...}, "values": {...}, "increment": {...}}
+    # and turns it into a few UPDATE statements touching only given columns
+
+    def get_editable_field(self, name):
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if not field.editable or field.auto_created:
+            return None
+        return field
+
+    # the same checks full_clean() runs for a single field,
+    # strings are escaped the way model_save does it
+    def clean_values(self, data):
+        values, errors = {}, {}
+        if not isinstance(data, dict):
+            return values, {"__all__": ["Expected an object."]}
+        for name, raw in data.items():
+            field = self.get_editable_field(name)
+            if field is None:
+                errors[name] = ["Unknown field."]
+                continue
+            try:
+                value = field.clean(raw, None)
+            except ValidationError as e:
+                errors[name] = e.messages
+                continue
+            if isinstance(value, str):
+                value = escape(value)
+            values[field.attname] = value
+        return values, errors
+
+    def clean_increments(self, data):
+        values, errors = {}, {}
+        if not isinstance(data, dict):
+            return values, {"__all__": ["Expected an object."]}
+        for name, raw in data.items():
+            field = self.get_editable_field(name)
+            if field is None or not isinstance(field, models.IntegerField):
+                errors[name] = ["Only integer fields can be incremented."]
+                continue
+            if not isinstance(raw, int) or isinstance(raw, bool):
+                errors[name] = ["Enter a whole number."]
+                continue
+            values[field.attname] = raw
+        return values, errors
+
+    # one value of a unique field can only go to one row
+    def unique_names(self, values):
+        return sorted(name for name in values
+            if self.model._meta.get_field(name).unique)
+
+    def check_increments(self, queryset, increments):
+        errors = {}
+        for name, inc in increments.items():
+            field = self.model._meta.get_field(name)
+            bounds = queryset.aggregate(high=Max(name), low=Min(name))
+            if bounds["high"] is None:
+                continue
+            try:
+                for validator in field.validators:
+                    validator(bounds["high"] + inc)
+                    validator(bounds["low"] + inc)
+            except ValidationError as e:
+                errors[name] = e.messages
+        return errors
+
+    def update_objects(self, objects):
+        errors, groups, rows = {}, {}, {}
+        for idx, obj in enumerate(objects):
+            if not isinstance(obj, dict) or "pk" not in obj:
+                errors[str(idx)] = {"pk": ["This field is required."]}
+                continue
+            data = dict(obj)
+            pk = data.pop("pk")
+            if not isinstance(pk, int) or isinstance(pk, bool):
+                errors[str(idx)] = {"pk": ["Enter a whole number."]}
+                continue
+            values, row_errors = self.clean_values(data)
+            if row_errors:
+                errors[str(idx)] = row_errors
+                continue
+            if values:
+                # rows with identical changes share one UPDATE
+                key = tuple(sorted(values.items()))
+                groups.setdefault(key, []).append(pk)
+                rows.setdefault(key, []).append(idx)
+        for key, pks in groups.items():
+            names = self.unique_names(dict(key))
+            if names and len(set(pks)) > 1:
+                for idx in rows[key][1:]:
+                    errors[str(idx)] = dict((name, ["The same value is set on an earlier row."])
+                        for name in names)
+        if errors:
+            raise QueryParamError(errors)
+        updated = 0
+        if not groups:
+            return 0
+        try:
+            with transaction.atomic():
+                stamp = stamp_changes(self.model)
+                for key, pks in groups.items():
+                    for i in range(0, len(pks), BULK_BATCH_SIZE):
+                        updated += self.model.objects.filter(
+                            pk__in=pks[i:i + BULK_BATCH_SIZE]).update(**dict(key, **stamp))
+        except IntegrityError as e:
+            # a unique value another row already has
+            raise QueryParamError({NON_FIELD_ERRORS: [str(e)]})
+        return updated
+
+    def update_filtered(self, body):
+        # an empty filter is allowed, but it has to be explicit
+        if "filter" not in body:
+            raise QueryParamError({"filter": ["This field is required."]})
+        filters, errors = self.clean_values(body["filter"])
+        if errors:
+            raise QueryParamError({"filter": errors})
+        values, errors = self.clean_values(body.get("values", {}))
+        increments, inc_errors = self.clean_increments(body.get("increment", {}))
+        errors.update(inc_errors)
+        for name in set(values) & set(increments):
+            errors[name] = ["A field cannot be both set and incremented."]
+        if errors:
+            raise QueryParamError(errors)
+        changes = dict(values)
+        for name, inc in increments.items():
+            changes[name] = F(name) + inc
+        if not changes:
+            return 0
+        try:
+            with transaction.atomic():
+                queryset = self.model.objects.filter(**filters)
+                names = self.unique_names(values)
+                if names and queryset.count() > 1:
+                    raise QueryParamError(dict(
+                        (name, ["A unique field can only be set on one row."]) for name in names))
+                if increments:
+                    errors = self.check_increments(queryset, increments)
+                    if errors:
+                        raise QueryParamError(errors)
+                changes.update(stamp_changes(self.model))
+                return queryset.update(**changes)
+        except IntegrityError as e:
+            # a unique value another row already has
+            raise QueryParamError({NON_FIELD_ERRORS: [str(e)]})
+
+    def post(self, request, *args, **kwargs):
+        self.get_queryset()
+        try:
+            body = self.get_json_body()
+            if not isinstance(body, dict):
+                raise QueryParamError({"__all__": ["Expected an object."]})
+            if "objects" in body:
+                if not isinstance(body["objects"], list):
+                    raise QueryParamError({"objects": ["Expected a list of objects."]})
+                updated = self.update_objects(body["objects"])
+            else:
+                updated = self.update_filtered(body)
+        except QueryParamError as e:
+            return self.render_to_json(e.errors, status=400)
+        return self.render_to_json({"updated": updated})
+
+class AggregateMixin:
+    # ?group_by=f1,f2&sum=f3&avg=f3&min=f4&max=f4&count=1, answered
+    # with a single GROUP BY query; results use django's "field__func" names
+    def get_list_param(self, name):
+        return [value for value in self.request.GET.get(name, "").split(",") if value]
+
+    def get_group_by(self):
+        group_by, errors = [], []
+        for name in self.get_list_param("group_by"):
+            field = self.get_model_field(name)
+            if field is None or ModelsLoader.field_type(field) is None:
+                errors.append("Cannot group by {}.".format(name))
+            else:
+                group_by.append(field.name)
+        if errors:
+            raise QueryParamError({"group_by": errors})
+        return group_by
+
+    def get_aggregates(self):
+        aggregates, errors = {}, {}
+        for param, (func, types) in AGGREGATES.items():
+            for name in self.get_list_param(param):
+                field = self.get_model_field(name)
+                if field is None or ModelsLoader.field_type(field) not in types:
+                    errors.setdefault(param, []).append(
+                        "Cannot {} field {}.".format(param, name))
+                    continue
+                aggregates["{}__{}".format(field.name, param)] = func(field.name)
+        if self.request.GET.get("count"):
+            aggregates["count"] = Count("pk")
+        if errors:
+            raise QueryParamError(errors)
+        if not aggregates:
+            raise QueryParamError({"__all__": ["Ask for at least one aggregate."]})
+        return aggregates
+
+    def to_json_value(self, value):
+        if isinstance(value, datetime.date):
+            return value.isoformat()
+        if isinstance(value, decimal.Decimal):
+            return float(value)
+        return value
+
+    def render_aggregate(self, queryset):
+        try:
+            group_by = self.get_group_by()
+            aggregates = self.get_aggregates()
+            queryset = queryset.filter(**self.get_filters())
+        except QueryParamError as e:
+            return self.render_to_json(e.errors, status=400)
+        with timer(self.request, "fetch"):
+            if group_by:
+                # order_by() also keeps Meta.ordering out of the GROUP BY
+                rows = list(queryset.values(*group_by)
+                    .annotate(**aggregates).order_by(*group_by))
+            else:
+                rows = [queryset.aggregate(**aggregates)]
+        data = [dict((key, self.to_json_value(value)) for key, value in row.items())
+            for row in rows]
+        record_rows(self.request, len(data))
+        return self.render_to_json({"group_by": group_by, "data": data})
+
+    def get(self, request, *args, **kwargs):
+        return self.render_cached(self.get_queryset(), self.render_aggregate)
+
+# stands in for the csrf token in cached pages, replaced on every response
+CSRF_PLACEHOLDER = "csrf{}".format(uuid.uuid4().hex)
+
+def clear_page_cache(sender, **kwargs):
+    page_cache.clear()
+
+schema_reloaded.connect(clear_page_cache)
+
+class CachedPageMixin:
+    # the page is rendered once per schema and url and served from
+    # page_cache afterwards; context processors run on that first render
+    # only, so cached templates must not depend on the user. Per-request
+    # parts, like the csrf token, are rendered as placeholders and
+    # filled in on every response, see get_fills()
+    # off for pages whose fills change without a new render
+    use_last_modified = True
+
+    def get_page(self):
+        key = page_key(self.template_name,
+            "{}:{}".format(schema_reloader.digest, MODELS_MAP.generation),
+            self.request.build_absolute_uri())
+        page = page_cache.get(key)
+        if page is None:
+            context = self.get_context_data(**self.kwargs)
+            content = render_to_string(self.template_name, context_instance=RequestContext(
+                self.request, context,
+                processors=[lambda request: {"csrf_token": CSRF_PLACEHOLDER}]))
+            digest = hashlib.md5(content.encode("utf-8")).hexdigest()
+            page = (content, digest, int(time.time()))
+            page_cache.set(key, page)
+        return page
+
+    # placeholder -> the value it stands for in this response
+    def get_fills(self, content):
+        if CSRF_PLACEHOLDER in content:
+            return {CSRF_PLACEHOLDER: get_token(self.request)}
+        return {}
+
+    def get(self, request, *args, **kwargs):
+        content, digest, rendered = self.get_page()
+        fills = self.get_fills(content)
+        raw = ":".join([digest] + [fills[key] for key in sorted(fills)])
+        etag = '"{}"'.format(hashlib.md5(raw.encode("utf-8")).hexdigest())
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if if_none_match:
+            not_modified = etag_matches(if_none_match, etag)
+        elif self.use_last_modified:
+            since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+            not_modified = since is not None and since >= rendered
+        else:
+            not_modified = False
+        if not_modified:
+            response = HttpResponseNotModified()
+        else:
+            for placeholder, value in fills.items():
+                content = content.replace(placeholder, value)
+            response = HttpResponse(content)
+        response["ETag"] = etag
+        if self.use_last_modified:
+            response["Last-Modified"] = http_date(rendered)
+        response["Cache-Control"] = "no-cache"
+        return response
@@ -1,37 +1,164 @@
 from django.db import models
+from django.db.models import loading
+from django.db.models.signals import post_syncdb
+from django.db import connections, router, transaction, DatabaseError
 from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
+from django.dispatch import Signal
+from django.core.management.color import no_style
+from collections.abc import Mapping
+import hashlib
 import json
 import os
 import re
+import sys
+import threading
+import time
+from .serializers import RowSerializer
+from .savers import escape, make_save
+from .cache import bump_version, EntityVersion
+from .search import ensure_search_index
+from .stamps import STAMP_FIELD, stamp_objects, connect_deletions, EntityDeletion
+from .specs import cached_specs, store_specs
+from .counts import EntityCount, connect_counts
 
-MODELS_MAP = {}
+# myapp's own tables, a schema model of the same name would replace them
+RESERVED_MODEL_NAMES = tuple(model._meta.model_name
+    for model in (EntityCount, EntityVersion, EntityDeletion))
+
+class PendingModel:
+    # a validated spec whose model class is not built yet
+    def __init__(self, model_name, spec):
+        self.model_name = model_name
+        self.spec = spec
+
+    def build(self):
+        return ModelsLoader().build(self.model_name, self.spec)
+
+class ModelsRegistry(Mapping):
+    # readers always get one consistent dict, writers never mutate it
+    # in place but swap in a new one; entries may be PendingModel, the
+    # class is built on first lookup, iterating values builds them all
+    def __init__(self, models_dict=None):
+        self._models = dict(models_dict or {})
+        # one lock for builds and every change of the dict: a build and a
+        # reload swapping the entry meanwhile would otherwise both win
+        self.lock = threading.RLock()
+        # bumped when entities are added, changed or removed, building
+        # a pending entry does not count
+        self.generation = 0
+
+    def __getitem__(self, key):
+        model = self._models[key]
+        if isinstance(model, PendingModel):
+            model = self.materialize(key)
+        return model
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def __iter__(self):
+        return iter(self._models)
+
+    def __len__(self):
+        return len(self._models)
+
+    def __setitem__(self, key, model):
+        with self.lock:
+            self._set(key, model)
+            self.generation += 1
+
+    def _set(self, key, model):
+        with self.lock:
+            models_dict = dict(self._models)
+            models_dict[key] = model
+            self._models = models_dict
+
+    def __delitem__(self, key):
+        with self.lock:
+            models_dict = dict(self._models)
+            del models_dict[key]
+            self._models = models_dict
+            self.generation += 1
+
+    def materialize(self, key):
+        with self.lock:
+            # another thread may have built it while we waited
+            model = self._models[key]
+            if isinstance(model, PendingModel):
+                model = model.build()
+                self._set(key, model)
+            return model
+
+    def materialize_all(self):
+        for key in self:
+            self[key]
+
+    def is_built(self, key):
+        return not isinstance(self._models[key], PendingModel)
+
+    # entity -> title without building anything
+    def titles(self):
+        return dict(
+            (key, model.spec["title"] if isinstance(model, PendingModel)
+                else model._meta.verbose_name_plural)
+            for key, model in self._models.items())
+
+    def snapshot(self):
+        return self._models
+
+    def swap(self, models_dict):
+        with self.lock:
+            self._models = dict(models_dict)
+            self.generation += 1
+
+MODELS_MAP = ModelsRegistry()
+# compiled row serializers, built together with the model class
+SERIALIZERS = {}
 
 file_name = getattr(settings, "JSON_FILE_NAME", "models.json")
 JSON_FULL_PATH = os.path.abspath(
     os.path.join(
         os.path.dirname(__file__), file_name))
+SCHEMA_RELOAD_INTERVAL = getattr(settings, "SCHEMA_RELOAD_INTERVAL", 2)
 
-def clean(s, regex="[^a-zA-Z0-9_]"):
-    pattern = re.compile(regex)
-    return pattern.sub("", s).strip()
+# sent after a schema reload with the model classes dropped and built
+schema_reloaded = Signal(providing_args=["unloaded", "loaded"])
 
-def escape(s):
-    # ugly
-    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("'", "&#39;").replace("\"", "&quot;")
+CLEAN_PATTERN = re.compile("[^a-zA-Z0-9_]")
 
-# save method for a model
-# escaping goes here
-def model_save(self, *args, **kwargs):
-    self.full_clean()
-    model = self.__class__
-    fields = model._meta.fields
+def clean(s, pattern=CLEAN_PATTERN):
+    return pattern.sub("", s).strip()
+
+def model_escape(self):
+    fields = self.__class__._meta.fields
     for field in fields:
         val = getattr(self, field.name)
         if isinstance(val, str):
             val = escape(val)
         setattr(self, field.name, val)
-    super(model, self).save(*args, **kwargs)
+
+# generic save method for a model, escaping goes here;
+# generated models get a compiled one from make_save()
+def model_save(self, *args, **kwargs):
+    self.full_clean()
+    model_escape(self)
+    # the stamp and the row counter are updated in the same
+    # transaction, see stamps and counts
+    using = kwargs.get("using") or router.db_for_write(self.__class__, instance=self)
+    with transaction.atomic(using=using, savepoint=False):
+        stamp_objects(self.__class__, [self])
+        super(self.__class__, self).save(*args, **kwargs)
+
+# fields: names of a projection, see RowSerializer.project()
+def get_serializer(model, fields=None):
+    key = model.__name__.lower()
+    serializer = SERIALIZERS.get(key)
+    if serializer is None or serializer.model is not model:
+        serializer = SERIALIZERS[key] = RowSerializer(model)
+    if fields:
+        return serializer.project(fields)
+    return serializer
 
 class ModelsLoader:
     # just simple structure
@@ -47,11 +174,24 @@ class ModelsLoader:
 
     required_model_keys = ["title", "fields"]
     required_attr_keys = ["id", "title", "type"]
+    # optional field keys and the field arguments they turn into
+    index_keys = {"index": "db_index", "unique": "unique"}
 
-    def __init__(self, json_str):
+    # json_str may be None when the loader only builds ready specs
+    def __init__(self, json_str=None):
         self._content = self._get_content(json_str)
 
+    # the schema type ("char", "integer"...) a model field was built from
+    @classmethod
+    def field_type(cls, field):
+        for fld_type, (fld_class, _) in cls.field_map.items():
+            if field.__class__ is fld_class:
+                return fld_type
+        return None
+
     def _get_content(self, json_str):
+        if json_str is None:
+            return {}
         try:
             return json.loads(json_str)
         except ValueError:
@@ -64,51 +204,232 @@ class ModelsLoader:
     def _check_keys(self, dct, req_keys):
         return set(req_keys).issubset(set(dct))
 
-    def unload(self, model_name_str):
-        if model_name_str in globals():
-            del globals()[model_name_str]
+    # composite indexes: "index_together": [["field1", "field2"], ...],
+    # groups naming unknown fields are skipped
+    def _get_index_together(self, model_attrs, fld_names):
+        groups = []
+        for group in model_attrs.get("index_together", []):
+            if not isinstance(group, list):
+                continue
+            group = tuple(clean(name) for name in group)
+            if group and all(name in fld_names for name in group):
+                groups.append(group)
+        return tuple(groups)
 
-    def load(self):
-        # TODO: add logging (to all methods)
+    # cleaned and validated schema: model name -> spec,
+    # two specs are equal only if they build the same model
+    def get_specs(self):
+        specs = {}
         for model_name, model_attrs in self._content.items():
             model_name = clean(model_name).capitalize()
             model_attrs = self._clean_keys(model_attrs)
-            attr_dict = dict()
-            if not self._check_keys(model_attrs, self.required_model_keys):
+            if (not self._check_keys(model_attrs, self.required_model_keys) or
+                model_name.lower() in RESERVED_MODEL_NAMES):
                 # if model does not have any of required keys
                 # consider it as invalid and skip
                 continue
-            first_fld_name = None
+            fields = []
             for field in model_attrs["fields"]:
                 if (not self._check_keys(field, self.required_attr_keys) or 
-                    not clean(field["type"]) in self.field_map):
+                    not clean(field["type"]) in self.field_map or
+                    clean(field["id"]) == STAMP_FIELD):
                     # the same skipping logic as for models
                     continue
-                fld_type = clean(field["type"])
-                fld_name = clean(field["id"])
-                if not first_fld_name:
-                    first_fld_name = fld_name
-                    # define __str__ function
-                    attr_dict["cap_field"] = fld_name
-                    attr_dict["__str__"] = lambda s: getattr(s, s.cap_field)
-                
-                fld_class = self.field_map[fld_type][0]
-                fld_args = self.field_map[fld_type][1]
-                attr_dict[fld_name] = fld_class(field["title"], **fld_args)
-
-            attr_dict.update({
-                "Meta": type(
-                    "Meta", (), {
-                    "verbose_name_plural": model_attrs["title"], 
-                    "ordering": ("id",)}),
-                "save": model_save,
-                "__module__": __name__
-                })
-
-            globals().update({
-                model_name: type(model_name, (models.Model,), attr_dict)})
-            MODELS_MAP[model_name.lower()] = globals()[model_name]
-
-if os.path.exists(JSON_FULL_PATH):
-    ModelsLoader(
-        open(JSON_FULL_PATH).read()).load()
+                flags = tuple(sorted(
+                    arg for key, arg in self.index_keys.items()
+                    if field.get(key) is True))
+                fields.append(
+                    (clean(field["id"]), field["title"], clean(field["type"]), flags))
+            fld_names = set(field[0] for field in fields)
+            specs[model_name] = {
+                "title": model_attrs["title"],
+                "fields": tuple(fields),
+                "index_together": self._get_index_together(model_attrs, fld_names)}
+        return specs
+
+    def unload(self, model_name_str):
+        if model_name_str in globals():
+            del globals()[model_name_str]
+        SERIALIZERS.pop(model_name_str.lower(), None)
+        # otherwise django hands out the old class for the same name
+        app_models = loading.cache.app_models.get(__name__.split(".")[0], {})
+        app_models.pop(model_name_str.lower(), None)
+        loading.cache._get_models_cache.clear()
+
+    def build(self, model_name, spec):
+        # TODO: add logging (to all methods)
+        attr_dict = dict()
+        first_fld_name = None
+        for fld_name, fld_title, fld_type, flags in spec["fields"]:
+            if not first_fld_name:
+                first_fld_name = fld_name
+                # define __str__ function
+                attr_dict["cap_field"] = fld_name
+                attr_dict["__str__"] = lambda s: getattr(s, s.cap_field)
+
+            fld_class = self.field_map[fld_type][0]
+            fld_args = dict(self.field_map[fld_type][1])
+            for arg in flags:
+                fld_args[arg] = True
+            attr_dict[fld_name] = fld_class(fld_title, **fld_args)
+
+        # hidden modification stamp, last so schema fields keep their places
+        attr_dict[STAMP_FIELD] = models.BigIntegerField(
+            default=0, editable=False, db_index=True)
+
+        meta_attrs = {
+            "verbose_name_plural": spec["title"], 
+            "ordering": ("id",)}
+        if spec["index_together"]:
+            meta_attrs["index_together"] = spec["index_together"]
+
+        attr_dict.update({
+            "Meta": type("Meta", (), meta_attrs),
+            "save": model_save,
+            "__module__": __name__
+            })
+
+        model = type(model_name, (models.Model,), attr_dict)
+        model.save = make_save(model)
+        connect_counts(model)
+        connect_deletions(model)
+        globals().update({model_name: model})
+        SERIALIZERS[model_name.lower()] = RowSerializer(model)
+        return model
+
+    def load(self):
+        for model_name, spec in self.get_specs().items():
+            MODELS_MAP[model_name.lower()] = self.build(model_name, spec)
+
+class SchemaReloader:
+    # watches the schema file and rebuilds only the models whose spec
+    # changed, the registry is swapped in one step afterwards
+    def __init__(self, path, registry=None, interval=SCHEMA_RELOAD_INTERVAL):
+        self.path = path
+        self.registry = MODELS_MAP if registry is None else registry
+        self.interval = interval
+        self.specs = {}
+        self.mtime = None
+        self.digest = None
+        self._checked = 0
+        self._lock = threading.Lock()
+        # seconds spent in each step of the last reload, and whether the
+        # specs came from the snapshot, for the startup report
+        self.timings = {}
+        self.specs_source = None
+
+    def check(self, force=False):
+        now = time.time()
+        if not force and now - self._checked < self.interval:
+            return False
+        self._checked = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        if not force and mtime == self.mtime:
+            return False
+        with self._lock:
+            self.mtime = mtime
+            start = time.time()
+            with open(self.path, "rb") as f:
+                content = f.read()
+            digest = hashlib.sha1(content).hexdigest()
+            if digest == self.digest:
+                return False
+            self.timings = {"read": time.time() - start}
+            self.reload(
+                content.decode("utf-8"), initial=self.digest is None, digest=digest)
+            self.digest = digest
+            return True
+
+    # with the content hash the cleaned specs come from the snapshot
+    # written by an earlier boot, so json parsing and cleaning are skipped
+    def get_specs(self, json_str, digest=None):
+        specs = cached_specs(digest) if digest else None
+        if specs is not None:
+            self.specs_source = "snapshot"
+            return specs
+        specs = ModelsLoader(json_str).get_specs()
+        self.specs_source = "parsed"
+        if digest:
+            store_specs(digest, specs)
+        return specs
+
+    def reload(self, json_str, initial=False, digest=None):
+        start = time.time()
+        specs = self.get_specs(json_str, digest)
+        parsed = time.time()
+        self.timings["specs"] = parsed - start
+        loader = ModelsLoader()
+        unloaded, loaded = [], []
+        # no entry is built from the old spec between the snapshot and
+        # the swap, it would stay in django's app cache otherwise
+        with self.registry.lock:
+            models_dict = dict(self.registry.snapshot())
+            for model_name in set(self.specs) | set(specs):
+                spec = specs.get(model_name)
+                if spec == self.specs.get(model_name):
+                    continue
+                entity = model_name.lower()
+                if entity in models_dict:
+                    model = models_dict.pop(entity)
+                    if not isinstance(model, PendingModel):
+                        unloaded.append(model)
+                        loader.unload(model_name)
+                if spec is not None and initial:
+                    # built on first use, see ModelsRegistry
+                    models_dict[entity] = PendingModel(model_name, spec)
+                elif spec is not None:
+                    models_dict[entity] = loader.build(model_name, spec)
+                    loaded.append(models_dict[entity])
+                if not initial:
+                    # cached responses carry the old fields
+                    try:
+                        bump_version(entity)
+                    except DatabaseError:
+                        # no versions table yet, syncdb has not run
+                        pass
+            self.registry.swap(models_dict)
+        self.specs = specs
+        self.timings["build"] = time.time() - parsed
+        if unloaded or loaded:
+            schema_reloaded.send(
+                sender=self.__class__, unloaded=unloaded, loaded=loaded)
+
+# the text search index needs the table, so it is created after syncdb;
+# models loaded later get theirs on the first search
+def create_search_indexes(sender, db="default", **kwargs):
+    tables = set(connections[db].introspection.table_names())
+    for model in MODELS_MAP.values():
+        if model._meta.db_table in tables:
+            ensure_search_index(model, db)
+
+post_syncdb.connect(create_search_indexes, sender=sys.modules[__name__])
+
+# tables created before the stamp existed get the column and its index,
+# syncdb only creates missing tables
+def add_stamp_columns(sender, db="default", **kwargs):
+    connection = connections[db]
+    tables = set(connection.introspection.table_names())
+    cursor = connection.cursor()
+    style = no_style()
+    for model in MODELS_MAP.values():
+        table = model._meta.db_table
+        if table not in tables:
+            continue
+        columns = [column[0] for column in
+            connection.introspection.get_table_description(cursor, table)]
+        field = model._meta.get_field(STAMP_FIELD)
+        if field.column in columns:
+            continue
+        qn = connection.ops.quote_name
+        cursor.execute("ALTER TABLE {} ADD COLUMN {} {} NOT NULL DEFAULT 0".format(
+            qn(table), qn(field.column), field.db_type(connection)))
+        for sql in connection.creation.sql_indexes_for_field(model, field, style):
+            cursor.execute(sql)
+
+post_syncdb.connect(add_stamp_columns, sender=sys.modules[__name__])
+
+schema_reloader = SchemaReloader(JSON_FULL_PATH)
+schema_reloader.check(force=True)
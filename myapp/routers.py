@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+import random
+import threading
+
+APP_LABEL = "myapp"
+_state = threading.local()
+
+# aliases added from DATABASE_URL_<NAME> variables, see settings
+def get_replicas():
+    return getattr(settings, "REPLICA_DATABASES", ())
+
+# the current thread reads from the primary until unpin()
+def pin_primary():
+    _state.pinned = True
+
+def unpin():
+    _state.pinned = False
+
+def is_pinned():
+    return getattr(_state, "pinned", False)
+
+class ReplicaRouter(object):
+    # entity models are read from a random replica unless the thread is
+    # pinned to the primary, writes always go to the primary; models of
+    # other apps are left to the default routing
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if not replicas or is_pinned() or model._meta.app_label != APP_LABEL:
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # without this an object read from a replica would be saved there
+        if model._meta.app_label != APP_LABEL:
+            return None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = (DEFAULT_DB_ALIAS,) + tuple(get_replicas())
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    # replicas get their tables from replication, not from syncdb
+    def allow_syncdb(self, db, model):
+        if db in get_replicas():
+            return False
+        return None
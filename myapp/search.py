@@ -0,0 +1,167 @@
+from django.db import models, connections, router
+from django.db.models import Q
+from .savers import escape
+import threading
+
+def get_char_columns(model):
+    return [field.column for field in model._meta.fields
+        if isinstance(field, models.CharField)]
+
+class SearchBackend:
+    # fallback: case insensitive substring match, a full scan
+    indexed = False
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def connection(self):
+        # connections are per thread, look it up on every use
+        return connections[self.alias]
+
+    def quote(self, name):
+        return self.connection.ops.quote_name(name)
+
+    def ensure_index(self, model):
+        pass
+
+    def filter(self, queryset, q):
+        query = Q()
+        for field in queryset.model._meta.fields:
+            if isinstance(field, models.CharField):
+                query |= Q(**{field.attname + "__icontains": q})
+        return queryset.filter(query)
+
+class SqliteSearchBackend(SearchBackend):
+    # external content FTS5 table over the char columns, kept in sync
+    # by triggers, so saves, bulk_create and update() all maintain it
+    indexed = True
+
+    def fts_table(self, model):
+        return model._meta.db_table + "_fts"
+
+    def _exists(self, cursor, name):
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = %s", [name])
+        return cursor.fetchone() is not None
+
+    def _fts_columns(self, cursor, fts):
+        cursor.execute("PRAGMA table_info({})".format(self.quote(fts)))
+        return [row[1] for row in cursor.fetchall()]
+
+    def drop_index(self, cursor, model):
+        fts = self.fts_table(model)
+        for suffix in ("_ai", "_ad", "_au"):
+            cursor.execute("DROP TRIGGER IF EXISTS {}".format(self.quote(fts + suffix)))
+        cursor.execute("DROP TABLE IF EXISTS {}".format(self.quote(fts)))
+
+    def ensure_index(self, model):
+        columns = get_char_columns(model)
+        table, fts = model._meta.db_table, self.fts_table(model)
+        cursor = self.connection.cursor()
+        if self._exists(cursor, fts):
+            if self._fts_columns(cursor, fts) == columns:
+                return
+            self.drop_index(cursor, model)
+        if not columns:
+            return
+        q = self.quote
+        cols = ", ".join(q(c) for c in columns)
+        new = ", ".join("new." + q(c) for c in columns)
+        old = ", ".join("old." + q(c) for c in columns)
+        pk = q(model._meta.pk.column)
+        delete_old = "INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.{pk}, {old});"
+        insert_new = "INSERT INTO {fts}(rowid, {cols}) VALUES (new.{pk}, {new});"
+        params = dict(table=q(table), fts=q(fts), cols=cols, new=new, old=old, pk=pk)
+        statements = [
+            "CREATE VIRTUAL TABLE {fts} USING fts5({cols}, content='"
+            + table + "', content_rowid='" + model._meta.pk.column + "')",
+            "INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+            "CREATE TRIGGER " + q(fts + "_ai") + " AFTER INSERT ON {table} BEGIN "
+            + insert_new + " END",
+            "CREATE TRIGGER " + q(fts + "_ad") + " AFTER DELETE ON {table} BEGIN "
+            + delete_old + " END",
+            "CREATE TRIGGER " + q(fts + "_au") + " AFTER UPDATE ON {table} BEGIN "
+            + delete_old + " " + insert_new + " END",
+        ]
+        for statement in statements:
+            cursor.execute(statement.format(**params))
+
+    def match_expression(self, q):
+        # every word as a quoted prefix, all of them must match
+        return " ".join('"{}"*'.format(word.replace('"', '""')) for word in q.split())
+
+    def filter(self, queryset, q):
+        model = queryset.model
+        expression = self.match_expression(q)
+        if not expression or not get_char_columns(model):
+            return queryset.none()
+        where = "{}.{} IN (SELECT rowid FROM {fts} WHERE {fts} MATCH %s)".format(
+            self.quote(model._meta.db_table), self.quote(model._meta.pk.column),
+            fts=self.quote(self.fts_table(model)))
+        return queryset.extra(where=[where], params=[expression])
+
+class PostgresSearchBackend(SearchBackend):
+    # pg_trgm GIN index per char column, ILIKE '%q%' is answered from it
+    indexed = True
+
+    def index_name(self, model, column):
+        return "{}_{}_trgm".format(model._meta.db_table, column)
+
+    def ensure_index(self, model):
+        cursor = self.connection.cursor()
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for column in get_char_columns(model):
+            name = self.index_name(model, column)
+            cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", [name])
+            if cursor.fetchone() is None:
+                cursor.execute("CREATE INDEX {} ON {} USING gin ({} gin_trgm_ops)".format(
+                    self.quote(name), self.quote(model._meta.db_table), self.quote(column)))
+
+    def filter(self, queryset, q):
+        model = queryset.model
+        columns = get_char_columns(model)
+        if not columns:
+            return queryset.none()
+        pattern = "%{}%".format(
+            q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_"))
+        table = self.quote(model._meta.db_table)
+        where = " OR ".join(
+            "{}.{} ILIKE %s".format(table, self.quote(column)) for column in columns)
+        return queryset.extra(where=["(" + where + ")"], params=[pattern] * len(columns))
+
+def sqlite_has_fts5(connection):
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA compile_options")
+    return "ENABLE_FTS5" in [row[0] for row in cursor.fetchall()]
+
+_backends = {}
+_ensured = set()
+_lock = threading.Lock()
+
+def get_search_backend(alias):
+    backend = _backends.get(alias)
+    if backend is None:
+        connection = connections[alias]
+        if connection.vendor == "sqlite" and sqlite_has_fts5(connection):
+            backend = SqliteSearchBackend(alias)
+        elif connection.vendor == "postgresql":
+            backend = PostgresSearchBackend(alias)
+        else:
+            backend = SearchBackend(alias)
+        _backends[alias] = backend
+    return backend
+
+def ensure_search_index(model, alias="default"):
+    get_search_backend(alias).ensure_index(model)
+    with _lock:
+        _ensured.add((alias, model))
+
+def search(queryset, q):
+    # stored strings are escaped, so is the query
+    q = escape(q.strip())
+    # the index is built on the primary, replicas get it from replication
+    write_alias = router.db_for_write(queryset.model)
+    if (write_alias, queryset.model) not in _ensured:
+        ensure_search_index(queryset.model, write_alias)
+    return get_search_backend(queryset.db).filter(queryset, q)
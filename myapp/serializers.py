@@ -0,0 +1,90 @@
+from django.db import models
+from .stamps import visible_fields
+import datetime
+
+def date_to_str(value):
+    # str() of a date is its isoformat, but without the extra dispatch
+    if value.__class__ is datetime.date:
+        return value.isoformat()
+    return str(value)
+
+def date_to_iso(value):
+    return value.isoformat() if value is not None else None
+
+class RowSerializer:
+    # converters must give exactly what str(getattr(obj, name))
+    # gives on a model instance, rows come from values_list()
+    converters = {
+        models.AutoField: str,
+        models.CharField: str,
+        models.IntegerField: str,
+        models.DateField: date_to_str,
+    }
+    # the compact formats keep ints as ints, only dates are converted
+    native_converters = {
+        models.DateField: date_to_iso,
+    }
+
+    # fields is a subset of the model's fields, all of them by default
+    def __init__(self, model, fields=None):
+        fields = fields or visible_fields(model)
+        self.model = model
+        self.names = tuple(field.name for field in fields)
+        self.columns = tuple(field.attname for field in fields)
+        self.pk_index = self.names.index(model._meta.pk.name)
+        self.fields = [[
+            field.name,
+            field.verbose_name,
+            field.__class__.__name__[:-5]]
+            for field in fields]
+        self.funcs = tuple(
+            self.converters.get(field.__class__, str) for field in fields)
+        self.native_funcs = tuple(
+            self.native_converters.get(field.__class__) for field in fields)
+        self.has_native_funcs = any(self.native_funcs)
+        self._projections = {}
+
+    # a serializer for some of the fields, in the order of the full one;
+    # the primary key is always kept, cursors and urls need it
+    def project(self, names):
+        names = set(names) | {self.model._meta.pk.name}
+        key = tuple(name for name in self.names if name in names)
+        if key == self.names:
+            return self
+        serializer = self._projections.get(key)
+        if serializer is None:
+            serializer = self._projections[key] = RowSerializer(self.model,
+                [field for field in visible_fields(self.model) if field.name in names])
+        return serializer
+
+    def values(self, queryset):
+        return queryset.values_list(*self.columns)
+
+    def instance_values(self, obj):
+        return tuple(getattr(obj, column) for column in self.columns)
+
+    def row(self, values):
+        return {name: func(value) for name, func, value
+            in zip(self.names, self.funcs, values)}
+
+    def rows(self, values_iter):
+        row = self.row
+        return [row(values) for values in values_iter]
+
+    # rows as lists in the order of the fields header
+    def native_rows(self, values_iter):
+        if not self.has_native_funcs:
+            return [list(values) for values in values_iter]
+        funcs = self.native_funcs
+        return [[func(value) if func else value
+            for func, value in zip(funcs, values)] for values in values_iter]
+
+    # one list per field in the order of the fields header
+    def native_columns(self, values_iter):
+        columns = [list(column) for column in zip(*values_iter)]
+        if not columns:
+            return [[] for name in self.names]
+        for idx, func in enumerate(self.native_funcs):
+            if func:
+                columns[idx] = [func(value) for value in columns[idx]]
+        return columns
@@ -0,0 +1,61 @@
+from django.conf import settings
+import marshal
+import os
+import tempfile
+
+# bump when get_specs() output changes shape or what it skips, old
+# snapshots are ignored; 2: _stamp fields and the entitycount model
+# are skipped, 3: entityversion and entitydeletion as well
+SPECS_FORMAT = 3
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), "__pycache__")
+PREFIX = "schema-"
+
+# where the parsed schema is kept between boots, None turns it off;
+# read on every call so the startup report can switch it off
+def cache_dir():
+    return getattr(settings, "SCHEMA_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+def snapshot_path(digest):
+    directory = cache_dir()
+    if not directory:
+        return None
+    return os.path.join(directory, "{}{}.marshal".format(PREFIX, digest))
+
+# specs cleaned and validated from a models.json with this content hash,
+# None if there is no usable snapshot
+def cached_specs(digest):
+    path = snapshot_path(digest)
+    if path is None:
+        return None
+    try:
+        with open(path, "rb") as f:
+            fmt, stored_digest, specs = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if fmt != SPECS_FORMAT or stored_digest != digest:
+        return None
+    return specs
+
+# written to a temp file and renamed, so workers booting together never
+# read half a snapshot; snapshots of older schemas are removed
+def store_specs(digest, specs):
+    path = snapshot_path(digest)
+    if path is None:
+        return False
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix="tmp-")
+        with os.fdopen(fd, "wb") as f:
+            marshal.dump((SPECS_FORMAT, digest, specs), f)
+        os.replace(tmp_path, path)
+    except (OSError, ValueError):
+        return False
+    for name in os.listdir(directory):
+        if (name.startswith(PREFIX) and name.endswith(".marshal") and
+            os.path.join(directory, name) != path):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    return True
@@ -0,0 +1,69 @@
+from django.db import models, router
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.signals import post_delete
+from .cache import bump_version
+
+# every generated model gets this hidden, indexed field (see
+# ModelsLoader.build()); writes set it from the entity version counter,
+# so ?since=<version> finds the rows changed after that version
+STAMP_FIELD = "_stamp"
+
+def has_stamp(model):
+    try:
+        model._meta.get_field(STAMP_FIELD)
+    except FieldDoesNotExist:
+        return False
+    return True
+
+def visible_fields(model):
+    return [field for field in model._meta.fields if field.name != STAMP_FIELD]
+
+# reserves a version for rows about to be written, and is the version
+# bump of the write too; called inside the write's transaction the
+# version row stays locked until the commit, so a later version is
+# never committed before an earlier one and ?since never skips rows
+def next_stamp(model):
+    return bump_version(model.__name__.lower())
+
+def stamp_objects(model, objs):
+    stamp = next_stamp(model)
+    if has_stamp(model):
+        for obj in objs:
+            setattr(obj, STAMP_FIELD, stamp)
+
+# the extra column for an update() of the model's rows
+def stamp_changes(model):
+    stamp = next_stamp(model)
+    if not has_stamp(model):
+        return {}
+    return {STAMP_FIELD: stamp}
+
+class EntityDeletion(models.Model):
+    # a deleted row has no stamp left to find it by, so every delete
+    # leaves its id here with the version it bumped; ?since returns the
+    # ids deleted after the token next to the changed rows
+    entity = models.CharField(max_length=100)
+    object_id = models.CharField(max_length=100)
+    stamp = models.BigIntegerField()
+
+    class Meta:
+        app_label = "myapp"
+        db_table = "myapp_entity_deletion"
+        index_together = [["entity", "stamp"]]
+
+# runs inside the delete's transaction; the bump also moves cached
+# lists and counts of the entity past the deleted rows
+def record_deleted(sender, instance, **kwargs):
+    EntityDeletion.objects.using(router.db_for_write(EntityDeletion)).create(
+        entity=sender.__name__.lower(), object_id=str(instance.pk), stamp=next_stamp(sender))
+
+# ids deleted after the since token, oldest first; an id can come back
+# in the rows when it was written again later
+def deleted_since(model, since, using=None):
+    return list(EntityDeletion.objects.using(using)
+        .filter(entity=model.__name__.lower(), stamp__gt=since)
+        .order_by("stamp").values_list("object_id", flat=True))
+
+# connected per generated model, like connect_counts()
+def connect_deletions(model):
+    post_delete.connect(record_deleted, sender=model)
@@ -0,0 +1,110 @@
+import builtins
+import collections
+import json
+import os
+import subprocess
+import sys
+import time
+
+# run in a fresh interpreter by the startup_report command, so every
+# import is a cold one; nothing from django is imported at module level
+CHILD_CODE = "from myapp.startup import main; main()"
+# modules whose own import time is listed, inclusive of what they import
+MODULE_PREFIXES = ("myapp", "myproject")
+
+def resolve(name, globals_dict, level):
+    if not level:
+        return name
+    package = (globals_dict or {}).get("__package__") or ""
+    parts = package.split(".")
+    base = ".".join(parts[:len(parts) - level + 1])
+    return "{}.{}".format(base, name) if name else base
+
+# wraps __import__ and records the first import of each of our modules
+def record_imports(modules):
+    original = builtins.__import__
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        full_name = resolve(name, globals, level)
+        if (full_name in sys.modules or
+            not full_name.startswith(MODULE_PREFIXES)):
+            return original(name, globals, locals, fromlist, level)
+        start = time.time()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            modules.setdefault(full_name, time.time() - start)
+
+    builtins.__import__ = timed_import
+    return original
+
+def measure(use_snapshot=True):
+    phases = collections.OrderedDict()
+    modules = {}
+    last = [time.time()]
+
+    def mark(name):
+        now = time.time()
+        phases[name] = now - last[0]
+        last[0] = now
+
+    from django.conf import settings
+    settings.INSTALLED_APPS
+    if not use_snapshot:
+        settings.SCHEMA_CACHE_DIR = None
+    mark("settings")
+    import django.db.models
+    import django.contrib.admin
+    mark("django")
+    original = record_imports(modules)
+    try:
+        import myapp.models
+        mark("myapp.models")
+        import myapp.admin
+        mark("myapp.admin")
+        __import__(settings.ROOT_URLCONF)
+        mark("urlconf")
+    finally:
+        builtins.__import__ = original
+    reloader = myapp.models.schema_reloader
+    return {
+        "total": sum(phases.values()),
+        "phases": phases,
+        "schema": dict(reloader.timings, source=reloader.specs_source),
+        "entities": len(myapp.models.MODELS_MAP),
+        "built": sum(1 for key in myapp.models.MODELS_MAP
+            if myapp.models.MODELS_MAP.is_built(key)),
+        "modules": modules}
+
+def main():
+    use_snapshot = sys.argv[-1] != "parsed"
+    sys.stdout.write(json.dumps(measure(use_snapshot)) + "\n")
+
+def run_child(mode):
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output(
+        [sys.executable, "-c", CHILD_CODE, mode],
+        cwd=project_dir, env=dict(os.environ))
+    # the last line, settings may print before it
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+# fastest of the runs for every timing, per schema mode
+def best_of(results):
+    def merge(values):
+        if isinstance(values[0], dict):
+            return collections.OrderedDict(
+                (key, merge([v[key] for v in values if key in v]))
+                for key in values[0])
+        if isinstance(values[0], (int, float)):
+            return round(min(values), 6)
+        return values[0]
+    return merge(results)
+
+def startup_report(runs=3, modes=("parsed", "snapshot")):
+    report = collections.OrderedDict()
+    for mode in modes:
+        if mode == "snapshot":
+            # makes sure the snapshot exists before it is timed
+            run_child(mode)
+        report[mode] = best_of([run_child(mode) for _ in range(runs)])
+    return report
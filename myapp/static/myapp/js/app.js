@@ -2,6 +2,7 @@
     App = function (options){
         var defaultOptions = {
             "links-var": {},
+            "counts-var": {},
             "links-div": "list",
             "links-class": "menu",
             "table-div": "info",
@@ -42,6 +43,15 @@
             }
         }
 
+        function renderRow(options, fields, obj){
+            return "<tr>"+ fields.reduce(function(acc, field){
+                return acc +"<td field_type='"+ 
+                field[2] +"' field_id='"+ field[0] + 
+                "' class='"+ options["td-class"] +"'>"+ 
+                obj[field[0]] +"</td>";
+            }, "") +"</tr>";
+        }
+
         function renderTable(options, data){
             function drawHeader(fields){
                 return "<tr>" + fields.reduce(function(acc, field){
@@ -51,12 +61,7 @@
 
             function drawBody(fields, objs){
                 return objs.reduce(function(acc, obj){
-                    return acc + "<tr>"+ fields.reduce(function(acc, field){
-                        return acc +"<td field_type='"+ 
-                        field[2] +"' field_id='"+ field[0] + 
-                        "' class='"+ options["td-class"] +"'>"+ 
-                        obj[field[0]] +"</td>";
-                    }, "") +"</tr>";
+                    return acc + renderRow(options, fields, obj);
                 }, "");
             }
 
@@ -65,6 +70,21 @@
             drawBody(data["fields"], data["data"]) +"</table>";
         }
 
+        //the server answers with the saved object only
+        function objectUrl(url){
+            return url + (url.indexOf("?") < 0 ? "?" : "&") + "response=object";
+        }
+
+        function patchRow(cells, obj){
+            [].forEach.call(cells, function(cell){
+                //values come escaped, as in renderRow; the input
+                //takes the decoded text the display shows
+                var txt = obj[$(cell).attr("field_id")];
+                var disp = $(cell).children(".display").first().html(txt);
+                $(cell).children(".edit").first().val(disp.text());
+            });
+        }
+
         function renderForm(options, data){
             function drawInputs(fields){
                 return fields.reduce(function(acc, field){
@@ -88,7 +108,9 @@
         function renderLinks(options){
             return Object.keys(options["links-var"]).reduce(function(acc, key){
                 return acc + "<a class='"+ options["links-class"] +
-                "' href='' id='"+ key +"'>"+ options["links-var"][key][0] +"</a><br>";
+                "' href='' id='"+ key +"'>"+ options["links-var"][key][0] +"</a>"+
+                (key in options["counts-var"] ? " ("+ options["counts-var"][key] +")" : "") +
+                "<br>";
             }, "");
         }
         
@@ -99,9 +121,10 @@
                 post_data[$(input).attr("id")] = $(input).val();
             });
 
-            $.post(url, post_data)
+            $.post(objectUrl(url), post_data)
             .success(function(data){
-                refreshPage(options, data);
+                appendRow(options, data);
+                inputs.val("");
             });
         }
 
@@ -117,9 +140,9 @@
                 post_data[$(cell).attr("field_id")] = $(cell).children(".edit").first().val();
             });
             url = url.substring(0, url.lastIndexOf("/")) + "/" + uid;
-            $.post(url, post_data)
+            $.post(objectUrl(url), post_data)
             .success(function(data){
-                refreshPage(options, data);
+                patchRow(cells, data["object"]);
             })
             .error(function(xhr, data, err){
                 $(disp).text(old_text);
@@ -127,14 +150,28 @@
             });
         }
 
-        function handleTable(options, data){
-            $("#"+ options["table-div"]).html(renderTable(options, data));
-            $("td."+ options["td-class"]).editable({
+        function makeEditable(options, data, cells){
+            cells.editable({
                 onHandle: function(edit, cells, old_text){
                     updateRequest.call(this, edit, options, 
                         data["update_url"], cells, old_text);
                 },
             });
+            setupDatepicker(cells.filter("[field_type=Date]").children(".edit"));
+        }
+
+        function handleTable(options, data){
+            $("#"+ options["table-div"]).html(renderTable(options, data));
+            makeEditable(options, data, $("td."+ options["td-class"]));
+            options["table-data"] = data;
+        }
+
+        function appendRow(options, obj_data){
+            var data = options["table-data"];
+            var row = $(renderRow(options, data["fields"], obj_data["object"]));
+
+            $("#grid").append(row);
+            makeEditable(options, data, row.children("td."+ options["td-class"]));
         }
 
         function handleForm(options, data){
@@ -149,20 +186,12 @@
             });
         }
 
-        function refreshPage(options, data){
-            //draw table and set its event handlers
-            handleTable(options, data);
-
-            //draw form and set its handlers
-            handleForm(options, data);
+        var dateFormat = {
+            dateFormat: "yy-mm-dd"
+        };
 
-            var dateFormat = {
-                dateFormat: "yy-mm-dd"
-            };
-            
-            //setup datepicker 
-            $("input.Date").datepicker(dateFormat);
-            $("td[field_type=Date] > .edit").datepicker($.extend({
+        function setupDatepicker(edits){
+            edits.datepicker($.extend({
                 onClose: function(date){
                     var e = $.Event("keypress");
                     e.which = 13;
@@ -173,6 +202,17 @@
             }, dateFormat));
         }
 
+        function refreshPage(options, data){
+            //draw table and set its event handlers
+            handleTable(options, data);
+
+            //draw form and set its handlers
+            handleForm(options, data);
+
+            //setup datepicker 
+            $("input.Date").datepicker(dateFormat);
+        }
+
         function handleLinks(options){
             //draw links
             $("#"+ options["links-div"]).html(renderLinks(options));
@@ -1,13 +1,35 @@
 from django.test import TestCase
-from django.test.client import Client
-from django.db import models
+from django.test.client import Client, RequestFactory
+from django.db import models, transaction, IntegrityError
 from django.core.exceptions import ValidationError
-from django.core.urlresolvers import reverse
+from django.core.urlresolvers import reverse, NoReverseMatch
+from django.http import HttpResponse
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.template.loader import render_to_string
 import json
 import datetime
-from .models import ModelsLoader, clean
+import gzip
+import marshal
+import os
+import shutil
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from .models import ModelsLoader, ModelsRegistry, PendingModel, SchemaReloader, clean, get_serializer, SERIALIZERS, model_save, schema_reloaded
+from .mixins import CSRF_PLACEHOLDER
+from .counts import EntityCount, CountedQuerySet, exact_count, approximate_counts
+from .savers import escape
+from .cache import LRUCache, response_cache, bump_version, get_version, page_cache
+from .metrics import Histogram, HISTOGRAMS
+from .specs import cached_specs, store_specs
+from .exporter import export
+from .stamps import STAMP_FIELD, visible_fields
+from .routers import ReplicaRouter, pin_primary, unpin, is_pinned
+from .middleware import ReplicaPinMiddleware, REPLICA_PIN_COOKIE
+from .assets import CompressedStaticFilesStorage, StaticFilesApp, MANIFEST_NAME
+from .admin import AdminResolver
+from django.core.files.storage import FileSystemStorage
 from .views import EntityView, NewEntityView, UpdateEntityView, MainView
 
 
@@ -172,7 +194,9 @@ class ModelsLoaderTest(TestCase):
         l = ModelsLoader(self.models_json)
         l.load()
         from .models import Anymodel
-        self.assertEqual(len(Anymodel._meta.fields), 4)
+        # the schema fields and the hidden stamp
+        self.assertEqual(len(Anymodel._meta.fields), 5)
+        self.assertEqual(Anymodel._meta.fields[4].name, STAMP_FIELD)
         l.unload("Anymodel")
 
     def test_load_in_globals_fields_names(self):
@@ -256,7 +280,9 @@ class ModelsLoaderTest(TestCase):
         l = ModelsLoader(self.dirty_json)
         l.load()
         from .models import Anymodel
-        self.assertEqual(len(Anymodel._meta.fields), 4)
+        # the schema fields and the hidden stamp
+        self.assertEqual(len(Anymodel._meta.fields), 5)
+        self.assertEqual(Anymodel._meta.fields[4].name, STAMP_FIELD)
         l.unload("Anymodel")
 
     def test_load_dirty_in_globals_fields_names(self):
@@ -303,7 +329,9 @@ class ModelsLoaderTest(TestCase):
         l = ModelsLoader(self.json_with_skips)
         l.load()
         from .models import Anymodel
-        self.assertEqual(len(Anymodel._meta.fields), 4)
+        # the schema fields and the hidden stamp
+        self.assertEqual(len(Anymodel._meta.fields), 5)
+        self.assertEqual(Anymodel._meta.fields[4].name, STAMP_FIELD)
         l.unload("Anymodel")
 
     def test_load_with_skips_in_globals_fields_names(self):
@@ -822,3 +850,2016 @@ class ViewsTest(TestCase):
             {"models_map": {"anymodel<>'&\"": "Anymodel title<>'&\""}})
         self.assertIn("anymodel&lt;&gt;&#39;&amp;&quot", html1)
         self.assertIn("Anymodel title&lt;&gt;&#39;&amp;&quot", html1)
+
+class PaginationTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        from .models import Anymodel
+        for i in range(5):
+            Anymodel.objects.create(
+                department="d{}".format(i),
+                spots=i,
+                any_date="2011-11-11")
+
+    def test_list_view_without_limit_has_no_cursor(self):
+        resp = self.client.get("/myapp/anymodel")
+        d = json.loads(resp.content.decode("utf-8"))
+        self.assertEqual(len(d["data"]), 5)
+        self.assertNotIn("next", d)
+
+    def test_list_view_first_page(self):
+        resp = self.client.get("/myapp/anymodel?limit=2")
+        d = json.loads(resp.content.decode("utf-8"))
+        self.assertEqual([o["id"] for o in d["data"]], ["1", "2"])
+        self.assertEqual(d["next"], 2)
+
+    def test_list_view_next_page(self):
+        resp = self.client.get("/myapp/anymodel?after=2&limit=2")
+        d = json.loads(resp.content.decode("utf-8"))
+        self.assertEqual([o["id"] for o in d["data"]], ["3", "4"])
+        self.assertEqual(d["next"], 4)
+
+    def test_list_view_last_page(self):
+        resp = self.client.get("/myapp/anymodel?after=4&limit=2")
+        d = json.loads(resp.content.decode("utf-8"))
+        self.assertEqual([o["id"] for o in d["data"]], ["5"])
+        self.assertIsNone(d["next"])
+
+    def test_list_view_invalid_params(self):
+        resp = self.client.get("/myapp/anymodel?after=a&limit=2")
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("after", json.loads(resp.content.decode("utf-8")))
+        resp = self.client.get("/myapp/anymodel?limit=0")
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("limit", json.loads(resp.content.decode("utf-8")))
+
+class StreamingTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+
+    def get_stream(self, url):
+        resp = self.client.get(url)
+        self.assertTrue(resp.streaming)
+        return json.loads(b"".join(resp.streaming_content).decode("utf-8"))
+
+    def test_stream_empty(self):
+        d = self.get_stream("/myapp/anymodel?stream=1")
+        self.assertEqual(d["data"], [])
+        self.assertEqual(len(d["fields"]), 4)
+        self.assertEqual(d["post_url"], "/myapp/anymodel/add")
+
+    def test_stream_matches_list_view(self):
+        from .models import Anymodel
+        for i in range(7):
+            Anymodel.objects.create(
+                department="<d{}>".format(i),
+                spots=i,
+                any_date="2011-11-11")
+        from . import mixins
+        old_size = mixins.STREAM_CHUNK_SIZE
+        mixins.STREAM_CHUNK_SIZE = 3
+        try:
+            d = self.get_stream("/myapp/anymodel?stream=1")
+        finally:
+            mixins.STREAM_CHUNK_SIZE = old_size
+        resp = self.client.get("/myapp/anymodel")
+        self.assertEqual(d, json.loads(resp.content.decode("utf-8")))
+
+    def test_stream_after(self):
+        from .models import Anymodel
+        for i in range(3):
+            Anymodel.objects.create(department="d", spots=i, any_date="2011-11-11")
+        d = self.get_stream("/myapp/anymodel?stream=1&after=1")
+        self.assertEqual([o["id"] for o in d["data"]], ["2", "3"])
+
+    def test_stream_with_limit(self):
+        resp = self.client.get("/myapp/anymodel?stream=1&limit=1")
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("stream", json.loads(resp.content.decode("utf-8")))
+
+class SerializerTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+
+    def test_serializer_created_on_load(self):
+        from .models import Anymodel
+        self.assertIn("anymodel", SERIALIZERS)
+        self.assertIs(get_serializer(Anymodel), SERIALIZERS["anymodel"])
+
+    def test_serializer_dropped_on_unload(self):
+        l = ModelsLoader(self.models_json)
+        l.load()
+        l.unload("Anymodel")
+        self.assertNotIn("anymodel", SERIALIZERS)
+        l.load()
+
+    def test_serializer_row_matches_instance(self):
+        from .models import Anymodel
+        Anymodel.objects.create(department="<d>", spots=-5, any_date="2011-01-02")
+        serializer = get_serializer(Anymodel)
+        obj = Anymodel.objects.get(pk=1)
+        row = serializer.rows(serializer.values(Anymodel.objects.all()))[0]
+        self.assertEqual(row, dict(
+            (f.name, str(getattr(obj, f.name))) for f in visible_fields(Anymodel)))
+
+class BulkCreateTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]},
+        "codemodel": {
+            "title": "Codes title",
+            "fields": [
+            {"id": "code", "title": "Code title", "type": "char", "unique": true}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+
+    def post_json(self, url, data):
+        return self.client.post(
+            url, json.dumps(data), content_type="application/json")
+
+    def test_bulk_create(self):
+        from .models import Anymodel
+        resp = self.post_json("/myapp/anymodel/bulk", [
+            {"department": "<a>", "spots": 1, "any_date": "2010-10-10"},
+            {"department": "b", "spots": "2", "any_date": "2011-10-10"}])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.content.decode("utf-8")), {"created": 2})
+        self.assertEqual(Anymodel.objects.count(), 2)
+        obj = Anymodel.objects.get(department="&lt;a&gt;")
+        self.assertEqual(obj.spots, 1)
+        self.assertEqual(obj.any_date, datetime.date(2010, 10, 10))
+
+    def test_bulk_create_errors_per_row(self):
+        from .models import Anymodel
+        resp = self.post_json("/myapp/anymodel/bulk", [
+            {"department": "a", "spots": 1, "any_date": "2010-10-10"},
+            {"department": "b", "spots": "x", "any_date": "2010-10-10"},
+            {"department": "c", "spots": 2147483648, "any_date": "2010-10-10z"}])
+        self.assertEqual(resp.status_code, 400)
+        d = json.loads(resp.content.decode("utf-8"))
+        self.assertEqual(sorted(d), ["1", "2"])
+        self.assertEqual(list(d["1"]), ["spots"])
+        self.assertIn("spots", d["2"])
+        self.assertIn("any_date", d["2"])
+        self.assertEqual(Anymodel.objects.count(), 0)
+
+    def test_bulk_create_duplicates_per_row(self):
+        from .models import Codemodel
+        Codemodel.objects.create(code="taken")
+        resp = self.post_json("/myapp/codemodel/bulk", [
+            {"code": "a"}, {"code": "b"}, {"code": "a"}, {"code": "taken"}])
+        self.assertEqual(resp.status_code, 400)
+        d = json.loads(resp.content.decode("utf-8"))
+        self.assertEqual(sorted(d), ["2", "3"])
+        self.assertEqual(list(d["2"]), ["code"])
+        self.assertEqual(list(d["3"]), ["code"])
+        self.assertEqual(Codemodel.objects.count(), 1)
+
+    def test_bulk_create_invalid_body(self):
+        resp = self.client.post(
+            "/myapp/anymodel/bulk", "{", content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+        resp = self.post_json("/myapp/anymodel/bulk", {"department": "a"})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_bulk_create_unknown_entity(self):
+        resp = self.post_json("/myapp/nomodel/bulk", [])
+        self.assertEqual(resp.status_code, 404)
+
+class BulkUpdateTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]},
+        "codemodel": {
+            "title": "Codes title",
+            "fields": [
+            {"id": "code", "title": "Code title", "type": "char", "unique": true}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        from .models import Anymodel
+        Anymodel.objects.create(department="a", spots=1, any_date="2010-10-10")
+        Anymodel.objects.create(department="a", spots=2, any_date="2010-10-10")
+        Anymodel.objects.create(department="b", spots=3, any_date="2010-10-10")
+
+    def post_json(self, data):
+        return self.client.post(
+            "/myapp/anymodel/bulk_update",
+            json.dumps(data), content_type="application/json")
+
+    def test_bulk_update_objects(self):
+        from .models import Anymodel
+        resp = self.post_json({"objects": [
+            {"pk": 1, "department": "<c>"},
+            {"pk": 2, "department": "<c>"},
+            {"pk": 3, "spots": "7", "any_date": "2012-12-12"}]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.content.decode("utf-8")), {"updated": 3})
+        self.assertEqual(Anymodel.objects.filter(department="&lt;c&gt;").count(), 2)
+        obj = Anymodel.objects.get(pk=3)
+        self.assertEqual(obj.department, "b")
+        self.assertEqual(obj.spots, 7)
+        self.assertEqual(obj.any_date, datetime.date(2012, 12, 12))
+
+    def post_codes(self, data):
+        from .models import Codemodel
+        if not Codemodel.objects.exists():
+            for code in ("a", "b", "c"):
+                Codemodel.objects.create(code=code)
+        resp = self.client.post(
+            "/myapp/codemodel/bulk_update",
+            json.dumps(data), content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(sorted(Codemodel.objects.values_list("code", flat=True)), ["a", "b", "c"])
+        return json.loads(resp.content.decode("utf-8"))
+
+    def test_bulk_update_unique_objects(self):
+        d = self.post_codes({"objects": [{"pk": 1, "code": "b"}]})
+        self.assertEqual(list(d), ["__all__"])
+        d = self.post_codes({"objects": [{"pk": 1, "code": "z"}, {"pk": 2, "code": "z"}]})
+        self.assertEqual(d, {"1": {"code": ["The same value is set on an earlier row."]}})
+
+    def test_bulk_update_unique_filter(self):
+        d = self.post_codes({"filter": {}, "values": {"code": "z"}})
+        self.assertEqual(d, {"code": ["A unique field can only be set on one row."]})
+        d = self.post_codes({"filter": {"code": "a"}, "values": {"code": "b"}})
+        self.assertEqual(list(d), ["__all__"])
+
+    def test_bulk_update_objects_errors(self):
+        from .models import Anymodel
+        resp = self.post_json({"objects": [
+            {"pk": 1, "spots": 2147483648},
+            {"pk": 2, "department": ""},
+            {"pk": 3, "spots": 5},
+            {"spots": 5}]})
+        self.assertEqual(resp.status_code, 400)
+        d = json.loads(resp.content.decode("utf-8"))
+        self.assertIn("spots", d["0"])
+        self.assertIn("department", d["1"])
+        self.assertIn("pk", d["3"])
+        self.assertNotIn("2", d)
+        self.assertEqual(Anymodel.objects.get(pk=3).spots, 3)
+
+    def test_bulk_update_filter(self):
+        from .models import Anymodel
+        resp = self.post_json({
+            "filter": {"department": "a"},
+            "values": {"any_date": "2011-11-11"},
+            "increment": {"spots": 10}})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.content.decode("utf-8")), {"updated": 2})
+        self.assertEqual(
+            list(Anymodel.objects.values_list("spots", flat=True)), [11, 12, 3])
+        self.assertEqual(
+            Anymodel.objects.filter(any_date="2011-11-11").count(), 2)
+
+    def test_bulk_update_filter_overflow(self):
+        from .models import Anymodel
+        resp = self.post_json({
+            "filter": {"department": "b"},
+            "increment": {"spots": 2147483647}})
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("spots", json.loads(resp.content.decode("utf-8")))
+        self.assertEqual(Anymodel.objects.get(pk=3).spots, 3)
+
+    def test_bulk_update_filter_required(self):
+        resp = self.post_json({"values": {"spots": 1}})
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("filter", json.loads(resp.content.decode("utf-8")))
+
+    def test_bulk_update_unknown_field(self):
+        resp = self.post_json({"filter": {}, "values": {"id": 5}})
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("id", json.loads(resp.content.decode("utf-8")))
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        response_cache.clear()
+        bump_version("anymodel")
+
+    def test_lru_eviction(self):
+        lru = LRUCache(2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertEqual(lru.get("a"), 1)
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(len(lru), 2)
+
+    def test_etag_not_modified(self):
+        resp = self.client.get("/myapp/anymodel")
+        self.assertEqual(resp.status_code, 200)
+        etag = resp["ETag"]
+        resp = self.client.get("/myapp/anymodel", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp["ETag"], etag)
+
+    def test_not_modified_without_queries(self):
+        etag = self.client.get("/myapp/anymodel")["ETag"]
+        with self.assertNumQueries(0):
+            resp = self.client.get("/myapp/anymodel", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+    def test_etag_depends_on_params(self):
+        resp1 = self.client.get("/myapp/anymodel")
+        resp2 = self.client.get("/myapp/anymodel?limit=1")
+        self.assertNotEqual(resp1["ETag"], resp2["ETag"])
+
+    def test_save_invalidates(self):
+        from .models import Anymodel
+        resp = self.client.get("/myapp/anymodel")
+        etag = resp["ETag"]
+        Anymodel.objects.create(department="d", spots=1, any_date="2011-11-11")
+        resp = self.client.get("/myapp/anymodel", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp["ETag"], etag)
+        d = json.loads(resp.content.decode("utf-8"))
+        self.assertEqual(len(d["data"]), 1)
+
+    def test_cached_body_served_without_queries(self):
+        self.client.get("/myapp/anymodel")
+        # the version comes from the cache as well
+        with self.assertNumQueries(0):
+            resp = self.client.get("/myapp/anymodel")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.content.decode("utf-8"))["data"], [])
+
+    def test_bulk_create_invalidates(self):
+        self.client.get("/myapp/anymodel")
+        self.client.post(
+            "/myapp/anymodel/bulk",
+            json.dumps([{"department": "a", "spots": 1, "any_date": "2010-10-10"}]),
+            content_type="application/json")
+        resp = self.client.get("/myapp/anymodel")
+        self.assertEqual(len(json.loads(resp.content.decode("utf-8"))["data"]), 1)
+
+    def test_delete_invalidates(self):
+        from .models import Anymodel
+        obj = Anymodel.objects.create(department="d", spots=1, any_date="2011-11-11")
+        version = get_version("anymodel")
+        self.client.get("/myapp/anymodel")
+        obj.delete()
+        self.assertGreater(get_version("anymodel"), version)
+        resp = self.client.get("/myapp/anymodel")
+        self.assertEqual(json.loads(resp.content.decode("utf-8"))["data"], [])
+
+    def test_versions_cached(self):
+        from .cache import EntityVersion, get_backend, version_key
+        version = get_version("anymodel")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_version("anymodel"), version)
+        # the row is what counts once the copy is gone
+        EntityVersion.objects.filter(entity="anymodel").update(version=version + 5)
+        get_backend().delete(version_key("anymodel", "default"))
+        self.assertEqual(get_version("anymodel"), version + 5)
+
+class FilterTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "indexedmodel": {
+            "title": "Indexed title",
+            "index_together": [["department", "spots"], ["department", "nofield"]],
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char", "index": true},
+            {"id": "spots", "title": "Spots title", "type": "integer", "index": true},
+            {"id": "code", "title": "Code title", "type": "char", "unique": true},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        from .models import Indexedmodel
+        Indexedmodel.objects.create(department="a", spots=3, code="c1", any_date="2010-10-10")
+        Indexedmodel.objects.create(department="b", spots=1, code="c2", any_date="2011-10-10")
+        Indexedmodel.objects.create(department="a", spots=2, code="c3", any_date="2012-10-10")
+
+    def get_json(self, url):
+        resp = self.client.get(url)
+        return resp.status_code, json.loads(resp.content.decode("utf-8"))
+
+    def test_load_indexes(self):
+        from .models import Indexedmodel
+        self.assertTrue(Indexedmodel._meta.get_field("department").db_index)
+        self.assertTrue(Indexedmodel._meta.get_field("code").unique)
+        self.assertFalse(Indexedmodel._meta.get_field("any_date").db_index)
+        self.assertEqual(
+            Indexedmodel._meta.index_together, (("department", "spots"),))
+
+    def test_load_does_not_share_field_args(self):
+        self.assertNotIn("db_index", ModelsLoader.field_map["char"][1])
+
+    def test_filter_exact(self):
+        status, d = self.get_json("/myapp/indexedmodel?department=a")
+        self.assertEqual(status, 200)
+        self.assertEqual([o["id"] for o in d["data"]], ["1", "3"])
+
+    def test_filter_range(self):
+        status, d = self.get_json("/myapp/indexedmodel?spots__gte=2&spots__lt=3")
+        self.assertEqual([o["id"] for o in d["data"]], ["3"])
+
+    def test_order(self):
+        status, d = self.get_json("/myapp/indexedmodel?order=-spots")
+        self.assertEqual([o["id"] for o in d["data"]], ["1", "3", "2"])
+        status, d = self.get_json("/myapp/indexedmodel?order=department&limit=2")
+        self.assertEqual([o["id"] for o in d["data"]], ["1", "3"])
+        self.assertNotIn("next", d)
+
+    def test_filter_not_indexed(self):
+        status, d = self.get_json("/myapp/indexedmodel?any_date__lt=2011-01-01")
+        self.assertEqual(status, 400)
+        self.assertIn("any_date__lt", d)
+        status, d = self.get_json("/myapp/indexedmodel?order=any_date")
+        self.assertEqual(status, 400)
+        self.assertIn("order", d)
+
+    def test_filter_invalid(self):
+        status, d = self.get_json("/myapp/indexedmodel?spots=x")
+        self.assertEqual(status, 400)
+        self.assertIn("spots", d)
+        status, d = self.get_json("/myapp/indexedmodel?spots__contains=1")
+        self.assertEqual(status, 400)
+        status, d = self.get_json("/myapp/indexedmodel?order=-spots&after=1")
+        self.assertEqual(status, 400)
+        self.assertIn("after", d)
+
+class SchemaReloaderTest(TestCase):
+    def setUp(self):
+        self.schema = {
+            "reloadone": {
+                "title": "One title",
+                "fields": [
+                {"id": "name", "title": "Name title", "type": "char"}
+                ]},
+            "reloadtwo": {
+                "title": "Two title",
+                "fields": [
+                {"id": "spots", "title": "Spots title", "type": "integer"}
+                ]}
+        }
+        fd, self.path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        self.write_schema()
+        self.registry = ModelsRegistry()
+        self.reloader = SchemaReloader(self.path, registry=self.registry)
+        self.reloader.check(force=True)
+
+    def tearDown(self):
+        os.remove(self.path)
+        for name in ("Reloadone", "Reloadtwo", "Reloadthree"):
+            ModelsLoader("{}").unload(name)
+
+    def write_schema(self):
+        with open(self.path, "w") as f:
+            f.write(json.dumps(self.schema))
+
+    def test_initial_load(self):
+        self.assertEqual(sorted(self.registry), ["reloadone", "reloadtwo"])
+        self.assertEqual(
+            self.registry["reloadone"]._meta.verbose_name_plural, "One title")
+
+    def test_unchanged_file_is_not_reloaded(self):
+        self.assertFalse(self.reloader.check(force=True))
+
+    def test_only_changed_models_rebuilt(self):
+        one = self.registry["reloadone"]
+        two = self.registry["reloadtwo"]
+        snapshot = self.registry.snapshot()
+        self.schema["reloadtwo"]["fields"].append(
+            {"id": "any_date", "title": "Date title", "type": "date"})
+        self.write_schema()
+        self.assertTrue(self.reloader.check(force=True))
+        self.assertIs(self.registry["reloadone"], one)
+        self.assertIsNot(self.registry["reloadtwo"], two)
+        fn = [f.name for f in visible_fields(self.registry["reloadtwo"])]
+        self.assertEqual(fn, ["id", "spots", "any_date"])
+        # readers holding the old snapshot are not affected
+        self.assertIs(snapshot["reloadtwo"], two)
+
+    def test_models_added_and_removed(self):
+        del self.schema["reloadone"]
+        self.schema["reloadthree"] = {
+            "title": "Three title",
+            "fields": [{"id": "name", "title": "Name title", "type": "char"}]}
+        self.write_schema()
+        self.reloader.check(force=True)
+        self.assertEqual(sorted(self.registry), ["reloadthree", "reloadtwo"])
+        from . import models as models_module
+        self.assertFalse(hasattr(models_module, "Reloadone"))
+
+class CompiledSaveTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+
+    def save_both(self, **kwargs):
+        from .models import Anymodel
+        results = []
+        for save in (model_save, Anymodel.save):
+            obj = Anymodel(**kwargs)
+            try:
+                save(obj)
+                results.append(
+                    ("ok", obj.department, obj.spots, obj.any_date))
+                obj.delete()
+            except ValidationError as e:
+                results.append(("error", e.message_dict))
+        return results
+
+    def test_escape(self):
+        s = "<a href='x'>\"&amp;\"</a>"
+        self.assertEqual(
+            escape(s),
+            s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            .replace("'", "&#39;").replace("\"", "&quot;"))
+        s = "nothing to escape"
+        self.assertIs(escape(s), s)
+
+    def test_same_as_generic_save(self):
+        cases = [
+            {"department": "<>&'\"", "spots": 2, "any_date": datetime.date(2012, 11, 11)},
+            {"department": "d", "spots": "3", "any_date": "2012-11-11"},
+            {"department": "d" * 200, "spots": 2147483647, "any_date": "2012-11-11"},
+            {"department": "d" * 201, "spots": 2147483648, "any_date": "2012-11-11z"},
+            {"department": "", "spots": None, "any_date": None},
+            {"department": "d", "spots": "a", "any_date": "2012-11-11"},
+            {"department": 5, "spots": -2147483649, "any_date": "2012-11-11"},
+        ]
+        for kwargs in cases:
+            generic, compiled = self.save_both(**kwargs)
+            self.assertEqual(generic, compiled, kwargs)
+
+    def test_duplicate_explicit_pk(self):
+        from .models import Anymodel
+        Anymodel.objects.create(id=5, department="d", spots=1, any_date="2012-11-11")
+        with self.assertRaises(ValidationError) as cm:
+            Anymodel.objects.create(id=5, department="d", spots=1, any_date="2012-11-11")
+        self.assertIn("id", cm.exception.message_dict)
+
+    def test_benchmark_save(self):
+        from .benchmarks import bench_save
+        result = bench_save(rows=10)
+        self.assertEqual(result["generic"]["count"], 10)
+        self.assertEqual(result["compiled"]["count"], 10)
+        self.assertEqual(result["prepare"]["compiled"]["count"], 10)
+
+class BenchmarkCommandTest(TestCase):
+    def test_benchmark_json_output(self):
+        out = StringIO()
+        call_command(
+            "benchmark", "loader", "serialize", "escape",
+            sizes="10,20", entities="1,3", iterations=2, stdout=out)
+        d = json.loads(out.getvalue())
+        self.assertIn("environment", d)
+        self.assertEqual(sorted(d["results"]["loader"]), ["1", "3"])
+        self.assertEqual(d["results"]["serialize"]["20"]["count"], 20)
+        self.assertIn("all_special", d["results"]["escape"])
+
+    def test_benchmark_unknown(self):
+        with self.assertRaises(CommandError):
+            call_command("benchmark", "nosuchbench", stdout=StringIO())
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        response_cache.clear()
+        for histogram in HISTOGRAMS:
+            histogram.clear()
+
+    def test_histogram_render(self):
+        h = Histogram("test_seconds", "Test.", (1, 2), ("view",))
+        h.observe(0.5, view="a")
+        h.observe(1.5, view="a")
+        h.observe(3, view="a")
+        lines = h.render()
+        self.assertIn('test_seconds_bucket{view="a",le="1.0"} 1', lines)
+        self.assertIn('test_seconds_bucket{view="a",le="2.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{view="a",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_sum{view="a"} 5.0', lines)
+        self.assertIn('test_seconds_count{view="a"} 3', lines)
+
+    def test_server_timing_header(self):
+        from .models import Anymodel
+        Anymodel.objects.create(department="d", spots=1, any_date="2011-11-11")
+        resp = self.client.get("/myapp/anymodel")
+        timing = resp["Server-Timing"]
+        for phase in ("fetch", "serialize", "json", "reverse", "total"):
+            self.assertIn(phase + ";dur=", timing)
+
+    def test_metrics_endpoint(self):
+        from .models import Anymodel
+        Anymodel.objects.create(department="d", spots=1, any_date="2011-11-11")
+        self.client.get("/myapp/anymodel")
+        resp = self.client.get("/myapp/metrics")
+        self.assertEqual(resp.status_code, 200)
+        text = resp.content.decode("utf-8")
+        self.assertIn(
+            'myapp_request_duration_seconds_count{entity="anymodel",view="EntityView",method="GET"} 1',
+            text)
+        self.assertIn(
+            'myapp_response_rows_count{entity="anymodel",view="EntityView"} 1', text)
+        self.assertIn(
+            'myapp_request_queries_count{entity="anymodel",view="EntityView"} 1', text)
+
+    def test_queries_counted_without_debug_cursor(self):
+        from django.db import connection
+        self.client.get("/myapp/anymodel")
+        before = connection.queries_run
+        self.client.get("/myapp/anymodel?limit=1")
+        self.assertGreater(connection.queries_run, before)
+        # nothing keeps the sql of every statement
+        self.assertFalse(connection.use_debug_cursor)
+
+class AggregateTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        from .models import Anymodel
+        Anymodel.objects.create(department="a", spots=1, any_date="2010-10-10")
+        Anymodel.objects.create(department="a", spots=3, any_date="2011-10-10")
+        Anymodel.objects.create(department="b", spots=5, any_date="2012-10-10")
+
+    def get_json(self, url):
+        resp = self.client.get(url)
+        return resp.status_code, json.loads(resp.content.decode("utf-8"))
+
+    def test_field_type(self):
+        from .models import Anymodel
+        self.assertEqual(ModelsLoader.field_type(Anymodel._meta.fields[1]), "char")
+        self.assertEqual(ModelsLoader.field_type(Anymodel._meta.fields[2]), "integer")
+        self.assertEqual(ModelsLoader.field_type(Anymodel._meta.fields[3]), "date")
+        self.assertIsNone(ModelsLoader.field_type(Anymodel._meta.fields[0]))
+
+    def test_group_by(self):
+        status, d = self.get_json(
+            "/myapp/anymodel/aggregate?group_by=department&sum=spots&count=1&min=any_date")
+        self.assertEqual(status, 200)
+        self.assertEqual(d["group_by"], ["department"])
+        self.assertEqual(d["data"], [
+            {"department": "a", "spots__sum": 4, "count": 2, "any_date__min": "2010-10-10"},
+            {"department": "b", "spots__sum": 5, "count": 1, "any_date__min": "2012-10-10"}])
+
+    def test_without_group_by(self):
+        status, d = self.get_json("/myapp/anymodel/aggregate?avg=spots&max=any_date,spots")
+        self.assertEqual(status, 200)
+        self.assertEqual(d["data"], [
+            {"spots__avg": 3.0, "spots__max": 5, "any_date__max": "2012-10-10"}])
+
+    def test_meaningless_aggregates_rejected(self):
+        status, d = self.get_json("/myapp/anymodel/aggregate?sum=any_date&avg=department")
+        self.assertEqual(status, 400)
+        self.assertIn("sum", d)
+        self.assertIn("avg", d)
+        status, d = self.get_json("/myapp/anymodel/aggregate?group_by=department")
+        self.assertEqual(status, 400)
+        status, d = self.get_json("/myapp/anymodel/aggregate?group_by=nofield&count=1")
+        self.assertEqual(status, 400)
+        self.assertIn("group_by", d)
+
+    def test_list_and_aggregate_cached_apart(self):
+        list_resp = self.client.get("/myapp/anymodel?count=1")
+        self.assertEqual(list_resp.status_code, 200)
+        self.assertIn("fields", json.loads(list_resp.content.decode("utf-8")))
+        status, d = self.get_json("/myapp/anymodel/aggregate?count=1")
+        self.assertEqual(status, 200)
+        self.assertNotIn("fields", d)
+        agg_resp = self.client.get("/myapp/anymodel/aggregate?count=1")
+        self.assertNotEqual(list_resp["ETag"], agg_resp["ETag"])
+        resp = self.client.get("/myapp/anymodel?count=1")
+        self.assertEqual(resp.content, list_resp.content)
+        resp = self.client.get(
+            "/myapp/anymodel/aggregate?count=1", HTTP_IF_NONE_MATCH=list_resp["ETag"])
+        self.assertEqual(resp.status_code, 200)
+
+    def test_single_query(self):
+        response_cache.clear()
+        bump_version("anymodel")
+        get_version("anymodel")
+        with self.assertNumQueries(1):
+            self.client.get(
+                "/myapp/anymodel/aggregate?group_by=department&sum=spots&count=1")
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "searchmodel": {
+            "title": "Search title",
+            "fields": [
+            {"id": "name", "title": "Name title", "type": "char"},
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        response_cache.clear()
+        from .models import Searchmodel
+        Searchmodel.objects.create(name="Tom & Jerry", department="sales", spots=1)
+        Searchmodel.objects.create(name="Alice", department="marketing", spots=2)
+
+    def search_ids(self, q):
+        resp = self.client.get("/myapp/searchmodel", {"q": q})
+        self.assertEqual(resp.status_code, 200)
+        d = json.loads(resp.content.decode("utf-8"))
+        return [o["id"] for o in d["data"]]
+
+    def test_search_any_char_field(self):
+        self.assertEqual(self.search_ids("alice"), ["2"])
+        self.assertEqual(self.search_ids("sales"), ["1"])
+
+    def test_search_prefix_and_all_words(self):
+        self.assertEqual(self.search_ids("jer"), ["1"])
+        self.assertEqual(self.search_ids("alice sales"), [])
+
+    def test_search_escaped_text(self):
+        self.assertEqual(self.search_ids("Tom & Jerry"), ["1"])
+
+    def test_search_follows_writes(self):
+        from .models import Searchmodel
+        obj = Searchmodel.objects.get(pk=2)
+        obj.department = "support"
+        obj.save()
+        Searchmodel.objects.bulk_create(
+            [Searchmodel(name="Bob", department="support", spots=3)])
+        self.assertEqual(self.search_ids("marketing"), [])
+        self.assertEqual(self.search_ids("support"), ["2", "3"])
+        Searchmodel.objects.filter(pk=3).delete()
+        self.assertEqual(self.search_ids("support"), ["2"])
+
+    def test_search_uses_index(self):
+        from .models import Searchmodel
+        from .search import get_search_backend
+        from django.db import connection
+        if connection.vendor in ("sqlite", "postgresql"):
+            self.assertTrue(get_search_backend("default").indexed)
+
+class SchemaSnapshotTest(TestCase):
+    def setUp(self):
+        self.schema = {
+            "snapone": {
+                "title": "One title",
+                "index_together": [["name", "spots"]],
+                "fields": [
+                {"id": "name", "title": "Name title", "type": "char", "index": True},
+                {"id": "spots", "title": "Spots title", "type": "integer"}
+                ]}
+        }
+        self.cache_dir = tempfile.mkdtemp()
+        fd, self.path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        with open(self.path, "w") as f:
+            f.write(json.dumps(self.schema))
+
+    def tearDown(self):
+        os.remove(self.path)
+        for name in os.listdir(self.cache_dir):
+            os.remove(os.path.join(self.cache_dir, name))
+        os.rmdir(self.cache_dir)
+        ModelsLoader().unload("Snapone")
+
+    def boot(self):
+        reloader = SchemaReloader(self.path, registry=ModelsRegistry())
+        reloader.check(force=True)
+        return reloader
+
+    def test_second_boot_uses_snapshot(self):
+        with self.settings(SCHEMA_CACHE_DIR=self.cache_dir):
+            first = self.boot()
+            second = self.boot()
+        self.assertEqual(first.specs_source, "parsed")
+        self.assertEqual(second.specs_source, "snapshot")
+        self.assertEqual(first.specs, second.specs)
+        self.assertEqual(sorted(second.timings), ["build", "read", "specs"])
+        model = second.registry["snapone"]
+        self.assertEqual(model._meta.index_together, (("name", "spots"),))
+        self.assertTrue(model._meta.get_field("name").db_index)
+
+    def test_snapshot_keyed_by_content(self):
+        with self.settings(SCHEMA_CACHE_DIR=self.cache_dir):
+            reloader = self.boot()
+            self.assertIsNotNone(cached_specs(reloader.digest))
+            self.assertIsNone(cached_specs("0" * 40))
+            store_specs("0" * 40, {})
+            # only the latest schema is kept
+            self.assertIsNone(cached_specs(reloader.digest))
+            self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_broken_snapshot_is_ignored(self):
+        with self.settings(SCHEMA_CACHE_DIR=self.cache_dir):
+            reloader = self.boot()
+            name = os.listdir(self.cache_dir)[0]
+            with open(os.path.join(self.cache_dir, name), "wb") as f:
+                f.write(b"garbage")
+            self.assertIsNone(cached_specs(reloader.digest))
+            self.assertEqual(self.boot().specs_source, "parsed")
+
+    def test_old_format_is_ignored(self):
+        from . import specs
+        with self.settings(SCHEMA_CACHE_DIR=self.cache_dir):
+            reloader = self.boot()
+            path = specs.snapshot_path(reloader.digest)
+            with open(path, "rb") as f:
+                fmt, digest, stored = marshal.load(f)
+            with open(path, "wb") as f:
+                marshal.dump((fmt - 1, digest, stored), f)
+            self.assertIsNone(cached_specs(reloader.digest))
+            self.assertEqual(self.boot().specs_source, "parsed")
+
+    def test_disabled_snapshot(self):
+        with self.settings(SCHEMA_CACHE_DIR=None):
+            self.assertFalse(store_specs("0" * 40, {}))
+            self.assertEqual(self.boot().specs_source, "parsed")
+            self.assertEqual(self.boot().specs_source, "parsed")
+
+class LazyRegistryTest(TestCase):
+    def setUp(self):
+        self.schema = {
+            "lazyone": {
+                "title": "One title",
+                "fields": [
+                {"id": "name", "title": "Name title", "type": "char"}
+                ]},
+            "lazytwo": {
+                "title": "Two title",
+                "fields": [
+                {"id": "spots", "title": "Spots title", "type": "integer"}
+                ]}
+        }
+        fd, self.path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        self.write_schema()
+        self.registry = ModelsRegistry()
+        self.reloader = SchemaReloader(self.path, registry=self.registry)
+        self.reloader.check(force=True)
+
+    def tearDown(self):
+        os.remove(self.path)
+        for name in ("Lazyone", "Lazytwo"):
+            ModelsLoader().unload(name)
+
+    def write_schema(self):
+        with open(self.path, "w") as f:
+            f.write(json.dumps(self.schema))
+
+    def test_nothing_built_at_load(self):
+        from . import models as models_module
+        self.assertEqual(sorted(self.registry), ["lazyone", "lazytwo"])
+        self.assertIn("lazyone", self.registry)
+        self.assertEqual(
+            self.registry.titles(),
+            {"lazyone": "One title", "lazytwo": "Two title"})
+        self.assertFalse(self.registry.is_built("lazyone"))
+        self.assertFalse(self.registry.is_built("lazytwo"))
+        self.assertFalse(hasattr(models_module, "Lazyone"))
+
+    def test_built_on_first_lookup(self):
+        one = self.registry["lazyone"]
+        self.assertTrue(issubclass(one, models.Model))
+        self.assertEqual(one._meta.verbose_name_plural, "One title")
+        self.assertIs(self.registry["lazyone"], one)
+        self.assertIs(self.registry.get("lazyone"), one)
+        self.assertFalse(self.registry.is_built("lazytwo"))
+        self.assertIsNone(self.registry.get("lazythree"))
+
+    def test_values_build_everything(self):
+        built = sorted(model.__name__ for model in self.registry.values())
+        self.assertEqual(built, ["Lazyone", "Lazytwo"])
+        self.assertTrue(self.registry.is_built("lazytwo"))
+
+    def test_reload_keeps_unchanged_models_lazy(self):
+        self.schema["lazytwo"]["title"] = "New title"
+        self.write_schema()
+        self.assertTrue(self.reloader.check(force=True))
+        self.assertFalse(self.registry.is_built("lazyone"))
+        self.assertTrue(self.registry.is_built("lazytwo"))
+        self.assertEqual(self.registry.titles()["lazytwo"], "New title")
+
+    def test_materialize_all(self):
+        self.registry.materialize_all()
+        self.assertTrue(self.registry.is_built("lazyone"))
+        self.assertTrue(self.registry.is_built("lazytwo"))
+
+    def test_reload_waits_for_a_build(self):
+        started, release = threading.Event(), threading.Event()
+
+        class SlowPending(PendingModel):
+            def build(self):
+                started.set()
+                release.wait(5)
+                return PendingModel.build(self)
+
+        pending = self.registry.snapshot()["lazyone"]
+        models_dict = dict(self.registry.snapshot())
+        models_dict["lazyone"] = SlowPending(pending.model_name, pending.spec)
+        self.registry.swap(models_dict)
+        builder = threading.Thread(target=lambda: self.registry["lazyone"])
+        builder.start()
+        started.wait(5)
+        self.schema["lazyone"]["fields"].append(
+            {"id": "spots", "title": "Spots title", "type": "integer"})
+        self.write_schema()
+        reloader = threading.Thread(target=lambda: self.reloader.check(force=True))
+        reloader.start()
+        reloader.join(0.2)
+        # the swap waits for the build of the old spec
+        self.assertTrue(reloader.is_alive())
+        release.set()
+        builder.join(5)
+        reloader.join(5)
+        names = [f.name for f in self.registry["lazyone"]._meta.fields]
+        self.assertIn("spots", names)
+
+class FormatTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        response_cache.clear()
+        from .models import Anymodel
+        for i in range(3):
+            Anymodel.objects.create(
+                department="dept, \"{}\"".format(i), spots=i, any_date="2014-01-0{}".format(i + 1))
+
+    def test_default_is_unchanged(self):
+        resp = self.client.get("/myapp/anymodel")
+        self.assertEqual(resp["Content-Type"], "application/json")
+        d = json.loads(resp.content.decode("utf-8"))
+        self.assertEqual(d["data"][0]["spots"], "0")
+
+    def test_columnar(self):
+        resp = self.client.get("/myapp/anymodel", {"format": "columnar"})
+        self.assertEqual(resp.status_code, 200)
+        d = json.loads(resp.content.decode("utf-8"))
+        self.assertEqual([f[0] for f in d["fields"]], ["id", "department", "spots", "any_date"])
+        self.assertNotIn("data", d)
+        self.assertEqual(d["columns"][0], [1, 2, 3])
+        self.assertEqual(d["columns"][2], [0, 1, 2])
+        self.assertEqual(d["columns"][3], ["2014-01-01", "2014-01-02", "2014-01-03"])
+        self.assertIn("post_url", d)
+
+    def test_columnar_empty(self):
+        resp = self.client.get("/myapp/anymodel", {"format": "columnar", "after": 3})
+        d = json.loads(resp.content.decode("utf-8"))
+        self.assertEqual(d["columns"], [[], [], [], []])
+
+    def test_csv(self):
+        resp = self.client.get("/myapp/anymodel", {"format": "csv", "limit": 2})
+        self.assertEqual(resp["Content-Type"], "text/csv; charset=utf-8")
+        self.assertEqual(resp["X-Next-Cursor"], "2")
+        lines = resp.content.decode("utf-8").splitlines()
+        self.assertEqual(lines[0], "id,department,spots,any_date")
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1], '1,"dept, &quot;0&quot;",0,2014-01-01')
+
+    def test_ndjson_from_accept_header(self):
+        resp = self.client.get("/myapp/anymodel", HTTP_ACCEPT="application/x-ndjson")
+        self.assertEqual(resp["Content-Type"], "application/x-ndjson")
+        lines = resp.content.decode("utf-8").splitlines()
+        head = json.loads(lines[0])
+        self.assertEqual(len(head["fields"]), 4)
+        self.assertEqual(json.loads(lines[1]), [1, "dept, &quot;0&quot;", 0, "2014-01-01"])
+        self.assertEqual(len(lines), 4)
+
+    def test_stream_formats(self):
+        resp = self.client.get("/myapp/anymodel", {"format": "ndjson", "stream": 1})
+        lines = b"".join(resp.streaming_content).decode("utf-8").splitlines()
+        self.assertEqual(len(lines), 4)
+        resp = self.client.get("/myapp/anymodel", {"format": "csv", "stream": 1})
+        lines = b"".join(resp.streaming_content).decode("utf-8").splitlines()
+        self.assertEqual(len(lines), 4)
+        resp = self.client.get("/myapp/anymodel", {"format": "columnar", "stream": 1})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_unknown_format(self):
+        resp = self.client.get("/myapp/anymodel", {"format": "xml"})
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("format", json.loads(resp.content.decode("utf-8")))
+
+    def test_cache_keeps_formats_apart(self):
+        json_resp = self.client.get("/myapp/anymodel")
+        csv_resp = self.client.get("/myapp/anymodel", HTTP_ACCEPT="text/csv")
+        self.assertNotEqual(json_resp["ETag"], csv_resp["ETag"])
+        self.assertEqual(csv_resp["Vary"], "Accept")
+        with self.assertNumQueries(0):
+            resp = self.client.get("/myapp/anymodel", HTTP_ACCEPT="text/csv")
+        self.assertEqual(resp["Content-Type"], "text/csv; charset=utf-8")
+        self.assertEqual(resp.content, csv_resp.content)
+
+class ImportCommandTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char", "unique": true},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        # the flags above need a fresh class, not one an earlier test built
+        ModelsLoader().unload("Anymodel")
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        ModelsLoader().unload("Anymodel")
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def run_import(self, path, **options):
+        out = StringIO()
+        call_command("import_entity", "anymodel", path, stdout=out, **options)
+        return out.getvalue()
+
+    def read_rejects(self, path):
+        with open(path + ".rejects.ndjson") as f:
+            return [json.loads(line) for line in f]
+
+    def test_csv_import(self):
+        from .models import Anymodel
+        path = self.write("rooms.csv",
+            "department,Spots title,any_date,extra\n"
+            "<b>sales</b>,1,2014-01-01,x\n"
+            "hr,2,2014-01-02,x\n")
+        out = self.run_import(path, commit_rows=1)
+        self.assertIn("2 rows, 2 imported, 0 rejected", out)
+        self.assertIn("Ignored columns: extra", out)
+        self.assertEqual(Anymodel.objects.count(), 2)
+        obj = Anymodel.objects.get(spots=1)
+        self.assertEqual(obj.department, "&lt;b&gt;sales&lt;/b&gt;")
+        self.assertEqual(obj.any_date, datetime.date(2014, 1, 1))
+        self.assertFalse(os.path.exists(path + ".rejects.ndjson"))
+
+    def test_bad_rows_rejected(self):
+        from .models import Anymodel
+        path = self.write("rooms.csv",
+            "department,spots,any_date\n"
+            "a,1,2014-01-01\n"
+            "b,2147483648,2014-01-01\n"
+            ",3,2014-01-01\n"
+            "c,4\n"
+            "d,6,not a date\n")
+        out = self.run_import(path)
+        self.assertIn("5 rows, 1 imported, 4 rejected", out)
+        self.assertIn("Rejected rows written to", out)
+        self.assertEqual(list(Anymodel.objects.values_list("department", flat=True)), ["a"])
+        rejects = self.read_rejects(path)
+        self.assertEqual([r["line"] for r in rejects], [3, 4, 5, 6])
+        self.assertIn("spots", rejects[0]["errors"])
+        self.assertIn("department", rejects[1]["errors"])
+        self.assertEqual(rejects[2]["errors"], {"__all__": ["Malformed row."]})
+        self.assertEqual(rejects[2]["row"], {"department": "c", "spots": "4"})
+        self.assertIn("any_date", rejects[3]["errors"])
+
+    def test_duplicates_within_batch(self):
+        from .models import Anymodel
+        path = self.write("rooms.csv",
+            "department,spots,any_date\n"
+            "a,1,2014-01-01\n"
+            "b,2,2014-01-01\n"
+            "a,3,2014-01-01\n")
+        out = self.run_import(path)
+        self.assertIn("3 rows, 2 imported, 1 rejected", out)
+        self.assertEqual(Anymodel.objects.count(), 2)
+        self.assertEqual(self.read_rejects(path)[0]["line"], 4)
+
+    def test_ndjson_import(self):
+        from .models import Anymodel
+        path = self.write("rooms.ndjson",
+            '{"department": "a", "spots": 1, "any_date": "2014-01-01"}\n'
+            '\n'
+            '{"department": "b", "spots": "x", "any_date": "2014-01-01"}\n'
+            '[1, 2]\n'
+            'not json\n')
+        out = self.run_import(path)
+        self.assertIn("4 rows, 1 imported, 3 rejected", out)
+        self.assertEqual(Anymodel.objects.get().department, "a")
+        self.assertEqual([r["line"] for r in self.read_rejects(path)], [3, 4, 5])
+
+    def test_ndjson_list_format_round_trip(self):
+        from .models import Anymodel
+        Anymodel.objects.create(department="sales", spots=1, any_date="2014-01-01")
+        resp = self.client.get("/myapp/anymodel", {"format": "ndjson"})
+        Anymodel.objects.all().delete()
+        path = self.write("rooms.ndjson", resp.content.decode("utf-8"))
+        out = self.run_import(path)
+        self.assertIn("1 rows, 1 imported, 0 rejected", out)
+        obj = Anymodel.objects.get()
+        self.assertEqual(obj.pk, 1)
+        self.assertEqual(obj.department, "sales")
+        self.assertEqual(obj.any_date, datetime.date(2014, 1, 1))
+
+    def test_bad_arguments(self):
+        path = self.write("rooms.txt", "")
+        with self.assertRaises(CommandError):
+            call_command("import_entity", "nosuchentity", path, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command("import_entity", "anymodel", path, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command("import_entity", "anymodel", stdout=StringIO())
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char", "index": true},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        # the flags above need a fresh class, not one an earlier test built
+        ModelsLoader().unload("Anymodel")
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        from .models import Anymodel
+        for i in range(5):
+            Anymodel.objects.create(
+                department="d{}".format(i % 2), spots=i, any_date="2014-01-0{}".format(i + 1))
+
+
+    def tearDown(self):
+        ModelsLoader().unload("Anymodel")
+    def download(self, **params):
+        resp = self.client.get("/myapp/anymodel/export", params)
+        self.assertEqual(resp.status_code, 200)
+        return resp, b"".join(resp.streaming_content)
+
+    def test_csv_download(self):
+        resp, content = self.download()
+        self.assertEqual(resp["Content-Type"], "text/csv; charset=utf-8")
+        self.assertEqual(
+            resp["Content-Disposition"], 'attachment; filename="anymodel.csv"')
+        lines = content.decode("utf-8").splitlines()
+        self.assertEqual(lines[0], "id,department,spots,any_date")
+        self.assertEqual(lines[1:3], ["1,d0,0,2014-01-01", "2,d1,1,2014-01-02"])
+        self.assertEqual(len(lines), 6)
+
+    def test_ndjson_gzip_download(self):
+        resp, content = self.download(format="ndjson", gzip=1)
+        self.assertEqual(resp["Content-Type"], "application/gzip")
+        self.assertIn("anymodel.ndjson.gz", resp["Content-Disposition"])
+        lines = gzip.decompress(content).decode("utf-8").splitlines()
+        self.assertEqual(len(json.loads(lines[0])["fields"]), 4)
+        self.assertEqual(json.loads(lines[5]), [5, "d0", 4, "2014-01-05"])
+
+    def test_filtered_and_resumed(self):
+        _, content = self.download(department="d1")
+        self.assertEqual(len(content.decode("utf-8").splitlines()), 3)
+        _, content = self.download(after=3)
+        ids = [line.split(",")[0] for line in content.decode("utf-8").splitlines()[1:]]
+        self.assertEqual(ids, ["4", "5"])
+
+    def test_bad_params(self):
+        resp = self.client.get("/myapp/anymodel/export", {"format": "xml"})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get("/myapp/anymodel/export", {"order": "department"})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_export_in_chunks(self):
+        from .models import Anymodel
+        out = BytesIO()
+        with self.assertNumQueries(3):
+            rows = export(Anymodel.objects.all(), out, chunk_size=2)
+        self.assertEqual(rows, 5)
+        self.assertEqual(len(out.getvalue().decode("utf-8").splitlines()), 6)
+
+    def test_export_command(self):
+        fd, path = tempfile.mkstemp(suffix=".csv.gz")
+        os.close(fd)
+        try:
+            out = StringIO()
+            call_command("export_entity", "anymodel", path, chunk_size=2, stdout=out)
+            self.assertIn("5 rows written to", out.getvalue())
+            with gzip.open(path, "rb") as f:
+                lines = f.read().decode("utf-8").splitlines()
+            self.assertEqual(len(lines), 6)
+        finally:
+            os.remove(path)
+        with self.assertRaises(CommandError):
+            call_command("export_entity", "nosuchentity", stdout=StringIO())
+
+class ObjectResponseTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        from .models import Anymodel
+        for i in range(10):
+            Anymodel.objects.create(department="d", spots=i, any_date="2014-01-01")
+
+    def test_add_returns_object(self):
+        # the version bump of the stamp (update, read), the insert, the
+        # row counter and the version read
+        with self.assertNumQueries(5):
+            resp = self.client.post(
+                "/myapp/anymodel/add?response=object",
+                {"department": "<b>", "spots": "5", "any_date": "2011-11-11"})
+        self.assertEqual(resp.status_code, 200)
+        d = json.loads(resp.content.decode("utf-8"))
+        self.assertNotIn("data", d)
+        self.assertEqual(d["object"], {
+            "id": "11", "department": "&lt;b&gt;", "spots": "5", "any_date": "2011-11-11"})
+        self.assertEqual(len(d["fields"]), 4)
+        self.assertEqual(d["version"], get_version("anymodel"))
+
+    def test_update_returns_object(self):
+        version = get_version("anymodel")
+        # the lookup, the version bump of the stamp, the update and the
+        # version read
+        with self.assertNumQueries(5):
+            resp = self.client.post(
+                "/myapp/anymodel/update/3?response=object",
+                {"department": "x", "spots": "7", "any_date": "2012-12-12"})
+        d = json.loads(resp.content.decode("utf-8"))
+        self.assertEqual(d["object"]["id"], "3")
+        self.assertEqual(d["object"]["spots"], "7")
+        self.assertGreater(d["version"], version)
+
+    def test_invalid_still_returns_errors(self):
+        resp = self.client.post(
+            "/myapp/anymodel/update/3?response=object",
+            {"department": "x", "spots": "many", "any_date": "2012-12-12"})
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("spots", json.loads(resp.content.decode("utf-8")))
+
+    def test_default_response_unchanged(self):
+        resp = self.client.post(
+            "/myapp/anymodel/add",
+            {"department": "x", "spots": "5", "any_date": "2011-11-11"})
+        self.assertEqual(len(json.loads(resp.content.decode("utf-8"))["data"]), 11)
+
+class SyncTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char", "index": true},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        # the flags above need a fresh class, not one an earlier test built
+        ModelsLoader().unload("Anymodel")
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        from .models import Anymodel
+        for i in range(3):
+            Anymodel.objects.create(department="d", spots=i, any_date="2014-01-01")
+
+    def tearDown(self):
+        ModelsLoader().unload("Anymodel")
+
+    def get(self, **params):
+        resp = self.client.get("/myapp/anymodel", params)
+        self.assertEqual(resp.status_code, 200)
+        return json.loads(resp.content.decode("utf-8"))
+
+    def ids(self, d):
+        return [row["id"] for row in d["data"]]
+
+    def test_stamp_is_hidden(self):
+        from .models import Anymodel
+        field = Anymodel._meta.get_field(STAMP_FIELD)
+        self.assertTrue(field.db_index)
+        self.assertFalse(field.editable)
+        d = self.get()
+        self.assertNotIn(STAMP_FIELD, [f[0] for f in d["fields"]])
+        self.assertNotIn(STAMP_FIELD, d["data"][0])
+        self.assertEqual(len(self.get(**{STAMP_FIELD: 0})["data"]), 3)
+
+    def test_since_returns_changes_only(self):
+        from .models import Anymodel
+        token = self.get()["token"]
+        self.assertEqual(self.get(since=token)["data"], [])
+        obj = Anymodel.objects.get(pk=2)
+        obj.spots = 10
+        obj.save()
+        Anymodel.objects.create(department="e", spots=4, any_date="2014-01-01")
+        d = self.get(since=token)
+        self.assertEqual(self.ids(d), ["2", "4"])
+        self.assertGreater(d["token"], token)
+        self.assertEqual(self.get(since=d["token"])["data"], [])
+
+    def test_since_reports_deletes(self):
+        from .models import Anymodel
+        token = self.get()["token"]
+        self.assertEqual(self.get(since=token)["deleted"], [])
+        self.assertNotIn("deleted", self.get())
+        Anymodel.objects.get(pk=2).delete()
+        Anymodel.objects.filter(pk=3).delete()
+        d = self.get(since=token)
+        self.assertEqual(d["data"], [])
+        self.assertEqual(d["deleted"], ["2", "3"])
+        self.assertEqual(self.get(since=d["token"])["deleted"], [])
+        resp = self.client.get("/myapp/anymodel", {"since": token, "format": "csv"})
+        self.assertEqual(resp["X-Deleted-Ids"], "2,3")
+
+    def test_stamp_is_the_version(self):
+        from .models import Anymodel
+        obj = Anymodel.objects.get(pk=1)
+        obj.save()
+        self.assertEqual(getattr(obj, STAMP_FIELD), get_version("anymodel"))
+        # a write rolled back takes its stamp's bump with it
+        version = get_version("anymodel")
+        try:
+            with transaction.atomic():
+                Anymodel.objects.create(department="e", spots=1, any_date="2014-01-01")
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.assertEqual(get_version("anymodel"), version)
+
+    def test_since_sees_bulk_writes(self):
+        token = self.get()["token"]
+        self.client.post(
+            "/myapp/anymodel/bulk",
+            json.dumps([{"department": "b", "spots": 5, "any_date": "2014-01-01"}]),
+            content_type="application/json")
+        d = self.get(since=token)
+        self.assertEqual(self.ids(d), ["4"])
+        self.client.post(
+            "/myapp/anymodel/bulk_update",
+            json.dumps({"objects": [{"pk": 1, "spots": 7}]}),
+            content_type="application/json")
+        self.assertEqual(self.ids(self.get(since=d["token"])), ["1"])
+        token = self.get()["token"]
+        self.client.post(
+            "/myapp/anymodel/bulk_update",
+            json.dumps({"filter": {"department": "d"}, "increment": {"spots": 1}}),
+            content_type="application/json")
+        self.assertEqual(self.ids(self.get(since=token)), ["1", "2", "3"])
+
+    def test_since_with_filters_and_pages(self):
+        from .models import Anymodel
+        token = self.get()["token"]
+        for obj in Anymodel.objects.all():
+            obj.save()
+        d = self.get(since=token, limit=2)
+        self.assertEqual(self.ids(d), ["1", "2"])
+        self.assertEqual(d["next"], 2)
+        d = self.get(since=token, limit=2, after=2)
+        self.assertEqual(self.ids(d), ["3"])
+        self.assertEqual(self.get(since=token, department="e")["data"], [])
+
+    def test_bad_since(self):
+        resp = self.client.get("/myapp/anymodel", {"since": "yesterday"})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_stamp_added_to_old_tables(self):
+        from django.db import connection
+        cursor = connection.cursor()
+        cursor.execute(
+            "CREATE TABLE myapp_oldmodel "
+            "(id integer NOT NULL PRIMARY KEY, name varchar(200) NOT NULL)")
+        cursor.execute("INSERT INTO myapp_oldmodel (id, name) VALUES (1, 'a')")
+        ModelsLoader("""
+        {"oldmodel": {"title": "Old title", "fields": [
+            {"id": "name", "title": "Name title", "type": "char"}]}}
+        """).load()
+        try:
+            call_command("syncdb")
+            from .models import Oldmodel
+            self.assertEqual(list(Oldmodel.objects.values_list(STAMP_FIELD, flat=True)), [0])
+        finally:
+            from .models import MODELS_MAP
+            del MODELS_MAP["oldmodel"]
+            ModelsLoader().unload("Oldmodel")
+
+class ReplicaRouterTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+        unpin()
+
+    def tearDown(self):
+        unpin()
+
+    def test_reads_go_to_replicas(self):
+        from .models import Anymodel
+        from django.contrib.auth.models import User
+        with self.settings(REPLICA_DATABASES=["replica1", "replica2"]):
+            self.assertIn(self.router.db_for_read(Anymodel), ["replica1", "replica2"])
+            self.assertIsNone(self.router.db_for_read(User))
+            self.assertEqual(self.router.db_for_write(Anymodel), "default")
+            self.assertFalse(self.router.allow_syncdb("replica1", Anymodel))
+            self.assertIsNone(self.router.allow_syncdb("default", Anymodel))
+            pin_primary()
+            self.assertIsNone(self.router.db_for_read(Anymodel))
+
+    def test_no_replicas(self):
+        from .models import Anymodel
+        self.assertIsNone(self.router.db_for_read(Anymodel))
+        self.assertEqual(self.router.db_for_write(Anymodel), "default")
+
+    def test_queryset_bound_when_built(self):
+        with self.settings(REPLICA_DATABASES=["replica"]):
+            view = EntityView(kwargs={"entity": "anymodel"})
+            queryset = view.get_queryset()
+            pin_primary()
+            self.assertEqual(queryset.db, "replica")
+            self.assertEqual(view.get_queryset().db, "default")
+
+    def test_replica_reads_cached_by_replica_version(self):
+        from .cache import get_backend, version_key
+        response_cache.clear()
+        version = get_version("anymodel")
+        with self.settings(REPLICA_DATABASES=["replica"]):
+            view = EntityView(kwargs={"entity": "anymodel"},
+                request=self.factory.get("/myapp/anymodel"))
+            # the replica has not got the last bump yet
+            get_backend().set(version_key("anymodel", "replica"), version - 1)
+            response = view.render_cached(
+                view.get_queryset(), lambda queryset: HttpResponse(queryset.db))
+            self.assertEqual(response.content, b"replica")
+            stale_etag = response["ETag"]
+            response = view.render_cached(view.get_queryset(), None)
+            self.assertEqual(response.content, b"replica")
+            pin_primary()
+            response = view.render_cached(
+                view.get_queryset(), lambda queryset: HttpResponse(queryset.db))
+            self.assertEqual(response.content, b"default")
+            self.assertNotEqual(response["ETag"], stale_etag)
+            # caught up, it serves what the primary had at that version
+            unpin()
+            get_backend().set(version_key("anymodel", "replica"), version)
+            response = view.render_cached(view.get_queryset(), None)
+            self.assertEqual(response.content, b"default")
+
+    def test_writes_pin_the_client(self):
+        middleware = ReplicaPinMiddleware()
+        with self.settings(REPLICA_DATABASES=["replica"]):
+            request = self.factory.post("/myapp/anymodel/add")
+            middleware.process_request(request)
+            self.assertTrue(is_pinned())
+            response = middleware.process_response(request, HttpResponse())
+            self.assertFalse(is_pinned())
+            cookie = response.cookies[REPLICA_PIN_COOKIE]
+            # the next read of the same client stays on the primary
+            request = self.factory.get("/myapp/anymodel")
+            request.COOKIES[REPLICA_PIN_COOKIE] = cookie.value
+            middleware.process_request(request)
+            self.assertTrue(is_pinned())
+            middleware.process_response(request, HttpResponse())
+            self.assertFalse(is_pinned())
+
+    def test_reads_and_failed_writes_do_not_pin(self):
+        middleware = ReplicaPinMiddleware()
+        with self.settings(REPLICA_DATABASES=["replica"]):
+            request = self.factory.get("/myapp/anymodel")
+            request.COOKIES[REPLICA_PIN_COOKIE] = "1"
+            middleware.process_request(request)
+            self.assertFalse(is_pinned())
+            response = middleware.process_response(request, HttpResponse())
+            self.assertNotIn(REPLICA_PIN_COOKIE, response.cookies)
+            request = self.factory.post("/myapp/anymodel/add")
+            middleware.process_request(request)
+            response = middleware.process_response(request, HttpResponse(status=400))
+            self.assertNotIn(REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_no_replicas_no_pin(self):
+        middleware = ReplicaPinMiddleware()
+        request = self.factory.post("/myapp/anymodel/add")
+        middleware.process_request(request)
+        self.assertFalse(is_pinned())
+        response = middleware.process_response(request, HttpResponse())
+        self.assertNotIn(REPLICA_PIN_COOKIE, response.cookies)
+
+class StaticAssetsTest(TestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        self.files = {
+            "myapp/js/app.js": b"var answer = 42;\n" * 200,
+            "myapp/css/app.css": b'body { background: url("../images/bg.png"); }\n' * 50,
+            "myapp/images/bg.png": os.urandom(512),
+        }
+        for name, data in self.files.items():
+            path = os.path.join(self.source, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as f:
+                f.write(data)
+        self.storage = CompressedStaticFilesStorage(location=self.root, base_url="/static/")
+        self.collect()
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+        shutil.rmtree(self.root)
+
+    # what collectstatic does: copy the files, then post_process() them
+    def collect(self):
+        source = FileSystemStorage(location=self.source)
+        paths = {}
+        for name in self.files:
+            with source.open(name) as f:
+                self.storage.save(name, f)
+            paths[name] = (source, name)
+        list(self.storage.post_process(paths))
+
+    def call(self, app, path, **environ):
+        environ.update({"PATH_INFO": path, "REQUEST_METHOD": environ.get("REQUEST_METHOD", "GET")})
+        result = {}
+        def start_response(status, headers):
+            result["status"] = status
+            result["headers"] = dict(headers)
+        result["body"] = b"".join(app(environ, start_response))
+        return result
+
+    def fallback(self, environ, start_response):
+        start_response("404 Not Found", [])
+        return [b"app"]
+
+    def test_collect_writes_manifest_and_variants(self):
+        with open(os.path.join(self.root, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        self.assertEqual(sorted(manifest), sorted(self.files))
+        hashed_js = manifest["myapp/js/app.js"]
+        self.assertRegex(hashed_js, r"^myapp/js/app\.[0-9a-f]{12}\.js$")
+        with open(os.path.join(self.root, hashed_js + ".gz"), "rb") as f:
+            self.assertEqual(gzip.GzipFile(fileobj=f).read(), self.files["myapp/js/app.js"])
+        # images are not compressed
+        self.assertFalse(os.path.exists(os.path.join(self.root, manifest["myapp/images/bg.png"] + ".gz")))
+        # css points to the hashed image
+        with open(os.path.join(self.root, manifest["myapp/css/app.css"]), "rb") as f:
+            self.assertIn(manifest["myapp/images/bg.png"].split("/")[-1].encode(), f.read())
+
+    def test_url_uses_manifest(self):
+        storage = CompressedStaticFilesStorage(location=self.root, base_url="/static/")
+        url = storage.url("myapp/js/app.js")
+        self.assertRegex(url, r"^/static/myapp/js/app\.[0-9a-f]{12}\.js$")
+        self.assertEqual(storage.url("myapp/js/missing.js"), "/static/myapp/js/missing.js")
+        with self.settings(DEBUG=True):
+            self.assertEqual(storage.url("myapp/js/app.js"), "/static/myapp/js/app.js")
+
+    def test_serves_negotiated_encoding(self):
+        app = StaticFilesApp(self.fallback, root=self.root, prefix="/static/")
+        url = self.storage.url("myapp/js/app.js")
+        plain = self.call(app, url)
+        self.assertEqual(plain["status"], "200 OK")
+        self.assertEqual(plain["body"], self.files["myapp/js/app.js"])
+        self.assertNotIn("Content-Encoding", plain["headers"])
+        self.assertIn("immutable", plain["headers"]["Cache-Control"])
+        self.assertEqual(plain["headers"]["Vary"], "Accept-Encoding")
+        self.assertIn("javascript", plain["headers"]["Content-Type"])
+        compressed = self.call(app, url, HTTP_ACCEPT_ENCODING="deflate, gzip;q=0.8")
+        self.assertEqual(compressed["headers"]["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(compressed["body"])).read(),
+            self.files["myapp/js/app.js"])
+        self.assertEqual(int(compressed["headers"]["Content-Length"]), len(compressed["body"]))
+        self.assertNotEqual(compressed["headers"]["ETag"], plain["headers"]["ETag"])
+        refused = self.call(app, url, HTTP_ACCEPT_ENCODING="gzip;q=0")
+        self.assertNotIn("Content-Encoding", refused["headers"])
+
+    def test_conditional_and_fallthrough(self):
+        app = StaticFilesApp(self.fallback, root=self.root, prefix="/static/")
+        first = self.call(app, "/static/myapp/js/app.js", HTTP_ACCEPT_ENCODING="gzip")
+        # unhashed names may change on the next deploy
+        self.assertNotIn("immutable", first["headers"]["Cache-Control"])
+        again = self.call(app, "/static/myapp/js/app.js", HTTP_ACCEPT_ENCODING="gzip",
+            HTTP_IF_NONE_MATCH=first["headers"]["ETag"])
+        self.assertEqual(again["status"], "304 Not Modified")
+        self.assertEqual(again["body"], b"")
+        head = self.call(app, "/static/myapp/js/app.js", REQUEST_METHOD="HEAD")
+        self.assertEqual(head["body"], b"")
+        self.assertEqual(self.call(app, "/static/myapp/js/app.js", REQUEST_METHOD="POST")["status"],
+            "405 Method Not Allowed")
+        self.assertEqual(self.call(app, "/static/" + MANIFEST_NAME)["body"], b"app")
+        self.assertEqual(self.call(app, "/static/myapp/js/app.js.gz")["body"], b"app")
+        self.assertEqual(self.call(app, "/myapp/")["body"], b"app")
+
+class PageCacheTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        page_cache.clear()
+
+    def tearDown(self):
+        # later tests get a class built from their own schema
+        ModelsLoader().unload("Anymodel")
+
+    def test_page_rendered_once(self):
+        first = self.client.get("/myapp/")
+        self.assertEqual(len(page_cache), 1)
+        second = self.client.get("/myapp/")
+        self.assertEqual(len(page_cache), 1)
+        self.assertContains(second, "\"anymodel\": [\"Rooms title\",")
+        self.assertEqual(first["ETag"], second["ETag"])
+
+    def test_csrf_token_is_per_client(self):
+        resp = self.client.get("/myapp/")
+        token = resp.cookies["csrftoken"].value
+        self.assertContains(resp, "value='{}'".format(token))
+        self.assertNotContains(resp, CSRF_PLACEHOLDER)
+        other = Client().get("/myapp/")
+        self.assertNotEqual(other.cookies["csrftoken"].value, token)
+        self.assertContains(other, other.cookies["csrftoken"].value)
+        self.assertNotEqual(other["ETag"], resp["ETag"])
+
+    def test_conditional_requests(self):
+        resp = self.client.get("/myapp/")
+        again = self.client.get("/myapp/", HTTP_IF_NONE_MATCH=resp["ETag"])
+        self.assertEqual(again.status_code, 304)
+        # the main page's counts change without a new render, so only
+        # the landing page has a Last-Modified
+        resp = self.client.get("/")
+        again = self.client.get("/", HTTP_IF_MODIFIED_SINCE=resp["Last-Modified"])
+        self.assertEqual(again.status_code, 304)
+        again = self.client.get("/", HTTP_IF_NONE_MATCH='"other"',
+            HTTP_IF_MODIFIED_SINCE=resp["Last-Modified"])
+        self.assertEqual(again.status_code, 200)
+
+    def test_schema_change_renders_again(self):
+        etag = self.client.get("/myapp/")["ETag"]
+        # django hands out the registered class again unless it is unloaded
+        ModelsLoader().unload("Anymodel")
+        ModelsLoader(self.models_json.replace("Rooms title", "Halls title")).load()
+        resp = self.client.get("/myapp/")
+        self.assertContains(resp, "\"anymodel\": [\"Halls title\",")
+        self.assertNotEqual(resp["ETag"], etag)
+
+    def test_reload_clears_cache(self):
+        self.client.get("/myapp/")
+        schema_reloaded.send(sender=SchemaReloader, unloaded=[], loaded=[])
+        self.assertEqual(len(page_cache), 0)
+
+    def test_landing_page(self):
+        resp = self.client.get("/")
+        self.assertContains(resp, "Start here")
+        self.assertEqual(self.client.get("/", HTTP_IF_NONE_MATCH=resp["ETag"]).status_code, 304)
+
+class CountsTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        from .models import Anymodel
+        self.model = Anymodel
+        for i in range(3):
+            Anymodel.objects.create(department="d{}".format(i), spots=i, any_date="2014-01-01")
+        page_cache.clear()
+
+    def counter(self):
+        return EntityCount.objects.get(entity="anymodel").rows
+
+    def test_saves_and_deletes_are_counted(self):
+        self.assertEqual(self.counter(), 3)
+        obj = self.model.objects.get(pk=1)
+        obj.spots = 10
+        obj.save()
+        self.assertEqual(self.counter(), 3)
+        obj.delete()
+        self.assertEqual(self.counter(), 2)
+        self.model.objects.filter(pk=2).delete()
+        self.assertEqual(self.counter(), 1)
+
+    def test_bulk_and_add_views_count(self):
+        self.client.post(
+            "/myapp/anymodel/bulk",
+            json.dumps([{"department": "a", "spots": 1, "any_date": "2010-10-10"},
+                {"department": "b", "spots": 2, "any_date": "2010-10-10"}]),
+            content_type="application/json")
+        self.assertEqual(self.counter(), 5)
+        self.client.post("/myapp/anymodel/add",
+            {"department": "c", "spots": "3", "any_date": "2011-11-11"})
+        self.assertEqual(self.counter(), 6)
+        # rejected rows are not counted
+        self.client.post("/myapp/anymodel/add", {"department": "", "spots": "", "any_date": ""})
+        self.assertEqual(self.counter(), 6)
+        self.assertEqual(self.counter(), self.model.objects.count())
+
+    def test_missing_counter_counts_once(self):
+        EntityCount.objects.all().delete()
+        self.assertEqual(exact_count(self.model), 3)
+        with self.assertNumQueries(1):
+            self.assertEqual(exact_count(self.model), 3)
+
+    def test_list_payload_has_count(self):
+        d = json.loads(self.client.get("/myapp/anymodel?limit=1").content.decode("utf-8"))
+        self.assertEqual(len(d["data"]), 1)
+        self.assertEqual(d["count"], 3)
+        resp = self.client.get("/myapp/anymodel?format=csv")
+        self.assertEqual(resp["X-Total-Count"], "3")
+        # a delete moves the version, the cached list is not served
+        self.model.objects.get(pk=3).delete()
+        d = json.loads(self.client.get("/myapp/anymodel?limit=1").content.decode("utf-8"))
+        self.assertEqual(d["count"], 2)
+
+    def test_counted_queryset(self):
+        queryset = self.model.objects.all()._clone(klass=CountedQuerySet)
+        with self.assertNumQueries(1):
+            self.assertEqual(queryset.count(), 3)
+        # filtered counts still go to the table
+        self.assertEqual(queryset.filter(spots__gt=0).count(), 2)
+        self.assertEqual(queryset[:2].count(), 2)
+
+    def page_counts(self, resp):
+        content = resp.content.decode("utf-8")
+        start = content.index("var counts = ") + len("var counts = ")
+        return json.loads(content[start:content.index(";", start)])
+
+    def test_main_view_counts(self):
+        self.assertEqual(approximate_counts({"anymodel": self.model}), {"anymodel": 3})
+        resp = self.client.get("/myapp/")
+        self.assertEqual(self.page_counts(resp)["anymodel"], 3)
+        self.model.objects.create(department="x", spots=1, any_date="2014-01-01")
+        # the page is not rendered again, only the counts change
+        self.assertEqual(len(page_cache), 1)
+        again = self.client.get("/myapp/", HTTP_IF_NONE_MATCH=resp["ETag"])
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(self.page_counts(again)["anymodel"], 4)
+        self.assertEqual(len(page_cache), 1)
+        self.assertFalse(again.has_header("Last-Modified"))
+
+    def test_reserved_model_name(self):
+        for name in ("entitycount", "entityversion", "entitydeletion"):
+            specs = ModelsLoader('{"%s": {"title": "t", "fields": []}}' % name).get_specs()
+            self.assertEqual(specs, {})
+
+class ProjectionTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+        from .models import Anymodel
+        for i in range(3):
+            Anymodel.objects.create(department="d{}".format(i), spots=i, any_date="2014-01-01")
+
+    def get_json(self, params):
+        resp = self.client.get("/myapp/anymodel", params)
+        return resp.status_code, json.loads(resp.content.decode("utf-8"))
+
+    def test_projected_list(self):
+        status, d = self.get_json({"fields": "spots,department"})
+        self.assertEqual(status, 200)
+        # schema order, the id is always there
+        self.assertEqual([f[0] for f in d["fields"]], ["id", "department", "spots"])
+        self.assertEqual(d["data"][0], {"id": "1", "department": "d0", "spots": "0"})
+
+    def test_select_list_shrinks(self):
+        from .models import Anymodel
+        serializer = get_serializer(Anymodel, ["spots"])
+        sql = str(serializer.values(Anymodel.objects.all()).query)
+        self.assertIn("spots", sql)
+        self.assertNotIn("department", sql)
+        self.assertIs(get_serializer(Anymodel, ["spots"]), serializer)
+        self.assertIs(get_serializer(Anymodel, [f.name for f in visible_fields(Anymodel)]),
+            get_serializer(Anymodel))
+
+    def test_projection_with_pages_and_formats(self):
+        status, d = self.get_json({"fields": "spots", "limit": 2})
+        self.assertEqual(d["next"], 2)
+        self.assertEqual(d["data"], [{"id": "1", "spots": "0"}, {"id": "2", "spots": "1"}])
+        status, d = self.get_json({"fields": "any_date", "format": "columnar"})
+        self.assertEqual(d["columns"], [[1, 2, 3], ["2014-01-01"] * 3])
+        resp = self.client.get("/myapp/anymodel", {"fields": "spots", "format": "csv"})
+        self.assertEqual(resp.content.decode("utf-8").splitlines()[0], "id,spots")
+        resp = self.client.get("/myapp/anymodel", {"fields": "spots", "format": "ndjson", "stream": 1})
+        lines = b"".join(resp.streaming_content).decode("utf-8").splitlines()
+        self.assertEqual(json.loads(lines[1]), [1, 0])
+        resp = self.client.get("/myapp/anymodel/export", {"fields": "department"})
+        self.assertEqual(b"".join(resp.streaming_content).decode("utf-8").splitlines()[1], "1,d0")
+
+    def test_cached_per_projection(self):
+        self.get_json({"fields": "spots"})
+        status, d = self.get_json({"fields": "department"})
+        self.assertEqual(d["data"][0], {"id": "1", "department": "d0"})
+
+    def test_unknown_fields(self):
+        status, d = self.get_json({"fields": "spots,nofield," + STAMP_FIELD})
+        self.assertEqual(status, 400)
+        self.assertEqual(d["fields"], ["Unknown field nofield.", "Unknown field {}.".format(STAMP_FIELD)])
+
+class AdminTest(TestCase):
+    def setUp(self):
+        self.models_json = """
+        {
+        "anymodel": {
+            "title": "Rooms title",
+            "fields": [
+            {"id": "department", "title": "Dept title", "type": "char"},
+            {"id": "spots", "title": "Spots title", "type": "integer"},
+            {"id": "any_date", "title": "Any date title", "type": "date"}
+            ]}
+        }
+        """
+        ModelsLoader(self.models_json).load()
+        call_command("syncdb")
+
+    def test_models_registered_on_first_admin_request(self):
+        from django.contrib import admin
+        from .models import Anymodel
+        if Anymodel in admin.site._registry:
+            admin.site.unregister(Anymodel)
+        resolver = AdminResolver(r"^admin/")
+        self.assertNotIn(Anymodel, admin.site._registry)
+        match = resolver.resolve("admin/myapp/anymodel/")
+        self.assertIn(Anymodel, admin.site._registry)
+        self.assertEqual(match.url_name, "myapp_anymodel_changelist")
+
+    def test_reload_rebuilds_admin_urls(self):
+        from django.contrib import admin
+        resolver = AdminResolver(r"^admin/")
+        resolver.resolve("admin/myapp/anymodel/")
+        with self.assertRaises(NoReverseMatch):
+            resolver.reverse("myapp_adminmodel_changelist")
+        ModelsLoader("""
+        {"adminmodel": {"title": "Admin title", "fields": [
+            {"id": "name", "title": "Name title", "type": "char"}]}}
+        """).load()
+        from .models import Adminmodel, MODELS_MAP
+        try:
+            # the urlconf module is not imported again, the resolver rebuilds
+            schema_reloaded.send(sender=SchemaReloader, unloaded=[], loaded=[Adminmodel])
+            self.assertEqual(resolver.reverse("myapp_adminmodel_changelist"), "myapp/adminmodel/")
+            self.assertIn(Adminmodel, admin.site._registry)
+        finally:
+            del MODELS_MAP["adminmodel"]
+            schema_reloaded.send(sender=SchemaReloader, unloaded=[Adminmodel], loaded=[])
+            ModelsLoader().unload("Adminmodel")
@@ -1,9 +1,16 @@
 from django.conf.urls import patterns, url
-from .views import MainView, EntityView, NewEntityView, UpdateEntityView
+from .views import (MainView, EntityView, NewEntityView, UpdateEntityView,
+    BulkEntityView, BulkUpdateEntityView, AggregateEntityView, ExportEntityView,
+    MetricsView)
 
 urlpatterns = patterns('',
     url(r'^$', MainView.as_view(), name="show_all"),
+    url(r'^metrics$', MetricsView.as_view(), name="metrics"),
     url(r'^(?P<entity>\w+)$', EntityView.as_view(), name="show_entity"),
     url(r'^(?P<entity>\w+)/add', NewEntityView.as_view(), name="new_entity"),
     url(r'^(?P<entity>\w+)/update/(?P<pk>\d+)$', UpdateEntityView.as_view(), name="update_entity"),
+    url(r'^(?P<entity>\w+)/bulk$', BulkEntityView.as_view(), name="bulk_entity"),
+    url(r'^(?P<entity>\w+)/bulk_update$', BulkUpdateEntityView.as_view(), name="bulk_update_entity"),
+    url(r'^(?P<entity>\w+)/aggregate$', AggregateEntityView.as_view(), name="aggregate_entity"),
+    url(r'^(?P<entity>\w+)/export$', ExportEntityView.as_view(), name="export_entity"),
 )
@@ -1,7 +1,16 @@
-from django.views.generic import ListView, TemplateView
+from django.http import HttpResponse
+from django.views.generic import View, ListView, TemplateView
 from django.views.generic.edit import CreateView, UpdateView
-from .mixins import ActionMixin, QuerysetMixin, ValidationMixin
+from .mixins import (ActionMixin, QuerysetMixin, ValidationMixin,
+    BulkCreateMixin, BulkUpdateMixin, AggregateMixin, ExportMixin, CachedPageMixin)
 from .models import MODELS_MAP
+from .metrics import render_metrics
+from .counts import approximate_counts
+import json
+import uuid
+
+# stands in for the row counts in the cached main page
+COUNTS_PLACEHOLDER = "counts{}".format(uuid.uuid4().hex)
 
 class EntityView(QuerysetMixin, ActionMixin, ListView):
     pass
@@ -12,11 +21,40 @@ class NewEntityView(QuerysetMixin, ValidationMixin, ActionMixin, CreateView):
 class UpdateEntityView(QuerysetMixin, ValidationMixin, ActionMixin, UpdateView):
     pass
 
-class MainView(TemplateView):
+class BulkEntityView(QuerysetMixin, BulkCreateMixin, ActionMixin, View):
+    pass
+
+class BulkUpdateEntityView(QuerysetMixin, BulkUpdateMixin, ActionMixin, View):
+    pass
+
+class AggregateEntityView(QuerysetMixin, AggregateMixin, ActionMixin, View):
+    pass
+
+class ExportEntityView(QuerysetMixin, ExportMixin, ActionMixin, View):
+    pass
+
+class CachedTemplateView(CachedPageMixin, TemplateView):
+    pass
+
+class MainView(CachedPageMixin, TemplateView):
     template_name = "myapp/main.html"
+    # the counts change with every write, the page only with the schema
+    use_last_modified = False
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        m = {k: v._meta.verbose_name_plural for k, v in MODELS_MAP.items()}
-        ctx["models_map"] = m
+        # titles come from the specs, no model class is built for them
+        ctx["models_map"] = MODELS_MAP.titles()
+        ctx["models_counts"] = COUNTS_PLACEHOLDER
         return ctx
+
+    # one query on the counters (or the planner stats), no rendering
+    def get_fills(self, content):
+        fills = super().get_fills(content)
+        fills[COUNTS_PLACEHOLDER] = json.dumps(approximate_counts(MODELS_MAP), sort_keys=True)
+        return fills
+
+class MetricsView(View):
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(
+            render_metrics(), content_type="text/plain; version=0.0.4")
@@ -52,12 +52,15 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'myapp.middleware.TimingMiddleware',
+    'myapp.middleware.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'myapp.middleware.SchemaReloadMiddleware',
 )
 
 TEMPLATE_CONTEXT_PROCESSORS = (
@@ -77,6 +80,23 @@ DATABASES = {
     'default': dj_database_url.config()
 }
 
+# read replicas: every DATABASE_URL_<NAME> variable adds a "<name>" alias
+# that entity reads go to (myapp.routers), e.g. locally
+# DATABASE_URL=sqlite:///primary.db DATABASE_URL_REPLICA=sqlite:///replica.db
+REPLICA_DATABASES = []
+for var_name in sorted(os.environ):
+    if var_name.startswith("DATABASE_URL_"):
+        alias = var_name[len("DATABASE_URL_"):].lower()
+        DATABASES[alias] = dj_database_url.config(env=var_name)
+        # tests run against the primary only
+        DATABASES[alias]["TEST_MIRROR"] = "default"
+        REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['myapp.routers.ReplicaRouter']
+
+# seconds a client keeps reading from the primary after it wrote
+REPLICA_PIN_SECONDS = 5
+
 # DATABASES = {
 #     'default': {
 #         'ENGINE': 'django.db.backends.sqlite3',
@@ -109,6 +129,13 @@ STATICFILES_DIRS = (
     #os.path.join(PROJECT_DIR, 'static'),
 )
 
+# collectstatic writes content-hashed names plus .gz (and .br with the
+# brotli package installed) variants, wsgi.py serves them from memory
+STATICFILES_STORAGE = 'myapp.assets.CompressedStaticFilesStorage'
+
+# Cache-Control max-age of files without a content hash in their name
+STATIC_MAX_AGE = 60
+
 # Parse database configuration from $DATABASE_URL
 
 # Honor the 'X-Forwarded-Proto' header for request.is_secure()
@@ -119,6 +146,21 @@ ALLOWED_HOSTS = ['*']
 
 JSON_FILE_NAME = "models.json"
 
+# how often (seconds) a worker checks models.json for changes
+SCHEMA_RELOAD_INTERVAL = 2
+
+# where the parsed models.json is cached between boots, None turns it off
+SCHEMA_CACHE_DIR = os.path.join(BASE_DIR, "myapp", "__pycache__")
+
+# the CACHES alias holding cached list responses and entity versions,
+# share one between workers (memcached, redis); without it each worker
+# keeps a bounded local-memory cache
+ENTITY_CACHE_BACKEND = "myapp"
+
+# registering the models in the admin builds every model class, that
+# happens on the first admin request; False keeps them out of the admin
+ADMIN_REGISTER_MODELS = True
+
 try:
     from local_settings import *
 except Exception as e:
@@ -1,12 +1,13 @@
 from django.conf.urls import patterns, include, url
 
-from django.views.generic import TemplateView
+from myapp.views import CachedTemplateView
+from myapp.admin import AdminResolver
 
 from django.contrib import admin
 admin.autodiscover()
 
 urlpatterns = patterns('',
-    url(r'^$', TemplateView.as_view(template_name="myproject/main_page.html")),
-    url(r'^admin/', include(admin.site.urls)),
+    url(r'^$', CachedTemplateView.as_view(template_name="myproject/main_page.html")),
+    AdminResolver(r'^admin/'),
     url(r'^myapp/', include("myapp.urls", namespace="myapp")),
 )
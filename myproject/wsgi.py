@@ -11,7 +11,8 @@ import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "myproject.settings")
 
 from django.core.wsgi import get_wsgi_application
-from dj_static import Cling
+from myapp.assets import StaticFilesApp
 #application = get_wsgi_application()
 
-application = Cling(get_wsgi_application())
\ No newline at end of file
+# static files are served from memory, see myapp.assets
+application = StaticFilesApp(get_wsgi_application())